@@ -8,8 +8,12 @@ from pyyaap.app.workers import FingerpintCrawler
 from pyyaap.config.app import SUPPORTED_EXTENSIONS
 
 
-CRAWLER_CFG = {}
 TARGET_DIR = '/audio/raw'
+# kept in the container, outside the read-only audio storage
+MANIFEST_PATH = '/app/crawler_manifest.json'
+# peaks of the crawled files, so a rebuilt index or new hash parameters skip decoding
+PEAK_CACHE_PATH = '/app/peak_cache'
+CRAWLER_CFG = {'manifest_path': MANIFEST_PATH, 'peak_cache_path': PEAK_CACHE_PATH}
 
 
 def run_crawling_session():
@@ -9,22 +9,28 @@ from typing import Dict, List, Tuple
 
 from pyyaap.utils import get_chunk, get_connection
 import pyyaap.codec.decode as audio_codec
-from pyyaap.app.core.db import PostgreSQLDatabase
-from pyyaap.app.workers import AudioRecognizer
+from pyyaap.app.core.db import AsyncPostgreSQLDatabase
+from pyyaap.app.workers import AsyncAudioRecognizer
 from config import (
     RAW_AUDIO_DIRECTORY_PATH, 
     PROCESSED_AUDIO_EXTENSIONS,
     PROCESSED_AUDIO_DIRECTORY_PATH,
+    SERVER_ALIGNMENT,
+    MATCH_PARTITIONS,
 )
 
 
 routes = web.RouteTableDef()
 
-RECOGNIZER_CFG = {  }
-DB_CONNECTOR = PostgreSQLDatabase(
-    **get_connection()
+# long uploads are fingerprinted in time segments over every core, matches are aligned by PostgreSQL
+# unless SERVER_ALIGNMENT is off, then in Python over MATCH_PARTITIONS connections
+RECOGNIZER_CFG = {'segment_workers': os.cpu_count(), 'server_alignment': SERVER_ALIGNMENT}
+# the event loop only awaits the database, decoding and fingerprinting run on threads
+DB_CONNECTOR = AsyncPostgreSQLDatabase(
+    match_partitions=MATCH_PARTITIONS, **get_connection()
 )
-recognizer = AudioRecognizer(RECOGNIZER_CFG, DB_CONNECTOR)
+# created with the application, the processes of its segment pool import this module
+RECOGNIZER = web.AppKey("recognizer", AsyncAudioRecognizer)
 
 
 @routes.get('/')
@@ -111,7 +117,7 @@ async def recognize(request: web.Request) -> web.Response:
             size += tmp.write(chunk)
 
         with open(tmp.name, 'rb') as buff:
-            results = recognizer.recognize(type='file', payload=buff, ext=name.split('.')[-1])
+            results = await request.app[RECOGNIZER].recognize(type='file', payload=buff, ext=name.split('.')[-1])
     
     return web.json_response(results)
 
@@ -122,6 +128,23 @@ if __name__ == '__main__':
     app = web.Application()
     app.add_routes(routes)
 
+    async def connect_database(app: web.Application) -> None:
+        await DB_CONNECTOR.connect()
+
+    async def close_database(app: web.Application) -> None:
+        await DB_CONNECTOR.close()
+
+    async def start_recognizer(app: web.Application) -> None:
+        app[RECOGNIZER] = AsyncAudioRecognizer(RECOGNIZER_CFG, DB_CONNECTOR)
+
+    async def stop_recognizer(app: web.Application) -> None:
+        app[RECOGNIZER].close()
+
+    app.on_startup.append(connect_database)
+    app.on_startup.append(start_recognizer)
+    app.on_cleanup.append(stop_recognizer)
+    app.on_cleanup.append(close_database)
+
     # Configure CORS on all routes.
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
@@ -1,3 +1,12 @@
+import os
+
 RAW_AUDIO_DIRECTORY_PATH = '/audio/raw'
 PROCESSED_AUDIO_DIRECTORY_PATH = '/audio/raw'
 PROCESSED_AUDIO_EXTENSIONS = ['mp3', 'mpeg', 'ogg', 'wav']
+
+# align matches in PostgreSQL, only the best candidates are transferred; 0 aligns them in Python
+SERVER_ALIGNMENT = os.getenv('SERVER_ALIGNMENT', '1').lower() not in ('0', 'false', 'no')
+
+# connections a large match search is split over and queried on concurrently,
+# when matches are aligned in Python (SERVER_ALIGNMENT=0)
+MATCH_PARTITIONS = int(os.getenv('MATCH_PARTITIONS', 4))
@@ -0,0 +1,78 @@
+"""
+Matching time and rows transferred of the Python alignment (`return_matches` then
+`AudioRecognizer.align_matches`) and of the server-side one (`return_aligned_matches`)
+against a local PostgreSQL.
+
+    POSTGRES_DB=... POSTGRES_USER=... POSTGRES_PASSWORD=... POSTGRES_HOST=localhost POSTGRES_PORT=5432 \\
+        python benchmarks/bench_align.py [--audios 200] [--hashes 20000] [--popular 0.01]
+                                         [--query 2000 10000] [--repeat 3]
+
+Scratch audios of random fingerprints are inserted and deleted afterwards; a share of
+their hashes is drawn from a small popular set, as silence and tones produce in real
+catalogues. Every query is an excerpt of one of them, shifted in time, and both paths
+must find it first with the same count.
+"""
+import argparse
+
+import numpy as np
+
+from pyyaap.app.core.db import PostgreSQLDatabase
+from pyyaap.app.workers.recognizer import AudioRecognizer
+from pyyaap.matching.signal.hashes import Fingerprints
+from pyyaap.utils import get_connection
+from common import make_fingerprints, timeit
+
+
+def make_query(rng: np.random.Generator, fingerprints: Fingerprints, n_rows: int, shift: int) -> Fingerprints:
+    excerpt = fingerprints.data[rng.choice(len(fingerprints), min(n_rows, len(fingerprints)), replace=False)]
+    return Fingerprints.from_arrays(excerpt["hash"], excerpt["offset"] - shift)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audios", type=int, default=200)
+    parser.add_argument("--hashes", type=int, default=20_000, help="fingerprints per audio")
+    parser.add_argument("--popular", type=float, default=0.01, help="share of popular hashes")
+    parser.add_argument("--query", type=int, nargs="+", default=[2_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db = PostgreSQLDatabase(**get_connection())
+    db.setup()
+    recognizer = AudioRecognizer({}, db)
+    rng = np.random.default_rng(0)
+
+    audio_ids, catalogue = [], []
+    try:
+        for index in range(args.audios):
+            fingerprints = make_fingerprints(args.hashes, rng, offset_bits=15, popular=args.popular)
+            audio_id = db.insert_audio(f"bench_align_{index}", "00", len(fingerprints))
+            db.insert_hashes(audio_id, fingerprints)
+            audio_ids.append(audio_id)
+            catalogue.append(fingerprints)
+
+        print(f"{'query':>8} {'rows, python':>13} {'rows, sql':>10} {'python, s':>10} {'sql, s':>8} {'speed-up':>9}")
+        for n_rows in args.query:
+            target = rng.integers(len(audio_ids))
+            query = make_query(rng, catalogue[target], n_rows, shift=100)
+
+            def python_path():
+                matches, dedup_hashes = db.return_matches(query)
+                python_path.rows = sum(dedup_hashes.values())
+                python_path.results = recognizer.align_matches(matches, dedup_hashes, len(query))
+
+            def sql_path():
+                sql_path.candidates, dedup_hashes = db.return_aligned_matches(query)
+                sql_path.results = recognizer.describe_matches(sql_path.candidates, dedup_hashes, len(query))
+
+            python_time = timeit(python_path, args.repeat)
+            sql_time = timeit(sql_path, args.repeat)
+
+            assert python_path.results == sql_path.results, "Results differ"
+            best_id, best_offset, _ = sql_path.candidates[0]
+            assert best_id == audio_ids[target] and best_offset == 100, "Excerpt not found first"
+            print(
+                f"{n_rows:>8} {python_path.rows:>13,} {len(sql_path.candidates):>10} "
+                f"{python_time:>10.4f} {sql_time:>8.4f} {python_time / sql_time:>8.1f}x"
+            )
+    finally:
+        db.delete_audios_by_id(audio_ids)
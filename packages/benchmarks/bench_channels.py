@@ -0,0 +1,48 @@
+"""
+Hash count and fingerprinting time of the channel strategies on stereo material.
+
+    python benchmarks/bench_channels.py [--seconds 180] [--repeat 3] [--spec-engine scipy]
+
+Two records are used: a wide stereo one, whose right channel only shares part
+of the left one, and a dual mono one (identical channels, as many encoded
+files are). `kept` is the share of the per-channel hashes the strategy still
+produces; 'batched' must reproduce them exactly.
+"""
+import argparse
+
+import numpy as np
+
+from pyyaap.matching.signal.fingerprint import fingerprint_channels
+from common import synthetic_signal, timeit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=180)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--spec-engine", default="scipy")
+    args = parser.parse_args()
+
+    left = synthetic_signal(args.seconds, seed=0)
+    records = {
+        "wide stereo": [left, (0.7 * left + 0.3 * synthetic_signal(args.seconds, seed=1)).astype(np.int16)],
+        "dual mono": [left, left.copy()],
+    }
+
+    print(f"{'record':>12} {'strategy':>12} {'hashes':>9} {'kept':>7} {'time, s':>9} {'saved':>7}")
+    for record, channels in records.items():
+        reference = fingerprint_channels(channels, "per_channel", spec_engine=args.spec_engine)
+        reference_set = set(reference.hashes.tolist())
+        baseline = None
+        for strategy in ("per_channel", "mono", "batched"):
+            fingerprints = fingerprint_channels(channels, strategy, spec_engine=args.spec_engine)
+            if strategy == "batched":
+                assert np.array_equal(fingerprints.data, reference.data)
+
+            elapsed = timeit(lambda: fingerprint_channels(channels, strategy, spec_engine=args.spec_engine), args.repeat)
+            baseline = baseline or elapsed
+            kept = len(reference_set & set(fingerprints.hashes.tolist())) / len(reference_set)
+            print(
+                f"{record:>12} {strategy:>12} {len(fingerprints):>9} {kept:>7.1%} "
+                f"{elapsed:>9.3f} {1 - elapsed / baseline:>7.1%}"
+            )
@@ -0,0 +1,216 @@
+"""
+Wall time, CPU time, peak RSS and bytes read of every decoding provider.
+
+    python benchmarks/bench_decode.py [--seconds 10 60 300] [--channels 1 2] [--limits 0 10]
+                                      [--providers WAVCodec FFmpegCodec PyDubCodec]
+                                      [--repeat 3] [--json results.json]
+
+Synthetic WAV files of every duration and channel count are written to a temporary
+directory and encoded to MP3 and OGG with ffmpeg (only WAV is benchmarked without it).
+Every provider registered in `pyyaap.codec.decode`, plus the ones given, decodes every
+file it supports, once per limit (0 meaning the whole file). Each decode runs in a
+fresh interpreter so peak RSS is its own; the figures are:
+
+    wall, cpu     best of `repeat`, cpu including child processes such as ffmpeg
+    peak_rss      high-water mark of the interpreter, and of its children (an upper
+                  bound, as it may carry the mark of the worker); rss_before is the
+                  mark once the provider is imported, before decoding
+    bytes_read    bytes pulled through the file object, hashing included
+
+Every sample of the decoded channels is summed before the clock stops, so providers
+returning lazily mapped views pay for their pages like the others.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import scipy.io.wavfile as wavfile
+
+from pyyaap.codec.decode import REGISTERED_CODECS, providers
+from pyyaap.codec.decode.providers.ffmpeg import FFMPEG_BINARY
+from common import synthetic_signal
+
+
+FRAMERATE = 44100
+ENCODINGS = {
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "192k"],
+    "ogg": ["-c:a", "libvorbis", "-q:a", "5"],
+}
+
+
+class CountingReader:
+    """
+    Passes reads through to a file object and counts the bytes they return.
+    """
+    def __init__(self, fd):
+        self._fd = fd
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self._fd.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def readinto(self, buffer):
+        n_bytes = self._fd.readinto(buffer)
+        self.bytes_read += n_bytes or 0
+        return n_bytes
+
+    def __getattr__(self, name):
+        return getattr(self._fd, name)
+
+
+def peak_rss() -> int:
+    """
+    High-water mark of the resident set in bytes. `ru_maxrss` survives `exec`, so a worker
+    would inherit the mark of the benchmark that spawned it; /proc resets it with the program.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measure(provider: str, path: str, ext: str, limit: float) -> dict:
+    codec = getattr(providers, provider)
+    rss_before = peak_rss()
+    with open(path, "rb") as fd:
+        reader = CountingReader(fd)
+        times = os.times()
+        start = perf_counter()
+
+        record = codec.read(reader, ext=ext, limit=limit or None)
+        n_frames = len(record.channels[0])
+        checksum = sum(float(np.sum(channel, dtype=np.float64)) for channel in record.channels)
+
+        wall = perf_counter() - start
+        cpu = sum(os.times()[:4]) - sum(times[:4])
+        del record
+
+    return {
+        "wall": wall,
+        "cpu": cpu,
+        "rss_before": rss_before,
+        "peak_rss": peak_rss(),
+        "peak_rss_children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        "bytes_read": reader.bytes_read,
+        "frames": n_frames,
+        "checksum": checksum,
+    }
+
+def run_isolated(provider: str, path: str, ext: str, limit: float) -> dict:
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker", provider, path, ext, str(limit)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+def write_inputs(directory: str, durations, channel_counts):
+    """
+    :return: a list of (path, ext, seconds, channels); encoded formats are skipped without ffmpeg.
+    """
+    inputs = []
+    for seconds in durations:
+        for n_channels in channel_counts:
+            signal = np.stack([
+                synthetic_signal(seconds, freq=FRAMERATE, seed=ch) for ch in range(n_channels)
+            ], axis=1)
+            wav_path = os.path.join(directory, f"{seconds}s_{n_channels}ch.wav")
+            wavfile.write(wav_path, FRAMERATE, signal)
+            inputs.append((wav_path, "wav", seconds, n_channels))
+
+            for ext, options in ENCODINGS.items():
+                path = wav_path[:-len("wav")] + ext
+                try:
+                    subprocess.run(
+                        [FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-y", "-i", wav_path, *options, path],
+                        check=True, capture_output=True
+                    )
+                except (OSError, subprocess.CalledProcessError) as e:
+                    print(f"Skipping {os.path.basename(path)}, could not encode it: {e}", file=sys.stderr)
+                    continue
+                if not os.path.isfile(path):
+                    print(f"Skipping {os.path.basename(path)}, ffmpeg wrote nothing", file=sys.stderr)
+                    continue
+                inputs.append((path, ext, seconds, n_channels))
+    return inputs
+
+def available_providers(names):
+    found = []
+    for name in names:
+        try:
+            found.append((name, getattr(providers, name)))
+        except ImportError as e:
+            print(f"Skipping {name}: {e}", file=sys.stderr)
+    return found
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        provider, path, ext, limit = sys.argv[2:6]
+        print(json.dumps(measure(provider, path, ext, float(limit))))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, nargs="+", default=[10, 60, 300])
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--limits", type=float, nargs="+", default=[0, 10])
+    parser.add_argument("--providers", nargs="*", default=["PyDubCodec"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="file the results are written to as JSON")
+    args = parser.parse_args()
+
+    names = list(dict.fromkeys([*REGISTERED_CODECS.values(), *args.providers]))
+    codecs = available_providers(names)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = write_inputs(directory, args.seconds, args.channels)
+
+        print(
+            f"{'provider':>12} {'format':>6} {'input':>8} {'limit':>6} {'wall, s':>9} {'cpu, s':>9} "
+            f"{'base, MB':>9} {'rss, MB':>9} {'child, MB':>9} {'read, MB':>9}"
+        )
+        for name, codec in codecs:
+            for path, ext, seconds, n_channels in inputs:
+                if ext not in codec.SUPPORTED_FORMATS:
+                    continue
+                for limit in args.limits:
+                    try:
+                        runs = [run_isolated(name, path, ext, limit) for _ in range(args.repeat)]
+                    except subprocess.CalledProcessError as e:
+                        print(f"{name} failed on {os.path.basename(path)}: {e.stderr.strip().splitlines()[-1:]}", file=sys.stderr)
+                        continue
+
+                    result = {
+                        "provider": name, "format": ext, "seconds": seconds, "channels": n_channels,
+                        "limit": limit or None, "file_size": os.path.getsize(path),
+                        "wall": min(run["wall"] for run in runs),
+                        "cpu": min(run["cpu"] for run in runs),
+                        "rss_before": max(run["rss_before"] for run in runs),
+                        "peak_rss": max(run["peak_rss"] for run in runs),
+                        "peak_rss_children": max(run["peak_rss_children"] for run in runs),
+                        "bytes_read": runs[0]["bytes_read"],
+                        "frames": runs[0]["frames"],
+                    }
+                    results.append(result)
+
+                    print(
+                        f"{name:>12} {ext:>6} {f'{seconds}s/{n_channels}ch':>8} {limit or '-':>6} "
+                        f"{result['wall']:>9.4f} {result['cpu']:>9.4f} "
+                        f"{result['rss_before'] / 2**20:>9.1f} {result['peak_rss'] / 2**20:>9.1f} {result['peak_rss_children'] / 2**20:>9.1f} "
+                        f"{result['bytes_read'] / 2**20:>9.1f}"
+                    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,75 @@
+"""
+Wall time of `PostgreSQLDatabase.return_matches` against a local PostgreSQL as the hashes
+of a search are split over more connections queried concurrently.
+
+    POSTGRES_DB=... POSTGRES_USER=... POSTGRES_PASSWORD=... POSTGRES_HOST=localhost POSTGRES_PORT=5432 \\
+        python benchmarks/bench_fanout.py [--audios 100] [--hashes 20000] [--query 2000 20000]
+                                          [--partitions 1 2 4 8] [--repeat 5]
+
+Scratch audios of random fingerprints are inserted, analysed, and deleted afterwards.
+Partitions only overlap as far as the server has cores to run them on, and searches
+below 2 * DB_MATCH_PARTITION_MIN hashes are not split at all.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from pyyaap.app.core.db import PostgreSQLDatabase
+from pyyaap.config.app import FINGERPRINTS_TABLENAME
+from pyyaap.matching.signal.hashes import Fingerprints
+from pyyaap.utils import get_connection
+from common import make_fingerprints, timeit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audios", type=int, default=100)
+    parser.add_argument("--hashes", type=int, default=20_000, help="fingerprints per audio")
+    parser.add_argument("--query", type=int, nargs="+", default=[2_000, 20_000])
+    parser.add_argument("--partitions", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = PostgreSQLDatabase(**get_connection())
+    db.setup()
+    rng = np.random.default_rng(0)
+
+    audio_ids = []
+    try:
+        catalogue = []
+        for index in range(args.audios):
+            fingerprints = make_fingerprints(args.hashes, rng, hash_bits=24, offset_bits=15)
+            audio_id = db.insert_audio(f"bench_fanout_{index}", "00", len(fingerprints))
+            db.insert_hashes(audio_id, fingerprints)
+            audio_ids.append(audio_id)
+            catalogue.append(fingerprints.hashes)
+        catalogue = np.concatenate(catalogue)
+        with db.cursor() as cur:
+            cur.execute(f'ANALYZE "{FINGERPRINTS_TABLENAME}";')
+
+        print(f"client cores: {os.cpu_count()}")
+        print(f"{'query':>7} {'partitions':>11} {'wall, ms':>9} {'speed-up':>9}")
+        for n_rows in args.query:
+            # half of the hashes are known to the catalogue
+            query = Fingerprints.from_arrays(
+                np.concatenate([rng.choice(catalogue, n_rows // 2), rng.integers(0, 2**24, n_rows - n_rows // 2, dtype=np.uint64)]),
+                rng.integers(0, 2**10, n_rows, dtype=np.int32)
+            )
+
+            expected, baseline = None, None
+            for n_partitions in args.partitions:
+                partitioned = PostgreSQLDatabase(
+                    match_partitions=n_partitions, max_size=max(n_partitions, 1), **get_connection()
+                )
+                matches, dedup_hashes = partitioned.return_matches(query)
+                if expected is None:
+                    expected = sorted(matches), dedup_hashes
+                assert (sorted(matches), dedup_hashes) == expected, "Partitioned matches differ"
+
+                wall = timeit(lambda: partitioned.return_matches(query), args.repeat)
+                baseline = baseline or wall
+                print(f"{n_rows:>7} {n_partitions:>11} {wall * 1000:>9.2f} {baseline / wall:>8.2f}x")
+                partitioned.pool.closeall()
+    finally:
+        db.delete_audios_by_id(audio_ids)
@@ -0,0 +1,60 @@
+"""
+Compares the reference combinatorial hashing loop with the vectorized engine.
+
+    python benchmarks/bench_hashing.py [--repeat 3]
+
+Peaks for the 10 s and 3 min inputs come from the spectrogram of a synthetic
+signal; the 60 min constellation is the 3 min one tiled in time, which keeps
+the peak density realistic without holding an hour-long spectrogram in memory.
+"""
+import argparse
+
+import numpy as np
+
+from pyyaap.matching.signal.fingerprint import (
+    _get_audio_spectrogram, _get_spectrogram_local_peaks,
+    _get_combinatorial_hashes, _get_combinatorial_hash_arrays
+)
+from common import synthetic_signal, timeit
+
+
+def get_peaks(seconds: float):
+    with np.errstate(divide='ignore'):
+        return _get_spectrogram_local_peaks(_get_audio_spectrogram(synthetic_signal(seconds)))
+
+def tile_peaks(f: np.ndarray, t: np.ndarray, n_frames: int, times: int):
+    return (
+        np.tile(f, times),
+        np.concatenate([t + i * n_frames for i in range(times)])
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    short_peaks = get_peaks(10)
+    long_peaks = get_peaks(180)
+    n_frames = int(long_peaks[1].max()) + 1
+
+    inputs = [
+        ("10 s", short_peaks),
+        ("3 min", long_peaks),
+        ("60 min", tile_peaks(*long_peaks, n_frames, 20)),
+    ]
+
+    print(f"{'input':>8} {'peaks':>10} {'hashes':>10} {'loop, s':>10} {'numpy, s':>10} {'speed-up':>10}")
+    for label, (f, t) in inputs:
+        peaks = list(zip(f, t))
+        hashes, offsets = _get_combinatorial_hash_arrays(f, t)
+
+        assert _get_combinatorial_hashes(list(peaks)) == list(zip(hashes.tolist(), offsets.tolist())), \
+            "Vectorized hashes differ from the reference loop"
+
+        loop_time = timeit(lambda: _get_combinatorial_hashes(list(peaks)), args.repeat)
+        numpy_time = timeit(lambda: _get_combinatorial_hash_arrays(f, t), args.repeat)
+
+        print(
+            f"{label:>8} {len(peaks):>10} {len(hashes):>10} "
+            f"{loop_time:>10.4f} {numpy_time:>10.4f} {loop_time / numpy_time:>9.1f}x"
+        )
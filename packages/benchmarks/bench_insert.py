@@ -0,0 +1,62 @@
+"""
+Fingerprint ingest rate of `insert_hashes` against a local PostgreSQL: the former
+`executemany` of INSERT batches and the binary COPY of `PostgreSQLDatabase`.
+
+    POSTGRES_DB=... POSTGRES_USER=... POSTGRES_PASSWORD=... POSTGRES_HOST=localhost POSTGRES_PORT=5432 \\
+        python benchmarks/bench_insert.py [--rows 10000 100000 1000000] [--repeat 3]
+
+Tables are created if missing; every run inserts into a scratch audio that is
+deleted afterwards (its fingerprints go with it), and the row counts are checked.
+executemany is skipped above --max-executemany rows, it would take minutes.
+"""
+import argparse
+from time import perf_counter
+
+from pyyaap.app.core.db import PostgreSQLDatabase
+from pyyaap.app.core.db.base import CommonDatabase
+from pyyaap.config.app import FIELD_AUDIO_ID, FINGERPRINTS_TABLENAME
+from pyyaap.matching.signal.hashes import Fingerprints
+from pyyaap.utils import get_connection
+from common import make_fingerprints
+
+
+def count_rows(db: PostgreSQLDatabase, audio_id: int) -> int:
+    with db.cursor() as cur:
+        cur.execute(
+            f'SELECT COUNT(*) FROM "{FINGERPRINTS_TABLENAME}" WHERE "audio_{FIELD_AUDIO_ID}" = %s;', (audio_id,)
+        )
+        return cur.fetchone()[0]
+
+def rows_per_second(db: PostgreSQLDatabase, insert, fingerprints: Fingerprints, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        audio_id = db.insert_audio("bench_insert", "00", len(fingerprints))
+        try:
+            t = perf_counter()
+            insert(db, audio_id, fingerprints)
+            best = min(best, perf_counter() - t)
+            assert count_rows(db, audio_id) == len(fingerprints), "Rows missing after insert"
+        finally:
+            db.delete_audios_by_id([audio_id])
+    return len(fingerprints) / best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--max-executemany", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db = PostgreSQLDatabase(**get_connection())
+    db.setup()
+
+    print(f"{'rows':>10} {'executemany, rows/s':>20} {'COPY, rows/s':>14} {'speed-up':>9}")
+    for n_rows in args.rows:
+        fingerprints = make_fingerprints(n_rows)
+
+        copy_rate = rows_per_second(db, PostgreSQLDatabase.insert_hashes, fingerprints, args.repeat)
+        if n_rows <= args.max_executemany:
+            insert_rate = rows_per_second(db, CommonDatabase.insert_hashes, fingerprints, args.repeat)
+            print(f"{n_rows:>10} {insert_rate:>20,.0f} {copy_rate:>14,.0f} {copy_rate / insert_rate:>8.1f}x")
+        else:
+            print(f"{n_rows:>10} {'-':>20} {copy_rate:>14,.0f} {'-':>9}")
@@ -0,0 +1,107 @@
+"""
+Cost of fetching the fingerprints of a query against a local PostgreSQL: the former
+`IN (%s, %s, ...)` batches of 1000 hashes, and the prepared `= ANY(array)` statement
+of `PostgreSQLDatabase` with 1000 hash batches and with adapted ones.
+
+    POSTGRES_DB=... POSTGRES_USER=... POSTGRES_PASSWORD=... POSTGRES_HOST=localhost POSTGRES_PORT=5432 \\
+        python benchmarks/bench_match_query.py [--audios 100] [--hashes 20000] [--query 2000 20000] [--repeat 5]
+
+Scratch audios of random fingerprints are inserted, analysed, and deleted afterwards. Besides the
+wall time of a search, the planning time PostgreSQL reports for each of its statements
+is summed with EXPLAIN ANALYZE; IN statements are parsed anew on top of it, which only
+the wall time shows.
+"""
+import argparse
+import json
+
+import numpy as np
+
+from pyyaap.app.core.db import PostgreSQLDatabase
+from pyyaap.app.core.db.base import CommonDatabase
+from pyyaap.app.core.db.pgclient import array_literal
+from pyyaap.config.app import FINGERPRINTS_TABLENAME
+from pyyaap.utils import get_connection
+from common import make_fingerprints, timeit
+
+
+def planning_time(cur, statements) -> float:
+    """
+    :param statements: (query, parameters) pairs.
+    :return: the planning time PostgreSQL reports for all of them, in seconds.
+    """
+    total = 0
+    for query, parameters in statements:
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query.strip(), parameters)
+        plan = cur.fetchone()[0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        total += plan[0]["Planning Time"] / 1000
+    return total
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audios", type=int, default=100)
+    parser.add_argument("--hashes", type=int, default=20_000, help="fingerprints per audio")
+    parser.add_argument("--query", type=int, nargs="+", default=[2_000, 20_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = PostgreSQLDatabase(**get_connection())
+    db.setup()
+    rng = np.random.default_rng(0)
+
+    audio_ids = []
+    try:
+        catalogue = []
+        for index in range(args.audios):
+            fingerprints = make_fingerprints(args.hashes, rng, hash_bits=24, offset_bits=15)
+            audio_id = db.insert_audio(f"bench_match_query_{index}", "00", len(fingerprints))
+            db.insert_hashes(audio_id, fingerprints)
+            audio_ids.append(audio_id)
+            catalogue.append(fingerprints.hashes)
+        catalogue = np.concatenate(catalogue)
+        with db.cursor() as cur:
+            cur.execute(f'ANALYZE "{FINGERPRINTS_TABLENAME}";')
+
+        print(
+            f"{'query':>7} {'path':>16} {'statements':>11} {'plan, ms':>9} {'wall, ms':>9} {'rows':>8}"
+        )
+        for n_rows in args.query:
+            # half of the hashes are known to the catalogue
+            values = sorted(set(np.concatenate([
+                rng.choice(catalogue, n_rows // 2), rng.integers(0, 2**24, n_rows - n_rows // 2, dtype=np.uint64)
+            ]).tolist()))
+
+            in_batches = [values[index: index + 1000] for index in range(0, len(values), 1000)]
+            paths = {
+                "IN, 1000": (
+                    lambda cur: CommonDatabase._select_matches(db, cur, values, 1000),
+                    [(db.SELECT_MULTIPLE % ', '.join([db.IN_MATCH] * len(batch)), batch) for batch in in_batches],
+                ),
+                "ANY, 1000": (
+                    lambda cur: db._select_matches(cur, values, 1000),
+                    [(db.EXECUTE_SELECT_MATCHES, (array_literal(batch),)) for batch in in_batches],
+                ),
+                "ANY, adaptive": (
+                    lambda cur: db._select_matches(cur, values),
+                    None,
+                ),
+            }
+
+            for name, (select, statements) in paths.items():
+                with db.cursor() as cur:
+                    n_matches = sum(1 for _ in select(cur))
+                    wall = timeit(lambda: sum(1 for _ in select(cur)), args.repeat)
+                    if statements is None:
+                        size = db.match_batch_size
+                        statements = [
+                            (db.EXECUTE_SELECT_MATCHES, (array_literal(values[index: index + size]),))
+                            for index in range(0, len(values), size)
+                        ]
+                    plan = planning_time(cur, statements)
+
+                print(
+                    f"{n_rows:>7} {name:>16} {len(statements):>11} {plan * 1000:>9.2f} "
+                    f"{wall * 1000:>9.2f} {n_matches:>8}"
+                )
+    finally:
+        db.delete_audios_by_id(audio_ids)
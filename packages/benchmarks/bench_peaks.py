@@ -0,0 +1,55 @@
+"""
+Peak picking: the former dilate-and-compare path against the current engines.
+
+    python benchmarks/bench_peaks.py [--seconds 60] [--repeat 5]
+
+`cv2 (old)` compares with the dilated image in the logical (frequencies, frames)
+layout and thresholds afterwards, `cv2` and `vhgw` fuse the threshold in the
+mask and scan the spectrogram in memory order. Every engine must return
+exactly the reference peaks.
+"""
+import argparse
+
+import cv2
+import numpy as np
+
+from pyyaap.config.fingerprint import FP_PEAK_MIN_AMP, FP_PEAK_WIN_SIZE
+from pyyaap.matching.signal.fingerprint import _get_spectrogram_local_peaks
+from pyyaap.matching.signal.spectrogram import SPECTROGRAM_ENGINES
+from common import synthetic_signal, timeit
+
+
+def legacy_peaks(spectrogram: np.ndarray):
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (FP_PEAK_WIN_SIZE, FP_PEAK_WIN_SIZE))
+    peak_map = spectrogram == cv2.dilate(spectrogram, kernel, iterations=1)
+    amps = spectrogram[peak_map].flatten()
+    f, t = np.where(peak_map)
+    keep = amps > FP_PEAK_MIN_AMP
+    return f[keep], t[keep]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    np.seterr(divide='ignore')
+    signal = synthetic_signal(args.seconds)
+
+    candidates = {
+        "cv2 (old)": legacy_peaks,
+        "cv2": lambda spectrogram: _get_spectrogram_local_peaks(spectrogram, peak_engine="cv2"),
+        "vhgw": lambda spectrogram: _get_spectrogram_local_peaks(spectrogram, peak_engine="vhgw"),
+    }
+
+    print(f"{'spectrogram':>20} {'engine':>10} {'time, s':>10} {'speedup':>8}")
+    for spec_name in ("scipy", "rfft", "rfft32"):
+        spectrogram = SPECTROGRAM_ENGINES[spec_name].compute(signal)
+        reference = legacy_peaks(spectrogram)
+        baseline = None
+        for name, candidate in candidates.items():
+            assert all(np.array_equal(a, b) for a, b in zip(reference, candidate(spectrogram))), name
+            elapsed = timeit(lambda: candidate(spectrogram), args.repeat)
+            baseline = baseline or elapsed
+            print(f"{spec_name + ' ' + str(spectrogram.dtype):>20} {name:>10} {elapsed:>10.4f} {baseline / elapsed:>7.2f}x")
@@ -0,0 +1,100 @@
+"""
+Recall against CPU time of fingerprinting at the native framerate and at lower analysis rates.
+
+    python benchmarks/bench_resample.py [--tracks 20] [--seconds 60] [--query 8] [--snr 10]
+
+A library of stereo synthetic tracks is fingerprinted in every mode, then noisy
+excerpts at random positions are matched against it the way `align_matches`
+does: a query is recalled when the most voted (track, offset difference) is
+the right track within one frame of the true position. CPU time covers
+decoding-side work (downmix, resampling) and fingerprinting of library and queries.
+"""
+import argparse
+from time import process_time
+
+import numpy as np
+
+from pyyaap.codec.decode.utils import downmix
+from pyyaap.config.fingerprint import FP_SPEC_FREQ, FP_SPEC_OVERLAP, FP_SPEC_WIN_SIZE
+from pyyaap.matching.signal.fingerprint import fingerprint
+from pyyaap.matching.signal.hashes import Fingerprints
+from common import synthetic_signal
+
+
+def fingerprint_record(channels, analysis_freq):
+    if analysis_freq is None:
+        return Fingerprints.union(*[fingerprint(channel, freq=FP_SPEC_FREQ) for channel in channels])
+    return fingerprint(downmix(channels), freq=FP_SPEC_FREQ, analysis_freq=analysis_freq).unique()
+
+def best_match(library, query):
+    hashes, offsets, track_ids = library
+    lo = np.searchsorted(hashes, query.hashes, side="left")
+    hi = np.searchsorted(hashes, query.hashes, side="right")
+    counts = hi - lo
+    if not counts.sum():
+        return None, None
+
+    positions = np.repeat(lo - np.cumsum(np.r_[0, counts[:-1]]), counts) + np.arange(counts.sum())
+    differences = offsets[positions].astype(np.int64) - np.repeat(query.offsets.astype(np.int64), counts)
+    votes, n_votes = np.unique(np.stack([track_ids[positions], differences]), axis=1, return_counts=True)
+    track_id, difference = votes[:, n_votes.argmax()]
+    return track_id, difference
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--query", type=float, default=8, help="query length in seconds")
+    parser.add_argument("--snr", type=float, default=10, help="query signal to noise ratio in dB")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tracks = []
+    for i in range(args.tracks):
+        # the right channel shares most of the left one
+        left = synthetic_signal(args.seconds, seed=2 * i)
+        right = (0.7 * left + 0.3 * synthetic_signal(args.seconds, seed=2 * i + 1)).astype(np.int16)
+        tracks.append([left, right])
+
+    query_sz = int(args.query * FP_SPEC_FREQ)
+    queries = []
+    for track_id, channels in enumerate(tracks):
+        start = int(rng.integers(0, len(channels[0]) - query_sz))
+        excerpt = [channel[start:start + query_sz].astype(np.float64) for channel in channels]
+        noise_scale = np.std(excerpt[0]) / 10 ** (args.snr / 20)
+        noisy = [
+            np.clip(channel + rng.normal(scale=noise_scale, size=query_sz), -2**15, 2**15 - 1).astype(np.int16)
+            for channel in excerpt
+        ]
+        queries.append((track_id, start, noisy))
+
+    hop_seconds = FP_SPEC_WIN_SIZE * FP_SPEC_OVERLAP / FP_SPEC_FREQ
+
+    print(f"{'mode':>10} {'library cpu, s':>15} {'query cpu, s':>13} {'hashes/track':>13} {'recall':>8}")
+    for analysis_freq in (None, 22050, 16000, 11025, 8000):
+        t = process_time()
+        fingerprints = [fingerprint_record(channels, analysis_freq) for channels in tracks]
+        library_time = process_time() - t
+
+        library = Fingerprints(np.concatenate([fp.data for fp in fingerprints]))
+        track_ids = np.repeat(np.arange(len(fingerprints)), [len(fp) for fp in fingerprints])
+        order = np.argsort(library.hashes, kind="stable")
+        library = (library.hashes[order], library.offsets[order], track_ids[order])
+
+        recalled = 0
+        query_time = 0
+        for track_id, start, channels in queries:
+            t = process_time()
+            query = fingerprint_record(channels, analysis_freq)
+            query_time += process_time() - t
+
+            matched_id, difference = best_match(library, query)
+            expected = start / FP_SPEC_FREQ / hop_seconds
+            recalled += matched_id == track_id and abs(difference - expected) <= 1
+
+        mode = "native" if analysis_freq is None else str(analysis_freq)
+        print(
+            f"{mode:>10} {library_time:>15.2f} {query_time:>13.2f} "
+            f"{len(library[0]) / len(tracks):>13.0f} {recalled / len(queries):>8.1%}"
+        )
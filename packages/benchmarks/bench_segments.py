@@ -0,0 +1,46 @@
+"""
+Fingerprinting time of a single long stereo record split in time segments over a process pool.
+
+    python benchmarks/bench_segments.py [--seconds 1800] [--workers 1 2 4 8] [--repeat 1]
+
+Both channels are fingerprinted in parallel, and split in segments of at least
+--segment-seconds when there are more workers than channels; a worker count past
+channels * duration / segment length gives no more tasks. Every run must give
+exactly the hashes of `fingerprint_channels` in this process.
+"""
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from pyyaap.matching.signal.fingerprint import fingerprint_channels
+from pyyaap.matching.signal.segments import fingerprint_channels_segmented, get_task_count
+from common import synthetic_signal, timeit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=1800)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--segment-seconds", type=float, default=120)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    left = synthetic_signal(args.seconds, seed=0)
+    channels = [left, (0.7 * left + 0.3 * synthetic_signal(args.seconds, seed=1)).astype(np.int16)]
+    config = {"segment_min_seconds": args.segment_seconds}
+
+    reference = fingerprint_channels(channels, **config)
+    baseline = timeit(lambda: fingerprint_channels(channels, **config), args.repeat)
+    print(f"{'workers':>8} {'tasks':>9} {'time, s':>9} {'speed-up':>9}")
+    print(f"{'-':>8} {1:>9} {baseline:>9.3f} {1:>8.1f}x")
+
+    for n_workers in args.workers:
+        with multiprocessing.Pool(n_workers) as pool:
+            fingerprints = fingerprint_channels_segmented(channels, pool, n_workers, **config)
+            assert np.array_equal(fingerprints.data, reference.data), "Segmented hashes differ from a single process"
+
+            elapsed = timeit(lambda: fingerprint_channels_segmented(channels, pool, n_workers, **config), args.repeat)
+
+        n_tasks = get_task_count(len(left), len(channels), n_workers, **config)
+        print(f"{n_workers:>8} {n_tasks:>9} {elapsed:>9.3f} {baseline / elapsed:>8.1f}x")
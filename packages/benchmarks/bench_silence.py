@@ -0,0 +1,41 @@
+"""
+Fingerprinting time with and without the silence gate on material with silent spans.
+
+    python benchmarks/bench_silence.py [--seconds 180] [--repeat 3]
+
+Each record is the synthetic signal with a share of it replaced by digital
+silence (intro) and by dither of +/-1 LSB (outro). Hashes must not change.
+"""
+import argparse
+
+import numpy as np
+
+from pyyaap.matching.signal.fingerprint import fingerprint
+from common import synthetic_signal, timeit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=180)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    np.seterr(divide='ignore')
+    rng = np.random.default_rng(0)
+
+    print(f"{'silent':>7} {'skipped':>8} {'gate off, s':>12} {'gate on, s':>11} {'speedup':>8}")
+    for silent_share in (0, 0.1, 0.25, 0.5):
+        signal = synthetic_signal(args.seconds)
+        n_silent = int(silent_share * len(signal))
+        signal[:n_silent // 2] = 0
+        signal[len(signal) - n_silent // 2:] = rng.integers(-1, 2, n_silent // 2)
+
+        stats = {}
+        assert np.array_equal(fingerprint(signal, silence_gate=False).data, fingerprint(signal, stats=stats).data)
+
+        gate_off = timeit(lambda: fingerprint(signal, silence_gate=False), args.repeat)
+        gate_on = timeit(lambda: fingerprint(signal), args.repeat)
+        print(
+            f"{silent_share:>7.0%} {stats['frames_skipped'] / stats['frames']:>8.1%} "
+            f"{gate_off:>12.3f} {gate_on:>11.3f} {gate_off / gate_on:>7.2f}x"
+        )
@@ -0,0 +1,55 @@
+"""
+Throughput of the spectrogram engines and their deviation from the SciPy reference.
+
+    python benchmarks/bench_spectrogram.py [--seconds 60] [--repeat 3]
+
+Deviation is the maximal absolute difference in dB over the bins that are
+finite in both spectrograms; `inf mismatch` counts bins where only one is -inf
+and `same peaks` is the share of reference peaks the engine reproduces. Every
+engine must find the peaks of the reference on a signal shorter than a window.
+"""
+import argparse
+
+import numpy as np
+
+from pyyaap.config.fingerprint import FP_SPEC_FREQ
+from pyyaap.matching.signal.fingerprint import _get_spectrogram_local_peaks
+from pyyaap.matching.signal.spectrogram import SPECTROGRAM_ENGINES, ScipySpectrogram
+from common import synthetic_signal, timeit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    np.seterr(divide='ignore')
+
+    signal = synthetic_signal(args.seconds)
+    signal[:FP_SPEC_FREQ] = 0  # a second of digital silence
+    reference = ScipySpectrogram.compute(signal)
+    reference_peaks = set(zip(*_get_spectrogram_local_peaks(reference)))
+
+    # signals shorter than a window have a single frame, over a window shrunk to them
+    short = signal[FP_SPEC_FREQ: FP_SPEC_FREQ + 3000]
+    short_peaks = set(zip(*_get_spectrogram_local_peaks(ScipySpectrogram.compute(short))))
+    for name, engine in SPECTROGRAM_ENGINES.items():
+        assert set(zip(*_get_spectrogram_local_peaks(engine.compute(short)))) == short_peaks, \
+            f"{name} differs from scipy on a signal shorter than a window"
+
+    print(f"{'engine':>8} {'dtype':>8} {'time, s':>10} {'x realtime':>11} {'max abs diff, dB':>17} {'inf mismatch':>13} {'same peaks':>11}")
+    for name, engine in SPECTROGRAM_ENGINES.items():
+        spectrum = engine.compute(signal)
+        elapsed = timeit(lambda: engine.compute(signal), args.repeat)
+
+        finite = np.isfinite(reference) & np.isfinite(spectrum)
+        deviation = np.abs(reference[finite].astype(np.float64) - spectrum[finite]).max()
+        inf_mismatch = np.count_nonzero(np.isfinite(reference) != np.isfinite(spectrum))
+        peaks = set(zip(*_get_spectrogram_local_peaks(spectrum)))
+        same_peaks = len(peaks & reference_peaks) / max(len(peaks | reference_peaks), 1)
+
+        print(
+            f"{name:>8} {str(spectrum.dtype):>8} {elapsed:>10.4f} {args.seconds / elapsed:>10.1f}x "
+            f"{deviation:>17.2e} {inf_mismatch:>13} {same_peaks:>10.2%}"
+        )
@@ -0,0 +1,48 @@
+"""
+Cost of fingerprinting a live feed with `StreamingFingerprinter` against `fingerprint`
+over the whole record, and the hashes of both, which must be the same.
+
+    python benchmarks/bench_streaming.py [--seconds 60] [--push 1024 4410] [--repeat 3]
+
+Records are pushed in frames of --push samples. Streams shorter than one spectrogram
+window (but longer than its overlap, as scipy requires) are checked too: they are
+fingerprinted over a window shrunk to their length.
+"""
+import argparse
+
+import numpy as np
+
+from pyyaap.config.fingerprint import FP_SPEC_WIN_SIZE
+from pyyaap.matching.signal.fingerprint import fingerprint
+from pyyaap.matching.signal.streaming import StreamingFingerprinter
+from common import synthetic_signal, timeit
+
+
+def fingerprint_stream(signal: np.ndarray, push_samples: int):
+    fingerprinter = StreamingFingerprinter()
+    hashes = [fingerprinter.push(signal[index: index + push_samples]) for index in range(0, len(signal), push_samples)]
+    hashes.append(fingerprinter.flush())
+    return np.concatenate([fingerprints.data for fingerprints in hashes])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--push", type=int, nargs="+", default=[1024, 4410])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    np.seterr(divide='ignore')
+    signal = synthetic_signal(args.seconds)
+
+    for n_samples in (3 * FP_SPEC_WIN_SIZE // 4, FP_SPEC_WIN_SIZE - 1, FP_SPEC_WIN_SIZE, 3 * FP_SPEC_WIN_SIZE // 2):
+        for push_samples in args.push:
+            expected = fingerprint(signal[:n_samples]).data
+            assert len(expected) and np.array_equal(np.unique(fingerprint_stream(signal[:n_samples], push_samples)), np.unique(expected)), \
+                f"Hashes differ on a stream of {n_samples} samples"
+
+    batch = timeit(lambda: fingerprint(signal), args.repeat)
+    print(f"{'push':>6} {'stream, s':>10} {'batch, s':>9} {'overhead':>9}")
+    for push_samples in args.push:
+        assert np.array_equal(np.unique(fingerprint_stream(signal, push_samples)), np.unique(fingerprint(signal).data)), "Hashes differ"
+        stream = timeit(lambda: fingerprint_stream(signal, push_samples), args.repeat)
+        print(f"{push_samples:>6} {stream:>10.3f} {batch:>9.3f} {stream / batch:>8.2f}x")
@@ -0,0 +1,42 @@
+"""
+Time for a pool worker to hand fingerprints over to the parent: pickled through the
+result pipe, or written to shared memory with only a descriptor going through it.
+
+    python benchmarks/bench_transfer.py [--pairs 100000 1000000 10000000] [--repeat 3]
+
+The time runs from submitting the task to the parent holding a usable container,
+the worker generating the same pairs in both cases.
+"""
+import argparse
+import multiprocessing
+
+from pyyaap.matching.signal.hashes import Fingerprints, SharedFingerprints
+from common import make_fingerprints, timeit
+
+
+def pickled_worker(n_pairs: int) -> Fingerprints:
+    return make_fingerprints(n_pairs, hash_bits=48)
+
+def shared_worker(n_pairs: int) -> SharedFingerprints:
+    return SharedFingerprints.export(make_fingerprints(n_pairs, hash_bits=48))
+
+def generate_only(n_pairs: int) -> int:
+    return len(make_fingerprints(n_pairs, hash_bits=48))
+
+def consume_shared(pool, n_pairs: int) -> None:
+    with pool.apply(shared_worker, (n_pairs,)).attach() as fingerprints:
+        fingerprints.hashes.sum()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'pairs':>10} {'generate, s':>12} {'pickled, s':>11} {'shared, s':>10}")
+    with multiprocessing.Pool(1) as pool:
+        for n_pairs in args.pairs:
+            generate = timeit(lambda: pool.apply(generate_only, (n_pairs,)), args.repeat)
+            pickled = timeit(lambda: pool.apply(pickled_worker, (n_pairs,)).hashes.sum(), args.repeat)
+            shared = timeit(lambda: consume_shared(pool, n_pairs), args.repeat)
+            print(f"{n_pairs:>10} {generate:>12.4f} {pickled:>11.4f} {shared:>10.4f}")
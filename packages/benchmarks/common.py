@@ -0,0 +1,47 @@
+"""
+Synthetic material and timing helpers shared by the benchmarks.
+"""
+from time import perf_counter
+
+import numpy as np
+
+from pyyaap.config.fingerprint import FP_SPEC_FREQ
+from pyyaap.matching.signal.hashes import Fingerprints
+
+
+def synthetic_signal(seconds: float, freq: int = FP_SPEC_FREQ, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    n_samples = int(seconds * freq)
+    t = np.arange(n_samples) / freq
+
+    # a handful of tones switched on and off every second over a noise floor
+    signal = rng.normal(scale=500, size=n_samples)
+    for tone in rng.uniform(50, 8000, size=16):
+        gate = rng.random(int(seconds) + 1) > 0.5
+        signal += 2000 * np.sin(2 * np.pi * tone * t) * gate[t.astype(int)]
+
+    return signal.astype(np.int16)
+
+def make_fingerprints(n_rows: int, rng: np.random.Generator = None, hash_bits: int = 43,
+                      offset_bits: int = 20, popular: float = 0) -> Fingerprints:
+    """
+    Random (hash, offset) pairs.
+    :param rng: generator to draw from, one seeded with 0 if None.
+    :param hash_bits: hashes are drawn below 2**hash_bits.
+    :param offset_bits: offsets are drawn below 2**offset_bits.
+    :param popular: share of hashes drawn from a set of 64, as silence and tones produce in real catalogues.
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    hashes = rng.integers(0, 2**hash_bits, n_rows, dtype=np.uint64)
+    if popular:
+        is_popular = rng.random(n_rows) < popular
+        hashes[is_popular] = rng.integers(0, 64, int(is_popular.sum()), dtype=np.uint64)
+    return Fingerprints.from_arrays(hashes, rng.integers(0, 2**offset_bits, n_rows, dtype=np.int32))
+
+def timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = perf_counter()
+        fn()
+        best = min(best, perf_counter() - t)
+    return best
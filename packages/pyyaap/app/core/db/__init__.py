@@ -1,2 +1,16 @@
+import importlib
+
 from pyyaap.app.core.db.base import BaseDatabase
 from pyyaap.app.core.db.pgclient import PostgreSQLDatabase
+
+
+# backends on optional dependencies are imported on first access
+_OPTIONAL_MODULES = {
+    "AsyncPostgreSQLDatabase": "pyyaap.app.core.db.asyncpgclient",
+}
+
+
+def __getattr__(name: str):
+    if name not in _OPTIONAL_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_OPTIONAL_MODULES[name]), name)
@@ -0,0 +1,317 @@
+import asyncio
+from contextlib import asynccontextmanager
+from itertools import chain, repeat
+from typing import AsyncIterator, Dict, List, Tuple, Union
+
+import asyncpg
+import numpy as np
+
+from pyyaap.app.core.db.base import collect_matches
+from pyyaap.app.core.db.pgclient import PostgreSQLDatabase
+from pyyaap.matching.signal.hashes import Fingerprints, as_fingerprints
+from pyyaap.config.app import (FIELD_HASH, FIELD_OFFSET, FIELD_AUDIO_ID,
+                                    FINGERPRINTS_TABLENAME, AUDIOS_TABLENAME,
+                                    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT,
+                                    DB_MATCH_BATCH_SIZE, DB_MATCH_PARTITIONS, DB_MATCH_PARTITION_MIN,
+                                    TOPN)
+
+
+class AsyncPostgreSQLDatabase:
+    """
+    The BaseDatabase contract for asyncio, on an asyncpg connection pool: every method of
+    PostgreSQLDatabase, with the same arguments and results, as a coroutine. asyncpg
+    prepares and caches the statements on each connection by itself, and sends arrays in
+    binary form.
+
+    db = AsyncPostgreSQLDatabase(**get_connection())
+    await db.connect()
+    ...
+    await db.close()
+    """
+    type = "postgres"
+
+    # the statements of PostgreSQLDatabase, with the numbered parameters of asyncpg
+    # CREATES
+    CREATE_AUDIOS_TABLE = PostgreSQLDatabase.CREATE_AUDIOS_TABLE
+    CREATE_FINGERPRINTS_TABLE = PostgreSQLDatabase.CREATE_FINGERPRINTS_TABLE
+
+    # INSERTS
+    INSERT_FINGERPRINT = PostgreSQLDatabase.INSERT_FINGERPRINT % ("$1", "$2", "$3")
+    INSERT_AUDIO = PostgreSQLDatabase.INSERT_AUDIO % ("$1", "$2", "$3")
+
+    # SELECTS
+    SELECT = PostgreSQLDatabase.SELECT % ("$1",)
+
+    SELECT_MATCHES = f"""
+        SELECT "{FIELD_HASH}", "audio_{FIELD_AUDIO_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" = ANY($1::BIGINT[]);
+    """
+
+    SELECT_ALIGNED_MATCHES = PostgreSQLDatabase.SELECT_ALIGNED_MATCHES % {"hashes": "$1", "offsets": "$2", "topn": "$3"}
+    SELECT_ALL = PostgreSQLDatabase.SELECT_ALL
+    SELECT_AUDIO = PostgreSQLDatabase.SELECT_AUDIO % ("$1",)
+    SELECT_NUM_FINGERPRINTS = PostgreSQLDatabase.SELECT_NUM_FINGERPRINTS
+    SELECT_UNIQUE_AUDIO_IDS = PostgreSQLDatabase.SELECT_UNIQUE_AUDIO_IDS
+    SELECT_AUDIOS = PostgreSQLDatabase.SELECT_AUDIOS
+
+    # DROPS
+    DROP_FINGERPRINTS = PostgreSQLDatabase.DROP_FINGERPRINTS
+    DROP_AUDIOS = PostgreSQLDatabase.DROP_AUDIOS
+
+    # UPDATE
+    UPDATE_AUDIO_FINGERPRINTED = PostgreSQLDatabase.UPDATE_AUDIO_FINGERPRINTED % ("$1",)
+
+    # DELETES
+    DELETE_UNFINGERPRINTED = PostgreSQLDatabase.DELETE_UNFINGERPRINTED
+
+    DELETE_AUDIOS = f"""
+        DELETE FROM "{AUDIOS_TABLENAME}" WHERE "{FIELD_AUDIO_ID}" = ANY($1::INT[]);
+    """
+
+    def __init__(self, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT, match_partitions: int = DB_MATCH_PARTITIONS, **options):
+        """
+        :param min_size: connections opened with the pool.
+        :param max_size: connections open at most, acquisitions wait past it.
+        :param timeout: seconds to wait for a free connection, None waits forever.
+        :param match_partitions: connections the hashes of a large match search are split
+            over and queried on concurrently, at most `max_size`.
+        :param options: connection options, as accepted by `asyncpg.connect`.
+        """
+        if options.get("port") is not None:
+            options["port"] = int(options["port"])
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.match_partitions = max(1, min(match_partitions, max_size))
+        self._options = options
+        self.pool = None
+        self._connecting = None
+
+    async def connect(self) -> None:
+        """
+        Opens the pool, also done by the first query; concurrent callers share one pool.
+        """
+        if self.pool is not None:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(asyncpg.create_pool(
+                min_size=self.min_size, max_size=self.max_size, **self._options
+            ))
+        try:
+            self.pool = await asyncio.shield(self._connecting)
+        except Exception:
+            self._connecting = None
+            raise
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            pool, self.pool, self._connecting = self.pool, None, None
+            await pool.close()
+
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[asyncpg.Connection]:
+        await self.connect()
+        async with self.pool.acquire(timeout=self.timeout) as conn:
+            yield conn
+
+    async def setup(self) -> None:
+        """
+        Called on creation or shortly afterwards.
+        """
+        async with self._connection() as conn:
+            async with conn.transaction():
+                await conn.execute(self.CREATE_AUDIOS_TABLE)
+                await conn.execute(self.CREATE_FINGERPRINTS_TABLE)
+                await conn.execute(self.DELETE_UNFINGERPRINTED)
+
+    async def empty(self) -> None:
+        """
+        Called when the database should be cleared of all data.
+        """
+        async with self._connection() as conn:
+            async with conn.transaction():
+                await conn.execute(self.DROP_FINGERPRINTS)
+                await conn.execute(self.DROP_AUDIOS)
+
+        await self.setup()
+
+    async def delete_unfingerprinted_audios(self) -> None:
+        """
+        Called to remove any audio entries that do not have any fingerprints
+        associated with them.
+        """
+        async with self._connection() as conn:
+            await conn.execute(self.DELETE_UNFINGERPRINTED)
+
+    async def get_num_audios(self) -> int:
+        """
+        :return: the amount of fully fingerprinted audios in the database.
+        """
+        async with self._connection() as conn:
+            return await conn.fetchval(self.SELECT_UNIQUE_AUDIO_IDS) or 0
+
+    async def get_num_fingerprints(self) -> int:
+        """
+        :return: the number of fingerprints in the database.
+        """
+        async with self._connection() as conn:
+            return await conn.fetchval(self.SELECT_NUM_FINGERPRINTS) or 0
+
+    async def set_audio_fingerprinted(self, audio_id: int) -> None:
+        """
+        Sets a specific audio as having all fingerprints in the database.
+        :param audio_id: audio identifier.
+        """
+        async with self._connection() as conn:
+            await conn.execute(self.UPDATE_AUDIO_FINGERPRINTED, audio_id)
+
+    async def get_audios(self) -> List[Dict[str, str]]:
+        """
+        :return: a dictionary with the info of every fully fingerprinted audio.
+        """
+        async with self._connection() as conn:
+            return [dict(record) for record in await conn.fetch(self.SELECT_AUDIOS)]
+
+    async def get_audio_by_id(self, audio_id: int) -> Dict[str, str]:
+        """
+        Brings the audio info from the database.
+        :param audio_id: audio identifier.
+        :return: a audio by its identifier, None if there is none.
+        """
+        async with self._connection() as conn:
+            record = await conn.fetchrow(self.SELECT_AUDIO, audio_id)
+        return None if record is None else dict(record)
+
+    async def insert(self, fingerprint: int, audio_id: int, offset: int) -> None:
+        """
+        Inserts a single fingerprint into the database.
+        :param fingerprint: hash of the fingerprint.
+        :param audio_id: Song identifier this fingerprint is off
+        :param offset: The offset this fingerprint is from.
+        """
+        async with self._connection() as conn:
+            await conn.execute(self.INSERT_FINGERPRINT, audio_id, fingerprint, offset)
+
+    async def insert_audio(self, audio_name: str, file_hash: str, total_hashes: int) -> int:
+        """
+        Inserts a audio name into the database, returns the new
+        identifier of the audio.
+        :param audio_name: The name of the audio.
+        :param file_hash: Hash from the fingerprinted file.
+        :param total_hashes: amount of hashes to be inserted on fingerprint table.
+        :return: the inserted id.
+        """
+        async with self._connection() as conn:
+            return await conn.fetchval(self.INSERT_AUDIO, audio_name, file_hash, total_hashes)
+
+    async def query(self, fingerprint: int = None) -> List[Tuple]:
+        """
+        Returns all matching fingerprint entries associated with
+        the given hash as parameter, if None is passed it returns all entries.
+        :param fingerprint: hash of the fingerprint.
+        :return: a list of fingerprint records stored in the db.
+        """
+        async with self._connection() as conn:
+            if fingerprint:
+                records = await conn.fetch(self.SELECT, fingerprint)
+            else:  # select all if no key
+                records = await conn.fetch(self.SELECT_ALL)
+        return [tuple(record) for record in records]
+
+    async def get_iterable_kv_pairs(self) -> List[Tuple]:
+        """
+        :return: a list containing all fingerprints stored in the db.
+        """
+        return await self.query(None)
+
+    async def insert_hashes(self, audio_id: int, hashes: Union[Fingerprints, List[Tuple[int, int]]],
+                            batch_size: int = 1000) -> None:
+        """
+        Insert a multitude of fingerprints with a single binary COPY.
+        :param audio_id: Song identifier the fingerprints belong to
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
+            - hash: int
+            - offset: Offset this hash was created from/at.
+        :param batch_size: fingerprints converted to records at a time.
+        """
+        hashes = as_fingerprints(hashes)
+        # a single COPY, fed batch by batch so the records of all fingerprints never coexist
+        records = chain.from_iterable(
+            zip(repeat(audio_id), batch["hash"].tolist(), batch["offset"].tolist())
+            for batch in (hashes.data[index: index + batch_size] for index in range(0, len(hashes), batch_size))
+        )
+
+        async with self._connection() as conn:
+            await conn.copy_records_to_table(
+                FINGERPRINTS_TABLENAME, records=records, columns=[f"audio_{FIELD_AUDIO_ID}", FIELD_HASH, FIELD_OFFSET]
+            )
+
+    async def return_matches(self, hashes: Union[Fingerprints, List[Tuple[int, int]]],
+                             batch_size: int = DB_MATCH_BATCH_SIZE) -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values.
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
+            - hash: int
+            - offset: Offset this hash was created from/at.
+        :param batch_size: number of hashes per query.
+        :return: a list of (sid, offset_difference) tuples and a
+        dictionary with the amount of hashes matched (not considering
+        duplicated hashes) in each audio.
+            - audio id: Song identifier
+            - offset_difference: (database_offset - sampled_offset)
+        """
+        mapper = as_fingerprints(hashes).group_by_hash()
+        values = list(mapper.keys())
+
+        # large searches are split like PostgreSQLDatabase splits them, over concurrent connections
+        n_partitions = max(1, min(self.match_partitions, len(values) // DB_MATCH_PARTITION_MIN))
+        bounds = np.linspace(0, len(values), n_partitions + 1).astype(int).tolist()
+        partitions = await asyncio.gather(*(
+            self._fetch_matches(values[start: end], batch_size) for start, end in zip(bounds[:-1], bounds[1:])
+        ))
+
+        return collect_matches(mapper, chain.from_iterable(partitions))
+
+    async def _fetch_matches(self, values: List[int], batch_size: int) -> List[asyncpg.Record]:
+        """
+        :param values: distinct hashes being searched.
+        :param batch_size: number of hashes per query.
+        :return: the (hash, audio id, offset) rows of the given hashes.
+        """
+        rows = []
+        async with self._connection() as conn:
+            for index in range(0, len(values), batch_size):
+                rows.extend(await conn.fetch(self.SELECT_MATCHES, values[index: index + batch_size]))
+        return rows
+
+    async def return_aligned_matches(self, hashes: Union[Fingerprints, List[Tuple[int, int]]], topn: int = TOPN) \
+            -> Tuple[List[Tuple[int, int, int]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values and aligns the matches
+        server-side, see `PostgreSQLDatabase.return_aligned_matches`.
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
+        :param topn: number of audios returned.
+        :return: a list of (sid, offset_difference, count) tuples, best first, and a
+        dictionary with the amount of hashes matched in each of these audios.
+        """
+        hashes = as_fingerprints(hashes)
+
+        async with self._connection() as conn:
+            rows = await conn.fetch(
+                self.SELECT_ALIGNED_MATCHES,
+                hashes.hashes.astype(np.int64).tolist(), hashes.offsets.tolist(), topn
+            )
+
+        return [(sid, offset, count) for sid, offset, count, _ in rows], {sid: matched for sid, _, _, matched in rows}
+
+    async def delete_audios_by_id(self, audio_ids: List[int], batch_size: int = 1000) -> None:
+        """
+        Given a list of audio ids it deletes all audios specified and their corresponding fingerprints.
+        :param audio_ids: audio ids to be deleted from the database.
+        :param batch_size: number of query's batches.
+        """
+        async with self._connection() as conn:
+            for index in range(0, len(audio_ids), batch_size):
+                await conn.execute(self.DELETE_AUDIOS, audio_ids[index: index + batch_size])
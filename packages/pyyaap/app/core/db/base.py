@@ -1,6 +1,11 @@
 import abc
 import importlib
-from typing import Dict, List, Tuple
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from pyyaap.matching.signal.hashes import Fingerprints, as_fingerprints
 
 
 class BaseDatabase:
@@ -122,22 +127,23 @@ class BaseDatabase:
         pass
 
     @abc.abstractmethod
-    def insert_hashes(self, audio_id: int, hashes: List[Tuple[str, int]], batch_size: int = 1000) -> None:
+    def insert_hashes(self, audio_id: int, hashes: Union[Fingerprints, List[Tuple[int, int]]],
+                      batch_size: int = 1000) -> None:
         """
         Insert a multitude of fingerprints.
         :param audio_id: Song identifier the fingerprints belong to
-        :param hashes: A sequence of tuples in the format (hash, offset)
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
             - hash: Part of a sha1 hash, in hexadecimal format
             - offset: Offset this hash was created from/at.
         :param batch_size: insert batches.
         """
 
     @abc.abstractmethod
-    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000) \
+    def return_matches(self, hashes: Union[Fingerprints, List[Tuple[int, int]]], batch_size: int = 1000) \
             -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
         """
         Searches the database for pairs of (hash, offset) values.
-        :param hashes: A sequence of tuples in the format (hash, offset)
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
             - hash: Part of a sha1 hash, in hexadecimal format
             - offset: Offset this hash was created from/at.
         :param batch_size: number of query's batches.
@@ -159,6 +165,30 @@ class BaseDatabase:
         pass
 
 
+def collect_matches(mapper: Dict[int, np.ndarray], rows: Iterable[Tuple[int, int, int]]) \
+        -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
+    """
+    Turns the fingerprints found for the hashes of a query into match tuples.
+    :param mapper: the offsets of every distinct hash of the query, see `Fingerprints.group_by_hash`.
+    :param rows: (hash, audio id, offset) rows of the database.
+    :return: a list of (sid, offset_difference) tuples and a dictionary with the amount
+    of hashes matched in each audio, as `return_matches` returns them.
+    """
+    # in order to count each hash only once per db offset we use the dic below
+    dedup_hashes = {}
+
+    results = []
+    for hsh, sid, offset in rows:
+        if sid not in dedup_hashes.keys():
+            dedup_hashes[sid] = 1
+        else:
+            dedup_hashes[sid] += 1
+        #  we now evaluate all offset for each  hash matched
+        results.extend(zip(repeat(sid), (offset - mapper[hsh]).tolist()))
+
+    return results, dedup_hashes
+
+
 def get_database(database_type: str = "mysql") -> BaseDatabase:
     """
     Given a database type it returns a database instance for that type.
@@ -315,26 +345,29 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         """
         return self.query(None)
 
-    def insert_hashes(self, audio_id: int, hashes: List[Tuple[str, int]], batch_size: int = 1000) -> None:
+    def insert_hashes(self, audio_id: int, hashes: Union[Fingerprints, List[Tuple[int, int]]],
+                      batch_size: int = 1000) -> None:
         """
         Insert a multitude of fingerprints.
         :param audio_id: Song identifier the fingerprints belong to
-        :param hashes: A sequence of tuples in the format (hash, offset)
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
             - hash: Part of a sha1 hash, in hexadecimal format
             - offset: Offset this hash was created from/at.
         :param batch_size: insert batches.
         """
-        values = [(audio_id, hsh, int(offset)) for hsh, offset in hashes]
+        hashes = as_fingerprints(hashes)
 
         with self.cursor() as cur:
             for index in range(0, len(hashes), batch_size):
-                cur.executemany(self.INSERT_FINGERPRINT, values[index: index + batch_size])
+                batch = hashes.data[index: index + batch_size]
+                values = zip(repeat(audio_id), batch["hash"].tolist(), batch["offset"].tolist())
+                cur.executemany(self.INSERT_FINGERPRINT, list(values))
 
-    def return_matches(self, hashes: List[Tuple[str, int]],
+    def return_matches(self, hashes: Union[Fingerprints, List[Tuple[int, int]]],
                        batch_size: int = 1000) -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
         """
         Searches the database for pairs of (hash, offset) values.
-        :param hashes: A sequence of tuples in the format (hash, offset)
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
             - hash: int
             - offset: Offset this hash was created from/at.
         :param batch_size: number of query's batches.
@@ -344,37 +377,37 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
             - audio id: Song identifier
             - offset_difference: (database_offset - sampled_offset)
         """
-        # Create a dictionary of hash => offset pairs for later lookups
-        mapper = {}
-        for hsh, offset in hashes:
-            if hsh in mapper.keys():
-                mapper[hsh].append(offset)
-            else:
-                mapper[hsh] = [offset]
+        # Create a dictionary of hash => offsets pairs for later lookups
+        mapper = as_fingerprints(hashes).group_by_hash()
 
         values = list(mapper.keys())
 
-        # in order to count each hash only once per db offset we use the dic below
-        dedup_hashes = {}
+        return collect_matches(mapper, self._fetch_matches(values, batch_size))
 
-        results = []
+    def _fetch_matches(self, values: List[int], batch_size: int) -> Iterator[Tuple[int, int, int]]:
+        """
+        Fetches the fingerprints of the given hashes on a single cursor.
+        :param values: distinct hashes being searched.
+        :param batch_size: number of hashes per query.
+        :return: an iterator of (hash, audio id, offset) rows.
+        """
         with self.cursor() as cur:
-            for index in range(0, len(values), batch_size):
-                # Create our IN part of the query
-                query = self.SELECT_MULTIPLE % ', '.join([self.IN_MATCH] * len(values[index: index + batch_size]))
+            yield from self._select_matches(cur, values, batch_size)
 
-                cur.execute(query, values[index: index + batch_size])
-
-                for hsh, sid, offset in cur:
-                    if sid not in dedup_hashes.keys():
-                        dedup_hashes[sid] = 1
-                    else:
-                        dedup_hashes[sid] += 1
-                    #  we now evaluate all offset for each  hash matched
-                    for audio_sampled_offset in mapper[hsh]:
-                        results.append((sid, offset - audio_sampled_offset))
+    def _select_matches(self, cur, values: List[int], batch_size: int) -> Iterator[Tuple[int, int, int]]:
+        """
+        Fetches the fingerprints of the given hashes.
+        :param cur: an open cursor.
+        :param values: distinct hashes being searched.
+        :param batch_size: number of hashes per query.
+        :return: an iterator of (hash, audio id, offset) rows.
+        """
+        for index in range(0, len(values), batch_size):
+            # Create our IN part of the query
+            query = self.SELECT_MULTIPLE % ', '.join([self.IN_MATCH] * len(values[index: index + batch_size]))
 
-            return results, dedup_hashes
+            cur.execute(query, values[index: index + batch_size])
+            yield from cur
 
     def delete_audios_by_id(self, audio_ids: List[int], batch_size: int = 1000) -> None:
         """
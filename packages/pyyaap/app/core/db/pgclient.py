@@ -1,13 +1,78 @@
-import queue
-
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import DictCursor
+from psycopg2.pool import PoolError
 
 from pyyaap.app.core.db.base import CommonDatabase
+from pyyaap.matching.signal.hashes import Fingerprints, as_fingerprints
 from pyyaap.config.app import (FIELD_FILE_SHA1, FIELD_FINGERPRINTED,
                                     FIELD_HASH, FIELD_OFFSET, FIELD_AUDIO_ID,
                                     FIELD_AUDIONAME, FIELD_TOTAL_HASHES,
-                                    FINGERPRINTS_TABLENAME, AUDIOS_TABLENAME)
+                                    FINGERPRINTS_TABLENAME, AUDIOS_TABLENAME,
+                                    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_PING_AFTER, DB_POOL_TIMEOUT,
+                                    DB_MATCH_BATCH_SIZE, DB_MATCH_BATCH_MIN, DB_MATCH_BATCH_MAX,
+                                    DB_MATCH_BATCH_SECONDS, DB_MATCH_PARTITIONS, DB_MATCH_PARTITION_MIN,
+                                    TOPN)
+
+
+# PostgreSQL binary COPY: signature, flags and header extension length, then the tuples
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + np.array([0, 0], dtype=">i4").tobytes()
+COPY_TRAILER = np.array(-1, dtype=">i2").tobytes()
+
+# a fingerprint row as a binary COPY tuple: field count, then length and value of every field
+COPY_FINGERPRINT_DTYPE = np.dtype([
+    ("n_fields", ">i2"),
+    ("audio_id_size", ">i4"), ("audio_id", ">i4"),
+    ("hash_size", ">i4"), ("hash", ">i8"),
+    ("offset_size", ">i4"), ("offset", ">i4"),
+])
+
+
+def array_literal(values: List[int]) -> str:
+    """
+    :return: the text form of an integer array. psycopg2 sends lists as ARRAY[...] expressions,
+        which PostgreSQL parses element by element; a literal is a single constant.
+    """
+    return "{" + ",".join(map(str, values)) + "}"
+
+
+class FingerprintCopyStream:
+    """
+    File-like source of a binary COPY of fingerprints, encoded `batch_size` rows at a
+    time straight from the arrays of a Fingerprints container, for `cursor.copy_expert`.
+    """
+    def __init__(self, audio_id: int, fingerprints: Fingerprints, batch_size: int):
+        self._chunks = self._iter_chunks(audio_id, fingerprints, batch_size)
+
+    @staticmethod
+    def _iter_chunks(audio_id: int, fingerprints: Fingerprints, batch_size: int) -> Iterator[bytes]:
+        yield COPY_HEADER
+
+        rows = np.empty(min(batch_size, len(fingerprints)), dtype=COPY_FINGERPRINT_DTYPE)
+        rows["n_fields"] = 3
+        rows["audio_id_size"], rows["audio_id"] = 4, audio_id
+        rows["hash_size"] = 8
+        rows["offset_size"] = 4
+        for index in range(0, len(fingerprints), batch_size):
+            batch = fingerprints.data[index: index + batch_size]
+            chunk = rows[:len(batch)]
+            chunk["hash"] = batch["hash"]
+            chunk["offset"] = batch["offset"]
+            yield chunk.tobytes()
+
+        yield COPY_TRAILER
+
+    def read(self, size: int = -1) -> bytes:
+        # copy_expert accepts chunks of any length, an empty one ends the COPY
+        return next(self._chunks, b"")
 
 
 class PostgreSQLDatabase(CommonDatabase):
@@ -60,6 +125,11 @@ class PostgreSQLDatabase(CommonDatabase):
         RETURNING "{FIELD_AUDIO_ID}";
     """
 
+    COPY_FINGERPRINTS = f"""
+        COPY "{FINGERPRINTS_TABLENAME}" ("audio_{FIELD_AUDIO_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}")
+        FROM STDIN WITH (FORMAT binary);
+    """
+
     # SELECTS
     SELECT = f"""
         SELECT "audio_{FIELD_AUDIO_ID}", "{FIELD_OFFSET}"
@@ -73,6 +143,45 @@ class PostgreSQLDatabase(CommonDatabase):
         WHERE "{FIELD_HASH}" IN (%s);
     """
 
+    # a single statement for batches of any size, prepared once per connection
+    PREPARE_SELECT_MATCHES = f"""
+        PREPARE "select_matches" (BIGINT[]) AS
+        SELECT "{FIELD_HASH}", "audio_{FIELD_AUDIO_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" = ANY($1);
+    """
+
+    EXECUTE_SELECT_MATCHES = 'EXECUTE "select_matches" (%s::BIGINT[]);'
+
+    # every (audio, offset difference) histogram is counted here, only the best bin of the
+    # best audios is returned; ties go to the smallest difference and audio id, as in Python
+    SELECT_ALIGNED_MATCHES = f"""
+        WITH "query" AS (
+            SELECT "{FIELD_HASH}", "{FIELD_OFFSET}"
+            FROM unnest(%(hashes)s::BIGINT[], %(offsets)s::INT[]) AS q("{FIELD_HASH}", "{FIELD_OFFSET}")
+        ), "matched" AS (
+            SELECT "{FIELD_HASH}", "audio_{FIELD_AUDIO_ID}", "{FIELD_OFFSET}"
+            FROM "{FINGERPRINTS_TABLENAME}"
+            WHERE "{FIELD_HASH}" IN (SELECT "{FIELD_HASH}" FROM "query")
+        ), "aligned" AS (
+            SELECT m."audio_{FIELD_AUDIO_ID}", m."{FIELD_OFFSET}" - q."{FIELD_OFFSET}" AS "offset_difference", COUNT(*) AS "n"
+            FROM "matched" m JOIN "query" q ON m."{FIELD_HASH}" = q."{FIELD_HASH}"
+            GROUP BY m."audio_{FIELD_AUDIO_ID}", "offset_difference"
+        ), "best" AS (
+            SELECT DISTINCT ON ("audio_{FIELD_AUDIO_ID}") "audio_{FIELD_AUDIO_ID}", "offset_difference", "n"
+            FROM "aligned"
+            ORDER BY "audio_{FIELD_AUDIO_ID}", "n" DESC, "offset_difference"
+        ), "hashes_matched" AS (
+            SELECT "audio_{FIELD_AUDIO_ID}", COUNT(*) AS "n"
+            FROM "matched"
+            GROUP BY "audio_{FIELD_AUDIO_ID}"
+        )
+        SELECT b."audio_{FIELD_AUDIO_ID}", b."offset_difference", b."n", h."n"
+        FROM "best" b JOIN "hashes_matched" h ON b."audio_{FIELD_AUDIO_ID}" = h."audio_{FIELD_AUDIO_ID}"
+        ORDER BY b."n" DESC, b."audio_{FIELD_AUDIO_ID}"
+        LIMIT %(topn)s;
+    """
+
     SELECT_ALL = f'SELECT "audio_{FIELD_AUDIO_ID}", "{FIELD_OFFSET}" FROM "{FINGERPRINTS_TABLENAME}";'
 
     SELECT_AUDIO = f"""
@@ -127,15 +236,31 @@ class PostgreSQLDatabase(CommonDatabase):
     # IN
     IN_MATCH = "%s"
 
-    def __init__(self, **options):
+    def __init__(self, match_partitions: int = DB_MATCH_PARTITIONS, **options):
+        """
+        :param match_partitions: connections the hashes of a large match search are split
+            over and queried on concurrently, at most the pool size.
+        :param options: connection options, as accepted by `psycopg2.connect`, and
+            pool settings, as accepted by `ConnectionPool`.
+        """
         super().__init__()
-        self.cursor = cursor_factory(**options)
+        self.pool = ConnectionPool(**options)
+        self.cursor = cursor_factory(self.pool)
+        self.match_partitions = max(1, min(match_partitions, self.pool.max_size))
         self._options = options
+        self._reset_matching()
+
+    def _reset_matching(self) -> None:
+        # connections holding the prepared match statement, and the batch size learnt so far
+        self._prepared = weakref.WeakSet()
+        self.match_batch_size = DB_MATCH_BATCH_SIZE
+        # threads of the partitioned searches, started on the first one, and their process
+        self._match_executor = None
+        self._match_pid = None
 
     def after_fork(self) -> None:
-        # Clear the cursor cache, we don't want any stale connections from
-        # the previous process.
-        Cursor.clear_cache()
+        # we don't want any stale connections from the previous process.
+        self.pool.after_fork()
 
     def insert_audio(self, audio_name: str, file_hash: str, total_hashes: int) -> int:
         """
@@ -150,49 +275,311 @@ class PostgreSQLDatabase(CommonDatabase):
             cur.execute(self.INSERT_AUDIO, (audio_name, file_hash, total_hashes))
             return cur.fetchone()[0]
 
+    def insert_hashes(self, audio_id: int, hashes: Union[Fingerprints, List[Tuple[int, int]]],
+                      batch_size: int = 1000) -> None:
+        """
+        Insert a multitude of fingerprints with a single binary COPY.
+        :param audio_id: Song identifier the fingerprints belong to
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
+            - hash: int
+            - offset: Offset this hash was created from/at.
+        :param batch_size: rows encoded per chunk of the COPY stream.
+        """
+        hashes = as_fingerprints(hashes)
+
+        with self.cursor() as cur:
+            # the table has no unique constraint, so COPY stores what INSERT ... ON CONFLICT DO NOTHING did
+            cur.copy_expert(self.COPY_FINGERPRINTS, FingerprintCopyStream(audio_id, hashes, batch_size))
+
+    def return_matches(self, hashes: Union[Fingerprints, List[Tuple[int, int]]],
+                       batch_size: int = None) -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values.
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
+            - hash: int
+            - offset: Offset this hash was created from/at.
+        :param batch_size: number of hashes per query, None adapts it to the query latency.
+        :return: a list of (sid, offset_difference) tuples and a
+        dictionary with the amount of hashes matched (not considering
+        duplicated hashes) in each audio.
+            - audio id: Song identifier
+            - offset_difference: (database_offset - sampled_offset)
+        """
+        return super().return_matches(hashes, batch_size)
+
+    def _fetch_matches(self, values: List[int], batch_size: int = None) -> Iterator[Tuple[int, int, int]]:
+        """
+        Fetches the fingerprints of the given hashes. A search of at least
+        2 * DB_MATCH_PARTITION_MIN hashes is split into up to `match_partitions` parts,
+        each queried on a connection of its own by a thread, so their round trips and index
+        probes overlap instead of queueing on a single cursor.
+        :param values: distinct hashes being searched.
+        :param batch_size: number of hashes per query, None adapts it.
+        :return: an iterator of (hash, audio id, offset) rows.
+        """
+        n_partitions = min(self.match_partitions, len(values) // DB_MATCH_PARTITION_MIN)
+        if n_partitions <= 1:
+            yield from super()._fetch_matches(values, batch_size)
+            return
+
+        if self._match_executor is None or self._match_pid != os.getpid():
+            # threads do not survive a fork, a forked process starts executors of its own,
+            # and resets the pool before they race to do it
+            self.pool.check_fork()
+            self._match_executor = ThreadPoolExecutor(self.match_partitions, thread_name_prefix="match")
+            self._match_pid = os.getpid()
+
+        bounds = np.linspace(0, len(values), n_partitions + 1).astype(int).tolist()
+        partitions = [
+            self._match_executor.submit(self._fetch_partition, values[start: end], batch_size)
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+        for partition in partitions:
+            yield from partition.result()
+
+    def _fetch_partition(self, values: List[int], batch_size: int = None) -> List[Tuple[int, int, int]]:
+        # runs on a thread of the executor, with a connection of its own
+        return list(super()._fetch_matches(values, batch_size))
+
+    def _select_matches(self, cur, values: List[int], batch_size: int = None) -> Iterator[Tuple[int, int, int]]:
+        """
+        Fetches the fingerprints of the given hashes with a prepared statement taking them
+        as an array, so batches are neither parsed nor planned from scratch.
+        Without `batch_size`, batches are resized after each one to take about
+        DB_MATCH_BATCH_SECONDS: few round trips on a fast server, short statements on a loaded one.
+        :param cur: an open cursor.
+        :param values: distinct hashes being searched.
+        :param batch_size: number of hashes per query, None adapts it.
+        :return: an iterator of (hash, audio id, offset) rows.
+        """
+        if cur.connection not in self._prepared:
+            cur.execute(self.PREPARE_SELECT_MATCHES)
+            self._prepared.add(cur.connection)
+
+        index = 0
+        while index < len(values):
+            size = batch_size or self.match_batch_size
+            t = time()
+            cur.execute(self.EXECUTE_SELECT_MATCHES, (array_literal(values[index: index + size]),))
+            rows = cur.fetchall()
+            elapsed = time() - t
+
+            if batch_size is None and size <= len(values) - index:
+                # a full batch tells how long one takes, the size moves by at most a factor of 2
+                scale = min(max(DB_MATCH_BATCH_SECONDS / max(elapsed, 1e-6), 0.5), 2)
+                self.match_batch_size = min(max(int(size * scale), DB_MATCH_BATCH_MIN), DB_MATCH_BATCH_MAX)
+            index += size
+            yield from rows
+
+    def return_aligned_matches(self, hashes: Union[Fingerprints, List[Tuple[int, int]]], topn: int = TOPN) \
+            -> Tuple[List[Tuple[int, int, int]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values and aligns the matches
+        server-side: only the best offset difference of the `topn` best audios comes back,
+        instead of every matching row.
+        :param hashes: A Fingerprints container or a sequence of tuples in the format (hash, offset)
+            - hash: int
+            - offset: Offset this hash was created from/at.
+        :param topn: number of audios returned.
+        :return: a list of (sid, offset_difference, count) tuples, best first, and a
+        dictionary with the amount of hashes matched in each of these audios, as
+        `return_matches` counts them.
+        """
+        hashes = as_fingerprints(hashes)
+        # sent as literals like the prepared match query, not as ARRAY[...] expressions
+        parameters = {
+            "hashes": array_literal(hashes.hashes.tolist()),
+            "offsets": array_literal(hashes.offsets.tolist()),
+            "topn": topn,
+        }
+
+        with self.cursor() as cur:
+            cur.execute(self.SELECT_ALIGNED_MATCHES, parameters)
+            rows = cur.fetchall()
+
+        return [(sid, offset, count) for sid, offset, count, _ in rows], {sid: matched for sid, _, _, matched in rows}
+
     def __getstate__(self):
-        return self._options,
+        return self._options, self.match_partitions
 
     def __setstate__(self, state):
-        self._options, = state
-        self.cursor = cursor_factory(**self._options)
+        self._options, self.match_partitions = state
+        self.pool = ConnectionPool(**self._options)
+        self.cursor = cursor_factory(self.pool)
+        self._reset_matching()
 
 
-def cursor_factory(**factory_options):
+def cursor_factory(pool: "ConnectionPool"):
     def cursor(**options):
-        options.update(factory_options)
-        return Cursor(**options)
+        return Cursor(pool, **options)
     return cursor
 
 
-class Cursor(object):
+class ConnectionPool:
     """
-    Establishes a connection to the database and returns an open cursor.
-    # Use as context manager
-    with Cursor() as cur:
-        cur.execute(query)
+    Thread-safe pool of psycopg2 connections. Connections are kept open once returned,
+    so a process in steady state does no TCP or authentication handshake; one that
+    idled for `ping_after` seconds is checked with a `SELECT 1` before being handed out.
+    A forked process starts over with connections of its own, the ones it inherited
+    are left alone as they still belong to the parent.
+
+    pool = ConnectionPool(**connection_options)
+    conn = pool.getconn()
+    try:
         ...
+    finally:
+        pool.putconn(conn)
     """
-    def __init__(self, dictionary=False, **options):
-        super().__init__()
+    def __init__(self, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 ping_after: float = DB_POOL_PING_AFTER, timeout: float = DB_POOL_TIMEOUT, **options):
+        """
+        :param min_size: connections opened on the first checkout.
+        :param max_size: connections open at most, checkouts wait past it.
+        :param ping_after: idle seconds after which a connection is pinged on checkout.
+        :param timeout: seconds a checkout waits for a free connection, None waits forever.
+        :param options: connection options, as accepted by `psycopg2.connect`.
+        """
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.ping_after = ping_after
+        self.timeout = timeout
+        self._options = options
+        # connections of forked parents, never closed as their sessions are not ours
+        self._inherited = []
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._lock = threading.Condition()
+        # idle connections with the time they were returned, most recent last
+        self._idle = []
+        self._size = 0
+        self._warm = False
 
-        self._cache = queue.Queue(maxsize=5)
+    def after_fork(self) -> None:
+        """
+        Drops the connections of the parent process without closing them.
+        Called on checkout when the process changed, or explicitly.
+        """
+        self._inherited.extend(conn for conn, _ in self._idle)
+        self._reset()
 
+    def _connect(self):
+        try:
+            return psycopg2.connect(**self._options)
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+
+    def _is_usable(self, conn, idle_since: float) -> bool:
+        if conn.closed or conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            return False
+        if time() - idle_since < self.ping_after:
+            return True
         try:
-            conn = self._cache.get_nowait()
-            # Ping the connection before using it from the cache.
-            conn.ping(True)
-        except queue.Empty:
-            conn = psycopg2.connect(**options)
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def check_fork(self) -> None:
+        """
+        Starts over if the process changed since the pool was last used.
+        """
+        if os.getpid() != self._pid:
+            self.after_fork()
 
-        self.conn = conn
-        self.dictionary = dictionary
+    def getconn(self):
+        """
+        :return: an idle connection, opened if none is left and the pool is not full.
+        """
+        self.check_fork()
+
+        if not self._warm:
+            self._warm = True
+            for _ in range(self.min_size):
+                with self._lock:
+                    if self._size >= self.min_size:
+                        break
+                    self._size += 1
+                self.putconn(self._connect())
+
+        deadline = None if self.timeout is None else time() + self.timeout
+        while True:
+            with self._lock:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = None if deadline is None else deadline - time()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolError(f"No connection available after {self.timeout} s")
+                    self._lock.wait(remaining)
+
+                if not self._idle:
+                    self._size += 1
+                    break
+                conn, idle_since = self._idle.pop()
+
+            # checked outside the lock, a ping is a round trip
+            if self._is_usable(conn, idle_since):
+                return conn
+            self._discard(conn)
+
+        return self._connect()
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """
+        Returns a connection to the pool.
+        :param discard: the connection is closed instead, e.g. after a failure.
+        """
+        if os.getpid() != self._pid:
+            # checked out before a fork, the new process owns none of these
+            return
+        if discard or conn.closed:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            self._idle.append((conn, time()))
+            self._lock.notify()
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+
+    def closeall(self) -> None:
+        """
+        Closes the idle connections, the ones in use are closed when returned.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
 
-    @classmethod
-    def clear_cache(cls):
-        cls._cache = queue.Queue(maxsize=5)
+
+class Cursor(object):
+    """
+    Borrows a connection from a pool and returns an open cursor, committing and
+    returning the connection on exit.
+    # Use as context manager
+    with Cursor(pool) as cur:
+        cur.execute(query)
+        ...
+    """
+    def __init__(self, pool: ConnectionPool, dictionary=False, **options):
+        # other options (e.g. buffered) do not apply to psycopg2, results are always fetched whole
+        super().__init__()
+        self.pool = pool
+        self.dictionary = dictionary
 
     def __enter__(self):
+        self.conn = self.pool.getconn()
         if self.dictionary:
             self.cursor = self.conn.cursor(cursor_factory=DictCursor)
         else:
@@ -200,15 +587,17 @@ class Cursor(object):
         return self.cursor
 
     def __exit__(self, extype, exvalue, traceback):
-        # if we had a PostgreSQL related error we try to rollback the cursor.
-        if extype is psycopg2.DatabaseError:
-            self.cursor.rollback()
-
-        self.cursor.close()
-        self.conn.commit()
-
-        # Put it back on the queue
+        broken = False
         try:
-            self._cache.put_nowait(self.conn)
-        except queue.Full:
-            self.conn.close()
\ No newline at end of file
+            self.cursor.close()
+            if extype is None:
+                self.conn.commit()
+            else:
+                # leave no failed transaction behind for the next borrower
+                self.conn.rollback()
+        except psycopg2.Error:
+            broken = True
+            if extype is None:
+                raise
+        finally:
+            self.pool.putconn(self.conn, discard=broken or bool(self.conn.closed))
@@ -0,0 +1,88 @@
+import os
+import json
+import tempfile
+from typing import Dict, Iterable, List, Optional
+
+
+MANIFEST_VERSION = 1
+
+
+class DirectoryManifest:
+    """
+    Persistent record of the files already crawled: path -> [size, mtime_ns, inode, sha1].
+    A file whose size, modification time and inode did not change since its entry
+    was written is assumed to keep its SHA1, so it does not have to be read again.
+
+    manifest = DirectoryManifest.load(manifest_path)
+    file_key = DirectoryManifest.file_key(os.stat(path))
+    file_hash = manifest.lookup(path, file_key)
+    ...
+    manifest.update(path, file_key, file_hash)
+    manifest.save()
+    """
+    def __init__(self, path: str, entries: Dict[str, List] = None):
+        self.path = path
+        self.entries = entries or {}
+
+    @classmethod
+    def load(cls, path: str) -> "DirectoryManifest":
+        """
+        Reads a manifest, starting an empty one when the file is missing, unreadable or outdated.
+        :param path: path to the JSON manifest.
+        """
+        try:
+            with open(path, "r") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return cls(path)
+
+        if not isinstance(content, dict) or content.get("version") != MANIFEST_VERSION:
+            return cls(path)
+        return cls(path, content.get("files", {}))
+
+    @staticmethod
+    def file_key(stat: os.stat_result) -> List[int]:
+        """
+        :param stat: stat of a file.
+        :return: the [size, mtime_ns, inode] a manifest entry is valid for.
+        """
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def lookup(self, file_path: str, file_key: List[int]) -> Optional[str]:
+        """
+        :param file_path: path of a crawled file.
+        :param file_key: current key of the file, see `file_key`.
+        :return: the recorded SHA1, or None if the file is new or changed.
+        """
+        entry = self.entries.get(file_path)
+        if entry is None or entry[:3] != file_key:
+            return None
+        return entry[3]
+
+    def update(self, file_path: str, file_key: List[int], file_hash: str) -> None:
+        self.entries[file_path] = [*file_key, file_hash]
+
+    def prune(self, file_paths: Iterable[str]) -> None:
+        """
+        Drops the entries of the files that disappeared.
+        :param file_paths: paths of every file found by the crawl.
+        """
+        file_paths = set(file_paths)
+        self.entries = {p: entry for p, entry in self.entries.items() if p in file_paths}
+
+    def save(self) -> None:
+        """
+        Writes the manifest atomically, a crash never leaves a truncated file behind.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".manifest-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": MANIFEST_VERSION, "files": self.entries}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,109 @@
+import os
+import json
+import zipfile
+import tempfile
+from hashlib import sha1
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from pyyaap.config.fingerprint import (
+    FP_SPEC_OVERLAP, FP_SPEC_WIN_SIZE, FP_SPEC_ENGINE, FP_ANALYSIS_FREQ,
+    FP_CHANNEL_STRATEGY, FP_SILENCE_GATE, FP_SILENCE_DB,
+    FP_PEAK_WIN_SIZE, FP_PEAK_MIN_AMP,
+    FP_PEAK_BUDGET, FP_PEAK_BUDGET_FRAMES, FP_PEAK_BUDGET_BINS,
+)
+
+
+PEAK_CACHE_VERSION = 1
+
+# fingerprint settings the peaks depend on, with their defaults; the hashing ones are not
+PEAK_PARAMETERS = {
+    "window_sz": FP_SPEC_WIN_SIZE,
+    "overlap_ratio": FP_SPEC_OVERLAP,
+    "spec_engine": FP_SPEC_ENGINE,
+    "analysis_freq": FP_ANALYSIS_FREQ,
+    "channel_strategy": FP_CHANNEL_STRATEGY,
+    "silence_gate": FP_SILENCE_GATE,
+    "silence_db": FP_SILENCE_DB,
+    "amp_min": FP_PEAK_MIN_AMP,
+    "spec_win_size": FP_PEAK_WIN_SIZE,
+    "peak_budget": FP_PEAK_BUDGET,
+    "budget_frames": FP_PEAK_BUDGET_FRAMES,
+    "budget_bins": FP_PEAK_BUDGET_BINS,
+}
+
+
+class PeakCache:
+    """
+    On-disk store of the peak constellations of crawled files, one compressed .npz per
+    file SHA1 and peak configuration. Hashing parameters (FP_N_NEIGHBOURS, FP_HASH_DELTA_*)
+    are not part of the key, so files can be hashed again without being decoded.
+
+    peak_cache = PeakCache(cache_path)
+    peaks = peak_cache.load(file_hash, limit, **config)
+    if peaks is None:
+        peaks = get_channel_peaks(channels, **config)
+        peak_cache.store(file_hash, peaks, limit, **config)
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def parameters_key(limit=None, **config) -> str:
+        """
+        :param limit: seconds of the file that were fingerprinted, None for all of them.
+        :param config: fingerprint configuration.
+        :return: a digest of everything besides the file the peaks depend on.
+        """
+        parameters = {name: config.get(name, default) for name, default in PEAK_PARAMETERS.items()}
+        parameters.update(limit=limit, version=PEAK_CACHE_VERSION)
+        return sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:16]
+
+    def _entry_path(self, file_hash: str, limit=None, **config) -> str:
+        # a level of subdirectories keeps directories small on large catalogues
+        name = f"{file_hash}-{self.parameters_key(limit, **config)}.npz"
+        return os.path.join(self.path, file_hash[:2], name)
+
+    def load(self, file_hash: str, limit=None, **config) -> Optional[List[Tuple[np.ndarray, np.ndarray]]]:
+        """
+        :param file_hash: SHA1 of the file.
+        :param limit: seconds of the file that are fingerprinted.
+        :param config: fingerprint configuration.
+        :return: the (f, t) arrays of every channel, or None if they were never stored.
+        """
+        try:
+            with np.load(self._entry_path(file_hash, limit, **config)) as entry:
+                return [
+                    (entry[f"f_{channel}"].astype(np.int64), np.cumsum(entry[f"dt_{channel}"], dtype=np.int64))
+                    for channel in range(int(entry["n_channels"]))
+                ]
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+
+    def store(self, file_hash: str, peaks: List[Tuple[np.ndarray, np.ndarray]], limit=None, **config) -> None:
+        """
+        Writes the peaks of a file atomically, so concurrent workers never read half an entry.
+        :param file_hash: SHA1 of the file.
+        :param peaks: the (f, t) arrays of every channel.
+        :param limit: seconds of the file that were fingerprinted.
+        :param config: fingerprint configuration.
+        """
+        arrays = {"n_channels": np.array(len(peaks))}
+        for channel, (f, t) in enumerate(peaks):
+            # hashing sorts peaks by time anyway; time deltas compress far better than frames
+            order = np.lexsort((f, t))
+            arrays[f"f_{channel}"] = f[order].astype(np.uint16)
+            arrays[f"dt_{channel}"] = np.diff(t[order], prepend=0).astype(np.uint32)
+
+        entry_path = self._entry_path(file_hash, limit, **config)
+        directory = os.path.dirname(entry_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".peaks-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
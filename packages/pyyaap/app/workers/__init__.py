@@ -1,2 +1,2 @@
 from pyyaap.app.workers.crawler import FingerpintCrawler
-from pyyaap.app.workers.recognizer import AudioRecognizer
+from pyyaap.app.workers.recognizer import AudioRecognizer, AsyncAudioRecognizer
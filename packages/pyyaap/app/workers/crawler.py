@@ -3,19 +3,30 @@ import sys
 import traceback
 import logging
 import multiprocessing
+import multiprocessing.pool
 from itertools import groupby
 from time import time
 from typing import Dict, List, Tuple
 
+import numpy as np
+
 import pyyaap.codec.decode as audio_codec
-from pyyaap.matching.signal.fingerprint import fingerprint
+from pyyaap.matching.signal.fingerprint import fingerprint_peaks
+from pyyaap.matching.signal.segments import SharedChannels, get_channel_peaks_segmented, get_task_count
+from pyyaap.matching.signal.hashes import Fingerprints, SharedFingerprints
 
 from pyyaap.app.core.db import BaseDatabase
+from pyyaap.app.core.manifest import DirectoryManifest
+from pyyaap.app.core.peak_cache import PeakCache
 from pyyaap.config.app import (
     FIELD_FILE_SHA1, AUDIO_NAME, TOPN
 )
 
 
+# fingerprints of fewer pairs are cheaper to pickle than to pass through shared memory
+SHARED_FINGERPRINTS_MIN = 2**18
+
+
 class FingerpintCrawler:
     def __init__(self, config: Dict, db: BaseDatabase):
         self.config = config
@@ -27,6 +38,12 @@ class FingerpintCrawler:
         if self.limit == -1:  # for JSON compatibility
             self.limit = None
 
+        # JSON manifest of the crawled files, None hashes every file on every session
+        self.manifest_path = self.config.get("manifest_path", None)
+
+        # directory of cached peak constellations, None decodes every file to fingerprint
+        self.peak_cache_path = self.config.get("peak_cache_path", None)
+
     def __load_fingerprinted_audio_hashes(self) -> None:
         # get audios previously indexed
         self.audios = self.db.get_audios()
@@ -58,77 +75,257 @@ class FingerpintCrawler:
         else:
             nprocesses = 1 if nprocesses <= 0 else nprocesses
 
-        pool = multiprocessing.Pool(nprocesses)
+        # files unchanged since the manifest recorded them are not read at all
+        manifest = DirectoryManifest.load(self.manifest_path) if self.manifest_path else None
 
+        file_keys = {}
         filenames_to_fingerprint = []
-        for filename, ext in audio_codec.find_files(path, extensions):
-            # don't refingerprint already fingerprinted files
-            if audio_codec.compute_binary_hash(filename) in self.audiohashes_set:
-                logging.info(f"{filename} already fingerprinted, continuing...")
+        for filename, ext, entry in audio_codec.scan_files(path, extensions):
+            file_keys[filename] = DirectoryManifest.file_key(entry.stat())
+            file_hash = manifest.lookup(filename, file_keys[filename]) if manifest is not None else None
+            if file_hash in self.audiohashes_set:
                 continue
 
-            filenames_to_fingerprint.append(filename)
+            # a hash known from the manifest lets the worker find cached peaks without reading the file
+            filenames_to_fingerprint.append((filename, file_hash))
+
+        logging.info(f"{len(filenames_to_fingerprint)} of {len(file_keys)} files are new or changed")
+
+        # workers hash files while decoding them and skip the ones already fingerprinted;
+        # without a manifest every file is hashed first, so known ones are never decoded
+        pool = multiprocessing.Pool(
+            nprocesses, initializer=FingerpintCrawler._init_worker,
+            initargs=(frozenset(self.audiohashes_set), nprocesses, manifest is None)
+        )
 
         # Prepare _fingerprint_worker input
-        worker_input = list(zip(filenames_to_fingerprint, [self.limit] * len(filenames_to_fingerprint)))
+        worker_input = [
+            (filename, file_hash, self.limit, self.config) for filename, file_hash in filenames_to_fingerprint
+        ]
 
         # Send off our tasks
         iterator = pool.imap_unordered(FingerpintCrawler._fingerprint_worker, worker_input)
 
         # Loop till we have all of them
+        long_files = []
+        try:
+            while True:
+                try:
+                    file_name, audio_name, extension, hashes, file_hash = next(iterator)
+                except multiprocessing.TimeoutError:
+                    continue
+                except StopIteration:
+                    break
+                except Exception:
+                    logging.info("Failed fingerprinting")
+                    # logging.info traceback because we can't reraise it here
+                    traceback.print_exc(file=sys.stdout)
+                else:
+                    # decoded channels of a file to split over the whole pool
+                    if isinstance(hashes, SharedChannels):
+                        long_files.append((file_name, audio_name, extension, hashes, file_hash))
+                        continue
+                    if not isinstance(hashes, SharedFingerprints):
+                        self.__store_fingerprints(file_name, audio_name, extension, hashes, file_hash, manifest, file_keys)
+                        continue
+
+                    # the block is released once the hashes are written
+                    with hashes.attach() as hashes:
+                        self.__store_fingerprints(file_name, audio_name, extension, hashes, file_hash, manifest, file_keys)
+
+            # the long files are spread over the pool once every core is free, from the
+            # channels their workers decoded
+            while long_files:
+                file_name, audio_name, extension, record, file_hash = long_files.pop(0)
+                try:
+                    with record.attach() as channels:
+                        hashes = FingerpintCrawler.get_channel_fingerprints(
+                            file_name, channels, record.framerate, file_hash, self.limit, print_output=True,
+                            pool=pool, n_workers=nprocesses, **self.config
+                        )
+                except Exception:
+                    logging.info("Failed fingerprinting")
+                    traceback.print_exc(file=sys.stdout)
+                else:
+                    self.__store_fingerprints(file_name, audio_name, extension, hashes, file_hash, manifest, file_keys)
+        except Exception:
+            # workers give the shared memory blocks of their results away, only attaching them unlinks them
+            FingerpintCrawler._release_results(iterator, long_files)
+            raise
+        except BaseException:
+            # an interrupted crawl does not wait for the remaining files
+            pool.terminate()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+
+        if manifest is not None:
+            manifest.prune(file_keys)
+            manifest.save()
+
+    def __store_fingerprints(self, file_name: str, audio_name: str, extension: str, hashes: Fingerprints,
+                             file_hash: str, manifest: DirectoryManifest, file_keys: Dict[str, List[int]]) -> None:
+        if manifest is not None:
+            manifest.update(file_name, file_keys[file_name], file_hash)
+
+        # known before the run, or a copy of a file fingerprinted during it
+        if hashes is None or file_hash in self.audiohashes_set:
+            logging.info(f"{audio_name + extension} already fingerprinted, continuing...")
+            return
+
+        sid = self.db.insert_audio(
+            audio_name + extension, file_hash, len(hashes)
+        )
+
+        self.db.insert_hashes(sid, hashes)
+        self.db.set_audio_fingerprinted(sid)
+        self.__load_fingerprinted_audio_hashes()
+
+    @staticmethod
+    def _release_results(iterator: multiprocessing.pool.IMapIterator,
+                         long_files: List[Tuple[str, str, str, SharedChannels, str]]) -> None:
+        """
+        Unlinks the shared memory blocks of the results a failed crawl does not store,
+        waiting for the files still being fingerprinted.
+        """
+        while long_files:
+            with long_files.pop()[3].attach():
+                pass
+
         while True:
             try:
-                audio_name, extension, hashes, file_hash = next(iterator)
-            except multiprocessing.TimeoutError:
-                continue
+                _, _, _, hashes, _ = next(iterator)
             except StopIteration:
                 break
             except Exception:
-                logging.info("Failed fingerprinting")
-                # logging.info traceback because we can't reraise it here
-                traceback.print_exc(file=sys.stdout)
-            else:
-                sid = self.db.insert_audio(
-                    audio_name + extension, file_hash, len(hashes)
-                )
+                continue
+            if isinstance(hashes, (SharedChannels, SharedFingerprints)):
+                with hashes.attach():
+                    pass
 
-                self.db.insert_hashes(sid, hashes)
-                self.db.set_audio_fingerprinted(sid)
-                self.__load_fingerprinted_audio_hashes()
+    # SHA1 of the audios fingerprinted before the run, size of the pool and whether files
+    # are hashed before being decoded, set in every worker process
+    _known_hashes = frozenset()
+    _n_workers = 1
+    _hash_first = False
 
-        pool.close()
-        pool.join()
+    @staticmethod
+    def _init_worker(known_hashes: frozenset, n_workers: int, hash_first: bool) -> None:
+        FingerpintCrawler._known_hashes = known_hashes
+        FingerpintCrawler._n_workers = n_workers
+        FingerpintCrawler._hash_first = hash_first
 
     @staticmethod
     def _fingerprint_worker(arguments):
         # Pool.imap sends arguments as tuples so we have to unpack
         # them ourself.
         try:
-            file_name, limit = arguments
+            file_name, file_hash, limit, config = arguments
         except ValueError:
             pass
 
         audio_name, extension = os.path.splitext(os.path.basename(file_name))
 
-        fingerprints, file_hash = FingerpintCrawler.get_file_fingerprints(file_name, limit, print_output=True)
+        fingerprints, file_hash = FingerpintCrawler.get_file_fingerprints(
+            file_name, limit, print_output=True, known_hashes=FingerpintCrawler._known_hashes,
+            file_hash=file_hash, hash_first=FingerpintCrawler._hash_first,
+            n_workers=FingerpintCrawler._n_workers, **config
+        )
+
+        if isinstance(fingerprints, Fingerprints) and len(fingerprints) >= SHARED_FINGERPRINTS_MIN:
+            # only the name of a shared memory block goes through the pool
+            fingerprints = SharedFingerprints.export(fingerprints)
 
-        return audio_name, extension, fingerprints, file_hash
+        return file_name, audio_name, extension, fingerprints, file_hash
 
     @staticmethod
-    def get_file_fingerprints(file_name: str, limit: int, print_output: bool = False):
-        channels, framerate, _, file_hash = audio_codec.read_file(file_name, limit)
-        
-        fingerprints = set()
-        channel_amount = len(channels)
-        for channeln, channel in enumerate(channels, start=1):
-            if print_output:
-                logging.info(f"Fingerprinting channel {channeln}/{channel_amount} for {file_name}")
+    def get_file_fingerprints(file_name: str, limit: int, print_output: bool = False,
+                              known_hashes: frozenset = frozenset(), file_hash: str = None,
+                              hash_first: bool = False, peak_cache_path: str = None,
+                              pool: multiprocessing.pool.Pool = None, n_workers: int = 1, **config):
+        """
+        Decodes and fingerprints a file, its SHA1 being computed in the same read.
+        With a peak cache, files of known SHA1 whose peaks are cached are not read at all.
+        :param known_hashes: SHA1 of files not to fingerprint again.
+        :param file_hash: SHA1 of the file if already known, e.g. from the crawl manifest.
+        :param hash_first: hash the file before decoding it when `file_hash` is not given,
+            so known files are skipped at the cost of a second read of the new ones.
+        :param peak_cache_path: directory of a `PeakCache`, None disables it.
+        :param pool: process pool the channels and time segments of long files are fingerprinted on.
+        :param n_workers: processes of `pool`, or of the pool this worker belongs to.
+        :return: a tuple of (fingerprints, SHA1), fingerprints being None for known files
+            and the `SharedChannels` of files to split over `n_workers` when no pool is given.
+        """
+        if file_hash is None and hash_first:
+            # reading the file is far cheaper than decoding it and computing its spectrogram
+            with open(file_name, 'rb') as fd:
+                file_hash = audio_codec.compute_binary_hash(fd)
+        if file_hash in known_hashes:
+            return None, file_hash
 
-            hashes = fingerprint(channel, freq=framerate)
+        peak_cache = PeakCache(peak_cache_path) if peak_cache_path else None
+        # a file of unknown hash is new or changed and hardly ever cached, it is not read
+        # just to look for it: the hash comes from the decoding read
+        if peak_cache is not None and file_hash is not None:
+            peaks = peak_cache.load(file_hash, limit, **config)
+            if peaks is not None:
+                fingerprints = fingerprint_peaks(peaks, **config)
+                if print_output:
+                    logging.info(f"Hashed the cached peaks of {file_name}: {len(fingerprints)} hashes")
+                return fingerprints, file_hash
 
-            if print_output:
-                logging.info(f"Finished channel {channeln}/{channel_amount} for {file_name}")
+        channels, framerate, _, file_hash = audio_codec.read_file(file_name, limit)
+        if file_hash in known_hashes:
+            return None, file_hash
 
-            fingerprints |= set(hashes)
+        n_tasks = get_task_count(len(channels[0]), len(channels), n_workers, **{**config, 'freq': framerate})
+        if pool is None and n_tasks > 1:
+            # pool workers cannot start processes of their own, the decoded record is handed over
+            return SharedChannels.export(channels, framerate), file_hash
 
+        fingerprints = FingerpintCrawler.get_channel_fingerprints(
+            file_name, channels, framerate, file_hash, limit, print_output,
+            peak_cache_path=peak_cache_path, pool=pool, n_workers=n_workers, **config
+        )
         return fingerprints, file_hash
+
+    @staticmethod
+    def get_channel_fingerprints(file_name: str, channels: List[np.ndarray], framerate: int, file_hash: str,
+                                 limit: int, print_output: bool = False, peak_cache_path: str = None,
+                                 pool: multiprocessing.pool.Pool = None, n_workers: int = 1,
+                                 **config) -> Fingerprints:
+        """
+        Fingerprints the decoded channels of a file, and caches their peaks.
+        :param file_hash: SHA1 of the file, the peaks are cached under it.
+        :param peak_cache_path: directory of a `PeakCache`, None disables it.
+        :param pool: process pool the channels and time segments of long files are fingerprinted on.
+        :param n_workers: processes of `pool`.
+        :return: the fingerprints of the file.
+        """
+        n_tasks = 1
+        if pool is not None:
+            n_tasks = get_task_count(len(channels[0]), len(channels), n_workers, **{**config, 'freq': framerate})
+        if print_output:
+            logging.info(f"Fingerprinting {len(channels)} channel(s) of {file_name}" + (
+                f" in {n_tasks} parallel segments" if n_tasks > 1 else ""
+            ))
+
+        stats = {}
+        peaks = get_channel_peaks_segmented(
+            channels, pool, n_workers, **{**config, 'freq': framerate, 'stats': stats}
+        )
+        if peak_cache_path:
+            PeakCache(peak_cache_path).store(file_hash, peaks, limit, **config)
+        fingerprints = fingerprint_peaks(peaks, **config)
+
+        if print_output:
+            logging.info(f"Finished {file_name}: {len(fingerprints)} hashes")
+
+        if print_output and stats.get("frames_skipped"):
+            logging.info(f"Skipped {stats['frames_skipped'] / stats['frames']:.1%} of the frames of {file_name} as silent")
+
+        if print_output and stats.get("peaks_dropped"):
+            logging.info(f"Peak budget dropped {stats['peaks_dropped']} of {stats['peaks'] + stats['peaks_dropped']} peaks for {file_name}")
+
+        return fingerprints
@@ -1,21 +1,27 @@
 import os
 import sys
+import asyncio
+import concurrent.futures
+import multiprocessing
+import multiprocessing.pool
 import traceback
 import numpy as np
+from functools import partial
 from itertools import groupby
 from time import time
 from typing import Dict, List, Tuple
 
 
 import pyyaap.codec.decode as decoder
-from pyyaap.matching.signal.fingerprint import fingerprint
+from pyyaap.matching.signal.segments import fingerprint_channels_segmented, get_task_count
+from pyyaap.matching.signal.hashes import Fingerprints
 from pyyaap.app.core.db import BaseDatabase
 from pyyaap.config.app import (
     FIELD_FILE_SHA1, FIELD_TOTAL_HASHES, 
     FINGERPRINTED_CONFIDENCE,FINGERPRINTED_HASHES, 
     HASHES_MATCHED, INPUT_CONFIDENCE, INPUT_HASHES, 
     OFFSET, OFFSET_SECS, AUDIO_ID, AUDIO_NAME, TOPN, TOTAL_TIME, 
-    FINGERPRINT_TIME, QUERY_TIME, ALIGN_TIME, RESULTS
+    FINGERPRINT_TIME, QUERY_TIME, ALIGN_TIME, RESULTS, PEAKS_DROPPED, SILENCE_SKIPPED
 )
 from pyyaap.config.fingerprint import (
     FP_SPEC_FREQ, FP_SPEC_OVERLAP, FP_SPEC_WIN_SIZE
@@ -29,21 +35,74 @@ class AudioRecognizer:
 
         self.limit = None
 
-    def generate_fingerprints(self, samples: np.ndarray, Fs=FP_SPEC_FREQ) -> Tuple[List[Tuple[str, int]], float]:
+        # processes long inputs are split over in time segments, None fingerprints them in-process;
+        # spawned rather than forked, services create recognizers while other threads run
+        self.segment_workers = self.config.get("segment_workers", None)
+        self._segment_pool = None
+        if self.segment_workers:
+            self._segment_pool = multiprocessing.get_context("spawn").Pool(self.segment_workers)
+
+        # align matches in the database, which must provide `return_aligned_matches`
+        self.server_alignment = self.config.get("server_alignment", False)
+
+    def close(self) -> None:
+        """
+        Stops the segment pool, long inputs are fingerprinted in-process afterwards.
+        """
+        if self._segment_pool is not None:
+            pool, self._segment_pool = self._segment_pool, None
+            pool.close()
+            pool.join()
+
+    def __enter__(self) -> "AudioRecognizer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _get_segment_pool(self, channels: List[np.ndarray], Fs: int) -> multiprocessing.pool.Pool:
+        """
+        :return: the pool to fingerprint `channels` on, or None for inputs too short to be split.
+        """
+        if self._segment_pool is None or not len(channels):
+            return None
+        if get_task_count(len(channels[0]), len(channels), self.segment_workers, **{**self.config, 'freq': Fs}) == 1:
+            return None
+        return self._segment_pool
+
+    def generate_fingerprints(self, samples: np.ndarray, Fs=FP_SPEC_FREQ,
+                              stats: Dict[str, int] = None) -> Tuple[Fingerprints, float]:
         f"""
             Generate the fingerprints for the given sample data (channel).
             :param samples: numpy array represents the channel info of the given audio file.
-            :return: a list of tuples for hash and its corresponding offset, together with the generation time.
+            :param stats: if given, collects the peak counters of the fingerprinting.
+            :return: the (hash, offset) pairs of the channel, together with the generation time.
+        """
+        if not isinstance(samples, np.ndarray) or samples.ndim != 1:
+            # several channels go through generate_channel_fingerprints
+            raise TypeError("generate_fingerprints expects the samples of a single channel")
+        return self.generate_channel_fingerprints([samples], Fs=Fs, stats=stats)
+
+    def generate_channel_fingerprints(self, channels: List[np.ndarray], Fs=FP_SPEC_FREQ,
+                                      stats: Dict[str, int] = None) -> Tuple[Fingerprints, float]:
+        """
+            Generate the fingerprints for all the channels of an audio, following the channel strategy of the config.
+            :param channels: numpy arrays representing the channels of the given audio file.
+            :param stats: if given, collects the peak counters of the fingerprinting.
+            :return: the unique (hash, offset) pairs of the channels, together with the generation time.
         """
         t = time()
-        hashes = fingerprint(samples, **{**self.config, 'freq':Fs})
+        hashes = fingerprint_channels_segmented(
+            channels, self._get_segment_pool(channels, Fs), self.segment_workers,
+            **{**self.config, 'freq':Fs, 'stats': stats}
+        )
         fingerprint_time = time() - t
         return hashes, fingerprint_time
 
-    def find_matches(self, hashes: List[Tuple[str, int]]) -> Tuple[List[Tuple[int, int]], Dict[str, int], float]:
+    def find_matches(self, hashes: Fingerprints) -> Tuple[List[Tuple[int, int]], Dict[str, int], float]:
         """
         Finds the corresponding matches on the fingerprinted audios for the given hashes.
-        :param hashes: list of tuples for hashes and their corresponding offsets
+        :param hashes: hashes and their corresponding offsets
         :return: a tuple containing the matches found against the db, a dictionary which counts the different
          hashes matched for each audio (with the audio id as key), and the time that the query took.
         """
@@ -53,6 +112,22 @@ class AudioRecognizer:
 
         return matches, dedup_hashes, query_time
 
+    def find_aligned_matches(self, hashes: Fingerprints, topn: int = TOPN) \
+            -> Tuple[List[Tuple[int, int, int]], Dict[int, int], float]:
+        """
+        Finds the best aligned matches of the given hashes in the database itself, so only
+        the `topn` best candidates are transferred instead of every matching row.
+        :param hashes: hashes and their corresponding offsets
+        :param topn: number of candidates being returned back.
+        :return: a tuple containing the (audio id, offset difference, count) candidates, best first,
+         a dictionary which counts the hashes matched for each of them, and the time that the query took.
+        """
+        t = time()
+        candidates, dedup_hashes = self.db.return_aligned_matches(hashes, topn)
+        query_time = time() - t
+
+        return candidates, dedup_hashes, query_time
+
     def align_matches(self, matches: List[Tuple[int, int]], dedup_hashes: Dict[str, int], queried_hashes: int,
                       topn: int = TOPN) -> List[Dict[str, any]]:
         """
@@ -65,6 +140,16 @@ class AudioRecognizer:
         :param topn: number of results being returned back.
         :return: a list of dictionaries (based on topn) with match information.
         """
+        return self.describe_matches(self.rank_matches(matches, topn), dedup_hashes, queried_hashes)
+
+    @staticmethod
+    def rank_matches(matches: List[Tuple[int, int]], topn: int = TOPN) -> List[Tuple[int, int, int]]:
+        """
+        Finds the offset difference most matches of each audio agree on.
+        :param matches: (audio id, offset difference) matches from the database
+        :param topn: number of candidates being returned back.
+        :return: the (audio id, offset difference, count) candidates of the topn audios, best first.
+        """
         # count offset occurrences per audio and keep only the maximum ones.
         sorted_matches = sorted(matches, key=lambda m: (m[0], m[1]))
         counts = [(*key, len(list(group))) for key, group in groupby(sorted_matches, key=lambda m: (m[0], m[1]))]
@@ -73,69 +158,165 @@ class AudioRecognizer:
             key=lambda count: count[2], reverse=True
         )
 
-        audios_result = []
-        for audio_id, offset, _ in audios_matches[0:topn]:  # consider topn elements in the result
-            audio = self.db.get_audio_by_id(audio_id)
-
-            audio_name = audio.get(AUDIO_NAME, None)
-            audio_hashes = audio.get(FIELD_TOTAL_HASHES, None)
-            nseconds = round(float(offset) / FP_SPEC_FREQ * FP_SPEC_WIN_SIZE * FP_SPEC_OVERLAP, 5)
-            hashes_matched = dedup_hashes[audio_id]
-
-            audio = {
-                AUDIO_ID: str(audio_id),
-                AUDIO_NAME: str(audio_name),
-                # INPUT_HASHES: queried_hashes,
-                # FINGERPRINTED_HASHES: audio_hashes,
-                # HASHES_MATCHED: hashes_matched,
-                # Percentage regarding hashes matched vs hashes from the input.
-                INPUT_CONFIDENCE: round(hashes_matched / queried_hashes, 2),
-                # Percentage regarding hashes matched vs hashes fingerprinted in the db.
-                FINGERPRINTED_CONFIDENCE: round(hashes_matched / audio_hashes, 2),
-                # OFFSET: offset,
-                # OFFSET_SECS: nseconds,
-                # FIELD_FILE_SHA1: audio.get(FIELD_FILE_SHA1, None).encode("utf8")
-            }
-
-            audios_result.append(audio)
-
-        return audios_result
-
-    def _recognize(self, *data, freq=FP_SPEC_FREQ) -> Tuple[List[Dict[str, any]], int, int, int]:
-        fingerprint_times = []
-        hashes = set()  # to remove possible duplicated fingerprints we built a set.
-        for channel in data:
-            fingerprints, fingerprint_time = self.generate_fingerprints(channel, Fs=freq)
-            fingerprint_times.append(fingerprint_time)
-            hashes |= set(fingerprints)
-
-        matches, dedup_hashes, query_time = self.find_matches(hashes)
+        return audios_matches[0:topn]  # consider topn elements in the result
 
-        t = time()
-        final_results = self.align_matches(matches, dedup_hashes, len(hashes))
-        align_time = time() - t
+    def describe_matches(self, candidates: List[Tuple[int, int, int]], dedup_hashes: Dict[int, int],
+                         queried_hashes: int) -> List[Dict[str, any]]:
+        """
+        Builds the results of the aligned candidates.
+        :param candidates: (audio id, offset difference, count) tuples, best first.
+        :param dedup_hashes: dictionary containing the hashes matched for each audio (key is the audio id).
+        :param queried_hashes: amount of hashes sent for matching against the db
+        :return: a list of dictionaries with match information.
+        """
+        return [
+            self._describe_match(audio_id, offset, self.db.get_audio_by_id(audio_id), dedup_hashes, queried_hashes)
+            for audio_id, offset, _ in candidates
+        ]
 
-        return final_results, np.sum(fingerprint_times), query_time, align_time
+    @staticmethod
+    def _describe_match(audio_id: int, offset: int, audio: Dict[str, any], dedup_hashes: Dict[int, int],
+                        queried_hashes: int) -> Dict[str, any]:
+        audio_name = audio.get(AUDIO_NAME, None)
+        audio_hashes = audio.get(FIELD_TOTAL_HASHES, None)
+        nseconds = round(float(offset) / FP_SPEC_FREQ * FP_SPEC_WIN_SIZE * FP_SPEC_OVERLAP, 5)
+        hashes_matched = dedup_hashes[audio_id]
 
-    def recognize(self, type, **payload) -> Dict[str, any]:
-        framerate = FP_SPEC_FREQ
-        if type == 'file':
-            record = decoder.read_file(payload["payload"], self.limit, ext=payload['ext'])
-            channels = record.channels
-            framerate = record.framerate
+        return {
+            AUDIO_ID: str(audio_id),
+            AUDIO_NAME: str(audio_name),
+            # INPUT_HASHES: queried_hashes,
+            # FINGERPRINTED_HASHES: audio_hashes,
+            # HASHES_MATCHED: hashes_matched,
+            # Percentage regarding hashes matched vs hashes from the input.
+            INPUT_CONFIDENCE: round(hashes_matched / queried_hashes, 2),
+            # Percentage regarding hashes matched vs hashes fingerprinted in the db.
+            FINGERPRINTED_CONFIDENCE: round(hashes_matched / audio_hashes, 2),
+            # OFFSET: offset,
+            # OFFSET_SECS: nseconds,
+            # FIELD_FILE_SHA1: audio.get(FIELD_FILE_SHA1, None).encode("utf8")
+        }
+
+    def _recognize(self, *data, freq=FP_SPEC_FREQ,
+                   stats: Dict[str, int] = None) -> Tuple[List[Dict[str, any]], int, int, int]:
+        hashes, fingerprint_time = self.generate_channel_fingerprints(data, Fs=freq, stats=stats)
+
+        if self.server_alignment:
+            candidates, dedup_hashes, query_time = self.find_aligned_matches(hashes)
+
+            t = time()
+            final_results = self.describe_matches(candidates, dedup_hashes, len(hashes))
+            align_time = time() - t
         else:
-            channels = payload['channels']        
+            matches, dedup_hashes, query_time = self.find_matches(hashes)
 
-        t = time()
-        matches, fingerprint_time, query_time, align_time = self._recognize(*channels, freq=framerate)
-        t = time() - t
+            t = time()
+            final_results = self.align_matches(matches, dedup_hashes, len(hashes))
+            align_time = time() - t
 
-        results = {
-            TOTAL_TIME: t,
+        return final_results, fingerprint_time, query_time, align_time
+
+    def _read_channels(self, type, **payload) -> Tuple[List[np.ndarray], int]:
+        if type == 'file':
+            record = decoder.read_file(payload["payload"], self.limit, ext=payload['ext'])
+            return record.channels, record.framerate
+        return payload['channels'], FP_SPEC_FREQ
+
+    @staticmethod
+    def _report(matches: List[Dict[str, any]], total_time: float, fingerprint_time: float, query_time: float,
+                align_time: float, stats: Dict[str, int]) -> Dict[str, any]:
+        return {
+            TOTAL_TIME: total_time,
             FINGERPRINT_TIME: fingerprint_time,
             QUERY_TIME: query_time,
             ALIGN_TIME: align_time,
+            PEAKS_DROPPED: stats.get("peaks_dropped", 0),
+            SILENCE_SKIPPED: round(stats.get("frames_skipped", 0) / max(stats.get("frames", 0), 1), 4),
             RESULTS: matches
         }
 
-        return results
+    def recognize(self, type, **payload) -> Dict[str, any]:
+        channels, framerate = self._read_channels(type, **payload)
+
+        stats = {}
+        t = time()
+        matches, fingerprint_time, query_time, align_time = self._recognize(*channels, freq=framerate, stats=stats)
+        t = time() - t
+
+        return self._report(matches, t, fingerprint_time, query_time, align_time, stats)
+
+
+class AsyncAudioRecognizer(AudioRecognizer):
+    """
+    AudioRecognizer for asyncio services, on a database whose methods are coroutines such
+    as AsyncPostgreSQLDatabase. Decoding, fingerprinting and ranking run on the threads of
+    `executor`, the loop's default one if None, so the event loop keeps accepting and
+    decoding other requests while one waits on them or on the database.
+
+    recognizer = AsyncAudioRecognizer(config, AsyncPostgreSQLDatabase(**get_connection()))
+    results = await recognizer.recognize(type='file', payload=fd, ext='mp3')
+    """
+    def __init__(self, config: Dict, db, executor: concurrent.futures.Executor = None):
+        super().__init__(config, db)
+        self.executor = executor
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    async def find_matches(self, hashes: Fingerprints) -> Tuple[List[Tuple[int, int]], Dict[str, int], float]:
+        t = time()
+        matches, dedup_hashes = await self.db.return_matches(hashes)
+        query_time = time() - t
+
+        return matches, dedup_hashes, query_time
+
+    async def find_aligned_matches(self, hashes: Fingerprints, topn: int = TOPN) \
+            -> Tuple[List[Tuple[int, int, int]], Dict[int, int], float]:
+        t = time()
+        candidates, dedup_hashes = await self.db.return_aligned_matches(hashes, topn)
+        query_time = time() - t
+
+        return candidates, dedup_hashes, query_time
+
+    async def align_matches(self, matches: List[Tuple[int, int]], dedup_hashes: Dict[str, int], queried_hashes: int,
+                            topn: int = TOPN) -> List[Dict[str, any]]:
+        candidates = await self._run(self.rank_matches, matches, topn)
+        return await self.describe_matches(candidates, dedup_hashes, queried_hashes)
+
+    async def describe_matches(self, candidates: List[Tuple[int, int, int]], dedup_hashes: Dict[int, int],
+                               queried_hashes: int) -> List[Dict[str, any]]:
+        # the audios of all the candidates are fetched at once
+        audios = await asyncio.gather(*(self.db.get_audio_by_id(audio_id) for audio_id, _, _ in candidates))
+        return [
+            self._describe_match(audio_id, offset, audio, dedup_hashes, queried_hashes)
+            for (audio_id, offset, _), audio in zip(candidates, audios)
+        ]
+
+    async def _recognize(self, *data, freq=FP_SPEC_FREQ,
+                         stats: Dict[str, int] = None) -> Tuple[List[Dict[str, any]], int, int, int]:
+        hashes, fingerprint_time = await self._run(self.generate_channel_fingerprints, data, Fs=freq, stats=stats)
+
+        if self.server_alignment:
+            candidates, dedup_hashes, query_time = await self.find_aligned_matches(hashes)
+
+            t = time()
+            final_results = await self.describe_matches(candidates, dedup_hashes, len(hashes))
+            align_time = time() - t
+        else:
+            matches, dedup_hashes, query_time = await self.find_matches(hashes)
+
+            t = time()
+            final_results = await self.align_matches(matches, dedup_hashes, len(hashes))
+            align_time = time() - t
+
+        return final_results, fingerprint_time, query_time, align_time
+
+    async def recognize(self, type, **payload) -> Dict[str, any]:
+        channels, framerate = await self._run(self._read_channels, type, **payload)
+
+        stats = {}
+        t = time()
+        matches, fingerprint_time, query_time, align_time = await self._recognize(*channels, freq=framerate, stats=stats)
+        t = time() - t
+
+        return self._report(matches, t, fingerprint_time, query_time, align_time, stats)
@@ -1,37 +1,117 @@
 import os
-import fnmatch
-from typing import Dict, List, Tuple
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 
-from pyyaap.codec.decode.providers import (
-    PyDubCodec, WAVCodec
-)
-from pyyaap.codec.decode.utils import Record, compute_binary_hash
+from pyyaap.codec.decode import providers
+from pyyaap.codec.decode.utils import Record, compute_binary_hash, downmix, resample
 
 
-REGISTERED_CODECS = [
-    WAVCodec, PyDubCodec 
+# Extension -> name of the provider in pyyaap.codec.decode.providers, imported on first use
+REGISTERED_CODECS = {
+    "wav": "WAVCodec", "wave": "WAVCodec",
+    **{
+        ext: "FFmpegCodec" for ext in (
+            "mp3", "mpeg", "ogg", "oga", "opus", "m4a", "mp4", "aac",
+            "flac", "wma", "webm", "mka", "aif", "aiff", "ac3", "amr",
+        )
+    },
+}
+
+# (extension, test of the leading bytes, strong): a strong signature overrides the
+# extension, a weak one (bare MPEG frame sync) is only used when the extension is unknown
+MAGIC_SIGNATURES = [
+    ("wav", lambda b: b[:4] == b"RIFF" and b[8:12] == b"WAVE", True),
+    ("ogg", lambda b: b[:4] == b"OggS", True),
+    ("flac", lambda b: b[:4] == b"fLaC", True),
+    ("m4a", lambda b: b[4:8] == b"ftyp", True),
+    ("aiff", lambda b: b[:4] == b"FORM" and b[8:12] in (b"AIFF", b"AIFC"), True),
+    ("mka", lambda b: b[:4] == b"\x1a\x45\xdf\xa3", True),
+    ("wma", lambda b: b[:4] == b"\x30\x26\xb2\x75", True),
+    ("amr", lambda b: b[:5] == b"#!AMR", True),
+    ("mp3", lambda b: b[:3] == b"ID3", True),
+    ("ac3", lambda b: b[:2] == b"\x0b\x77", False),
+    ("aac", lambda b: len(b) > 1 and b[0] == 0xFF and b[1] & 0xF6 == 0xF0, False),
+    ("mp3", lambda b: len(b) > 1 and b[0] == 0xFF and b[1] & 0xE0 == 0xE0, False),
 ]
+MAGIC_SIZE = 12
+
+
+def sniff_format(fd: BinaryIO) -> Tuple[Optional[str], bool]:
+    """
+    Guesses the format of a file from its leading bytes, keeping the file position.
+    :param fd: seekable file object.
+    :return: a tuple of (extension or None, whether the signature is strong).
+    """
+    position = fd.tell()
+    fd.seek(0)
+    head = fd.read(MAGIC_SIZE)
+    fd.seek(position)
+
+    for ext, matches, strong in MAGIC_SIGNATURES:
+        if matches(head):
+            return ext, strong
+    return None, False
 
-def read_file(file: str, limit=1000, ext=None) -> Record:
+def get_codec(ext: str):
+    """
+    Given an extension it returns the provider registered for it, importing it if needed.
+    :param ext: file extension, without the dot.
+    :return: the codec class.
+    """
+    try:
+        return getattr(providers, REGISTERED_CODECS[ext])
+    except KeyError:
+        raise ValueError("Unsupported audio format encountered")
+
+def read_file(file: Union[str, BinaryIO], limit=1000, ext=None) -> Record:
+    """
+    Decodes a file exactly once, with the provider of its content when the leading
+    bytes identify it, otherwise with the provider of its extension.
+    :param file: path or file object of the audio.
+    :param limit: if given, only the first `limit` seconds are decoded.
+    :param ext: extension of a file object, ignored for paths.
+    :return: the decoded record.
+    """
     if isinstance(file, str):
         ext = file.split('.')[-1]
         f = open(file, 'rb')
     else:
         f = file
 
-    record = None
-    for codec in REGISTERED_CODECS:
-        if ext in codec.SUPPORTED_FORMATS:
-            record = codec.read(f, ext=ext, limit=limit)
+    try:
+        ext = ext.lower() if ext else ext
+        sniffed, strong = sniff_format(f)
+        if sniffed is not None and (strong or ext not in REGISTERED_CODECS):
+            ext = sniffed
 
-    if isinstance(file, str):
-        f.close()
-
-    if record is None:
-        raise ValueError("Unsupported audio format encountered")
+        record = get_codec(ext).read(f, ext=ext, limit=limit)
+    finally:
+        if isinstance(file, str):
+            f.close()
 
     return record
 
+def scan_files(path: str, extensions: List[str]) -> Iterator[Tuple[str, str, os.DirEntry]]:
+    """
+    Walks a directory tree in a single `os.scandir` pass, matching all extensions at once.
+    :param path: path to a directory with audio files.
+    :param extensions: file extensions to look for.
+    :return: an iterator of tuples with file name, its extension and its directory entry.
+    """
+    # Allow both with ".mp3" and without "mp3" to be used for extensions
+    extensions = {e.replace(".", "") for e in extensions}
+
+    directories = [path]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                    continue
+
+                extension = entry.name.rsplit(".", 1)[-1] if "." in entry.name else None
+                if extension in extensions and entry.is_file():
+                    yield entry.path, extension, entry
+
 def find_files(path: str, extensions: List[str]) -> List[Tuple[str, str]]:
     """
     Get all files that meet the specified extensions.
@@ -39,16 +119,7 @@ def find_files(path: str, extensions: List[str]) -> List[Tuple[str, str]]:
     :param extensions: file extensions to look for.
     :return: a list of tuples with file name and its extension.
     """
-    # Allow both with ".mp3" and without "mp3" to be used for extensions
-    extensions = [e.replace(".", "") for e in extensions]
-
-    results = []
-    for dirpath, dirnames, files in os.walk(path):
-        for extension in extensions:
-            for f in fnmatch.filter(files, f"*.{extension}"):
-                p = os.path.join(dirpath, f)
-                results.append((p, extension))
-    return results
+    return [(file_path, extension) for file_path, extension, _ in scan_files(path, extensions)]
 
 def get_audio_name_from_path(file_path: str) -> str:
     """
@@ -1,2 +1,17 @@
-from pyyaap.codec.decode.providers.pydub import PyDubCodec
-from pyyaap.codec.decode.providers.wave import WAVCodec
\ No newline at end of file
+import importlib
+
+
+# providers are imported on first access, so importing the package pulls in no decoder
+_PROVIDER_MODULES = {
+    "FFmpegCodec": "pyyaap.codec.decode.providers.ffmpeg",
+    "PyDubCodec": "pyyaap.codec.decode.providers.pydub",
+    "WAVCodec": "pyyaap.codec.decode.providers.wave",
+}
+
+__all__ = list(_PROVIDER_MODULES)
+
+
+def __getattr__(name: str):
+    if name not in _PROVIDER_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_PROVIDER_MODULES[name]), name)
@@ -1,6 +1,6 @@
 from typing import BinaryIO, Union
 
-from pyyaap.codec.decode.utils import Record, compute_binary_hash
+from pyyaap.codec.decode.utils import HashingReader, Record
 
 
 class BaseCodec:
@@ -14,9 +14,10 @@ class BaseCodec:
         else:
             fd = file
         
-        sha_signature = compute_binary_hash(fd)
-        
-        channels, framerate = cls._read_record(fd, ext, limit)
+        # the hash is computed from the bytes the codec reads, then from the rest of the file
+        reader = HashingReader(fd)
+        channels, framerate = cls._read_record(reader, ext, limit)
+        sha_signature = reader.hexdigest()
 
         fd.seek(0)
         if isinstance(file, str):
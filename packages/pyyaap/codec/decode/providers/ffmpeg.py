@@ -0,0 +1,204 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import numpy as np
+from typing import BinaryIO, Iterator, List, Tuple
+
+from pyyaap.codec.decode.providers.base import BaseCodec
+from pyyaap.codec.decode.providers.wave import WAVCodec
+
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# frames read from the pipe at once
+FFMPEG_CHUNK_FRAMES = 2**16
+# bitrate the PCM buffer is sized for: the duration it gives bounds the one of any file encoded
+# at a higher bitrate, lower ones double the buffer until their audio fits. Pages never written
+# are not committed, and the buffer is trimmed to the decoded audio.
+FFMPEG_MIN_BITRATE = 64000
+# seconds given to ffmpeg to exit by itself once its output could not be used
+FFMPEG_EXIT_TIMEOUT = 1
+
+
+class FFmpegCodec(BaseCodec):
+    """
+    Decodes anything ffmpeg reads by streaming 16-bit PCM out of an ffmpeg process.
+    ffmpeg decodes while the pipe is being read, stops at `limit` by itself, and the
+    samples land in a single preallocated buffer that the channels are views of.
+    """
+    SUPPORTED_FORMATS = [
+        "mp3", "mpeg", "ogg", "oga", "opus", "m4a", "mp4", "aac",
+        "flac", "wma", "webm", "mka", "aif", "aiff", "ac3", "amr",
+    ]
+
+    # containers whose index may sit at the end of the file, ffmpeg has to seek in them
+    SEEKING_FORMATS = [
+        "m4a", "mp4", "mov", "3gp",
+    ]
+
+    # resample to this framerate and mix to this many channels, None keeps the source ones
+    FRAMERATE = None
+    CHANNELS = None
+
+    @classmethod
+    def _spawn(cls, fd: BinaryIO, limit=None, ext=None) -> Tuple[subprocess.Popen, threading.Thread, BinaryIO]:
+        # streamable formats are piped through `fd`, so a hashing reader sees every byte ffmpeg reads
+        path = getattr(fd, "name", None)
+        from_file = ext in cls.SEEKING_FORMATS and isinstance(path, str) and os.path.isfile(path)
+
+        # a file is read with stdin closed, a piped input must not be taken for commands
+        command = [FFMPEG_BINARY] if from_file else [FFMPEG_BINARY, "-nostdin"]
+        command += ["-hide_banner", "-loglevel", "error"]
+        command += ["-i", path if from_file else "pipe:0", "-vn", "-map_metadata", "-1"]
+        if limit:
+            command += ["-t", str(limit)]
+        if cls.FRAMERATE:
+            command += ["-ar", str(cls.FRAMERATE)]
+        if cls.CHANNELS:
+            command += ["-ac", str(cls.CHANNELS)]
+        command += ["-f", "wav", "-acodec", "pcm_s16le", "-bitexact", "pipe:1"]
+
+        # errors go to a file rather than a pipe, which ffmpeg would block on once full
+        # while the decoder is still reading stdout
+        errors = tempfile.TemporaryFile()
+        try:
+            process = subprocess.Popen(
+                command, stdin=subprocess.DEVNULL if from_file else subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=errors
+            )
+        except Exception:
+            errors.close()
+            raise
+
+        feeder = None
+        if not from_file:
+            # fed while ffmpeg decodes
+            fd.seek(0)
+            feeder = threading.Thread(target=cls._feed, args=(fd, process.stdin), daemon=True)
+            feeder.start()
+
+        return process, feeder, errors
+
+    @staticmethod
+    def _feed(fd: BinaryIO, stdin: BinaryIO) -> None:
+        try:
+            shutil.copyfileobj(fd, stdin)
+        except BrokenPipeError:
+            # ffmpeg stops reading once `limit` is decoded
+            pass
+        finally:
+            stdin.close()
+
+    @staticmethod
+    def _finish(
+        process: subprocess.Popen, feeder: threading.Thread, errors: BinaryIO,
+        failed: bool = False, abandoned: bool = False
+    ) -> None:
+        """
+        Reaps the ffmpeg process, raising its own error if it failed.
+        :param failed: reading the output failed, ffmpeg is killed if it does not exit by itself.
+        :param abandoned: the output is not needed anymore, ffmpeg is killed.
+        """
+        if abandoned:
+            process.kill()
+        process.stdout.close()
+        killed = abandoned
+        if failed and not abandoned:
+            try:
+                # an output cut short usually means ffmpeg is exiting with an error
+                process.wait(timeout=FFMPEG_EXIT_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                killed = True
+        if feeder is not None:
+            feeder.join()
+        returncode = process.wait()
+        errors.seek(0)
+        stderr = errors.read().decode(errors="replace").strip()
+        errors.close()
+
+        if returncode != 0 and not killed:
+            raise ValueError(f"ffmpeg failed to decode the audio: {stderr.splitlines()[-1] if stderr else returncode}")
+
+    @classmethod
+    def _read_header(cls, process: subprocess.Popen) -> Tuple[int, int]:
+        audio_format, n_channels, framerate, f_width, _, _ = WAVCodec._parse_header(process.stdout)
+        if f_width != 2:
+            raise ValueError(f"Unexpected ffmpeg output: {8 * f_width} bits")
+        return n_channels, framerate
+
+    @classmethod
+    def stream(
+        cls, fd: BinaryIO, limit=None, chunk_frames: int = FFMPEG_CHUNK_FRAMES, ext=None
+    ) -> Tuple[int, int, Iterator[np.ndarray]]:
+        """
+        Decodes a file chunk by chunk, e.g. to feed a `StreamingFingerprinter`.
+        :param fd: file object of the encoded audio.
+        :param limit: if given, only the first `limit` seconds are decoded.
+        :param chunk_frames: frames per chunk.
+        :param ext: format of the file, seeking formats are opened by ffmpeg from their path.
+        :return: a tuple of (channels, framerate, iterator of int16 chunks shaped (frames, channels)).
+        """
+        process, feeder, errors = cls._spawn(fd, limit, ext)
+        try:
+            n_channels, framerate = cls._read_header(process)
+        except Exception:
+            cls._finish(process, feeder, errors, failed=True)
+            raise
+
+        def chunks() -> Iterator[np.ndarray]:
+            exhausted = False
+            try:
+                while True:
+                    chunk = np.empty((chunk_frames, n_channels), dtype=np.int16)
+                    n_bytes = process.stdout.readinto(memoryview(chunk).cast("B"))
+                    if not n_bytes:
+                        exhausted = True
+                        break
+                    yield chunk[:n_bytes // (2 * n_channels)]
+            finally:
+                # a consumer that stops early is not an ffmpeg failure
+                cls._finish(process, feeder, errors, abandoned=not exhausted)
+
+        return n_channels, framerate, chunks()
+
+    @classmethod
+    def _read_record(cls, fd: BinaryIO, ext=None, limit=1000) -> Tuple[List[np.ndarray], int]:
+        # measured before `fd` is handed to the feeding thread
+        fd.seek(0, 2)
+        file_size = fd.tell()
+
+        process, feeder, errors = cls._spawn(fd, limit, ext)
+        try:
+            n_channels, framerate = cls._read_header(process)
+
+            capacity = int(file_size * 8 / FFMPEG_MIN_BITRATE * framerate) + 1
+            if limit:
+                # no more than `limit` seconds are decoded
+                capacity = min(capacity, int(limit * framerate) + 1)
+            capacity = max(capacity, FFMPEG_CHUNK_FRAMES)
+
+            buffer = np.empty((capacity, n_channels), dtype=np.int16)
+            view = memoryview(buffer).cast("B")
+            filled = 0
+            while True:
+                if filled == len(view):
+                    # more audio than estimated, doubled in place when the allocator can
+                    del view
+                    buffer.resize((len(buffer) * 2, n_channels), refcheck=False)
+                    view = memoryview(buffer).cast("B")
+                n_bytes = process.stdout.readinto(view[filled:])
+                if not n_bytes:
+                    break
+                filled += n_bytes
+            del view
+        except Exception:
+            cls._finish(process, feeder, errors, failed=True)
+            raise
+        cls._finish(process, feeder, errors)
+
+        # the estimate usually overshoots, the unused tail is given back
+        buffer.resize((filled // (2 * n_channels), n_channels), refcheck=False)
+        return [buffer[:, ch] for ch in range(n_channels)], framerate
@@ -1,44 +1,119 @@
-import wave as wv
+import struct
 import numpy as np
-from typing import BinaryIO, Union
+from typing import BinaryIO, List, Tuple, Union
 
 from pyyaap.codec.decode.providers.base import BaseCodec
 from pyyaap.codec.decode.utils import Record
 
 
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# sizes of 0 and 0xFFFFFFFF are written by streaming encoders that could not seek back
+UNKNOWN_CHUNK_SIZES = (0, 0xFFFFFFFF)
+
+
+def _skip(fd: BinaryIO, size: int) -> None:
+    if fd.seekable():
+        fd.seek(size, 1)
+    else:
+        # pipes, e.g. the output of a decoder process
+        fd.read(size)
+
+
 class WAVCodec(BaseCodec):
     SUPPORTED_FORMATS = [
         "wav"
     ]
 
-    @classmethod
-    def _read_record(cls, file: Union[str, BinaryIO], ext=None, limit=1000):
-        with wv.open(file) as wav:
-            params = wav.getparams()
-            data = wav.readframes(
-                params.nframes
-            )
+    @staticmethod
+    def _parse_header(fd: BinaryIO) -> Tuple[int, int, int, int, int, int]:
+        """
+        Walks the RIFF chunks up to the sample data.
+        :param fd: file object positioned at the start of the file, seekable or not.
+        :return: a tuple of (format, channels, framerate, sample width, data offset, data size),
+            the offset being None for pipes.
+        """
+        header = fd.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:] != b"WAVE":
+            raise ValueError("Wav file corrupted: not a RIFF/WAVE file")
 
-        n_channels = params.nchannels
-        f_width = params.sampwidth
-        n_samples, r = divmod(len(data), n_channels * f_width)
+        fmt = None
+        while True:
+            header = fd.read(8)
+            if len(header) < 8:
+                raise ValueError("Wav file corrupted: no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
 
-        print(params)
+            if chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("Wav file corrupted: data chunk before fmt chunk")
+                return (*fmt, fd.tell() if fd.seekable() else None, chunk_size)
 
-        assert r == 0, "Wav file corrupted"
+            if chunk_id == b"fmt ":
+                body = fd.read(chunk_size)
+                audio_format, n_channels, framerate, _, block_align, _ = struct.unpack("<HHIIHH", body[:16])
+                if audio_format == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    # the sub-format GUID starts with the actual format tag
+                    audio_format, = struct.unpack("<H", body[24:26])
+                fmt = (audio_format, n_channels, framerate, block_align // n_channels)
+                # chunks are word aligned
+                _skip(fd, chunk_size % 2)
+            else:
+                _skip(fd, chunk_size + chunk_size % 2)
 
-        if f_width != 3:
-            sign_type = 'u' if f_width == 1 else 'i'
-            pcm_signal = np.frombuffer(data, dtype=f'<{sign_type}{f_width}').reshape(-1, n_channels)
+    @staticmethod
+    def _map_bytes(fd: BinaryIO, offset: int, size: int) -> np.ndarray:
+        if size == 0:
+            return np.empty(0, dtype=np.uint8)
+        try:
+            fd.fileno()
+        except (AttributeError, OSError):
+            # in-memory uploads, only the requested bytes are copied
+            fd.seek(offset)
+            return np.frombuffer(fd.read(size), dtype=np.uint8)
+        return np.memmap(fd, dtype=np.uint8, mode="r", offset=offset, shape=(size,))
+
+    @classmethod
+    def _read_record(cls, file: Union[str, BinaryIO], ext=None, limit=1000) -> Tuple[List[np.ndarray], int]:
+        """
+        Exposes the channels of the file as strided views of a memory map, so only
+        the pages actually read by the caller are loaded.
+        :param file: file object of a PCM or IEEE float WAV file.
+        :param limit: if given, only the first `limit` seconds are mapped.
+        :return: a tuple of (channels, framerate); 24-bit samples are expanded to int32.
+        """
+        file.seek(0)
+        audio_format, n_channels, framerate, f_width, data_offset, data_size = cls._parse_header(file)
+
+        if audio_format == WAVE_FORMAT_PCM and f_width in (1, 2, 3, 4):
+            dtype = np.dtype("u1") if f_width == 1 else np.dtype(f"<i{f_width if f_width != 3 else 4}")
+        elif audio_format == WAVE_FORMAT_IEEE_FLOAT and f_width in (4, 8):
+            dtype = np.dtype(f"<f{f_width}")
         else:
-            wav_transformed = np.empty((n_samples, n_channels, 4), dtype=np.int8)
-            wav_raw = np.frombuffer(data, dtype=np.int8)
-            wav_transformed[:,:,:f_width] = wav_raw.reshape(-1, n_channels, f_width)
-            # Expand carry bit to MSB
-            wav_transformed[:,:,-1] = (wav_transformed[:,:, f_width - 1] >> 7) * 255 
-            pcm_signal = wav_transformed.reshape(-1, n_channels)
+            raise ValueError(f"Unsupported wav format encountered: {audio_format:#06x}, {8 * f_width} bits")
+
+        block_align = n_channels * f_width
+        file.seek(0, 2)
+        available = file.tell() - data_offset
+        if data_size in UNKNOWN_CHUNK_SIZES or data_size > available:
+            data_size = available
 
+        n_frames = data_size // block_align
         if limit:
-            pcm_signal = pcm_signal[:limit * 1000,:]
+            n_frames = min(n_frames, int(limit * framerate))
+
+        if f_width != 3:
+            raw = cls._map_bytes(file, data_offset, n_frames * block_align)
+            pcm_signal = raw.view(dtype).reshape(n_frames, n_channels)
+        else:
+            # every sample is read as the int32 that ends with its 3 bytes, starting one
+            # byte earlier (inside the header), and shifted down with sign extension
+            raw = cls._map_bytes(file, data_offset - 1, n_frames * block_align + 1)
+            words = np.ndarray(
+                shape=(n_frames, n_channels), dtype=dtype, buffer=raw, strides=(block_align, f_width)
+            )
+            pcm_signal = np.right_shift(words, 8)
 
-        return [ch.flatten() for ch in np.split(pcm_signal, pcm_signal.shape[-1], axis=-1)], params.framerate
+        return [pcm_signal[:, ch] for ch in range(n_channels)], framerate
@@ -1,6 +1,9 @@
 from hashlib import sha1
 from collections import namedtuple
+from math import gcd
+from typing import List
 import numpy as np
+import scipy.signal as sgnl
 
 
 Record = namedtuple("Record", [
@@ -26,3 +29,85 @@ def compute_binary_hash(fd):
     fd.seek(0)
 
     return sha_signature.hexdigest().upper()
+
+class HashingReader:
+    """
+    Read-only file object wrapper that feeds a SHA1 with the bytes read through it,
+    so a decoder and the file hash share a single read of the file.
+    Bytes the decoder skips (seeks, memory maps, `limit`) are only read when the
+    digest is requested; bytes read twice are hashed once.
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self._sha_signature = sha1()
+        # bytes [0, _hashed) are already in the digest
+        self._hashed = 0
+        self.fd.seek(0)
+
+    def _update(self, position: int, data) -> None:
+        if position <= self._hashed < position + len(data):
+            self._sha_signature.update(memoryview(data)[self._hashed - position:])
+            self._hashed = position + len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        position = self.fd.tell()
+        data = self.fd.read(size)
+        self._update(position, data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        position = self.fd.tell()
+        n_bytes = self.fd.readinto(buffer)
+        self._update(position, memoryview(buffer).cast("B")[:n_bytes])
+        return n_bytes
+
+    def hexdigest(self) -> str:
+        """
+        Completes the digest with the bytes not read yet, keeping the file position.
+        :return: the SHA1 of the whole file, as `compute_binary_hash` returns it.
+        """
+        position = self.fd.tell()
+        self.fd.seek(self._hashed)
+        while True:
+            buf = self.read(HASHING_BLOCK_SIZE)
+            if not buf:
+                break
+        self.fd.seek(position)
+
+        return self._sha_signature.hexdigest().upper()
+
+    def __getattr__(self, name):
+        # seek, tell, fileno, name... of the wrapped file
+        return getattr(self.fd, name)
+
+def downmix(channels: List[np.ndarray]) -> np.ndarray:
+    """
+    Averages the channels of a record into a single one.
+    :param channels: PCM samples of every channel, of equal length.
+    :return: mono samples as float32.
+    """
+    if len(channels) == 1:
+        return np.asarray(channels[0], dtype=np.float32)
+
+    mono = np.zeros(len(channels[0]), dtype=np.float32)
+    for channel in channels:
+        mono += channel
+    mono /= len(channels)
+    return mono
+
+def resample(data: np.ndarray, framerate: int, target_framerate: int) -> np.ndarray:
+    """
+    Polyphase resampling of a channel, the anti-aliasing filter included.
+    :param data: PCM samples of a single channel, or stacked channels along the first axis.
+    :param framerate: framerate of `data`.
+    :param target_framerate: framerate of the result.
+    :return: resampled samples as float32, `data` itself if the framerates are equal.
+    """
+    if framerate == target_framerate:
+        return data
+
+    common = gcd(framerate, target_framerate)
+    resampled = sgnl.resample_poly(
+        data.astype(np.float32, copy=False), target_framerate // common, framerate // common, axis=-1
+    )
+    return resampled.astype(np.float32, copy=False)
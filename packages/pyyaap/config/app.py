@@ -15,6 +15,11 @@ INPUT_HASHES = 'input_total_hashes'
 # Percentage regarding hashes matched vs hashes from the input.
 INPUT_CONFIDENCE = 'input_confidence'
 
+# Peaks discarded by the peak budget while fingerprinting the input.
+PEAKS_DROPPED = 'peaks_dropped'
+# Share of the input spectrogram frames skipped as silent.
+SILENCE_SKIPPED = 'silence_skipped'
+
 TOTAL_TIME = 'total_time'
 FINGERPRINT_TIME = 'fingerprint_time'
 QUERY_TIME = 'query_time'
@@ -52,4 +57,23 @@ FINGERPRINT_REDUCTION = 20
 # Number of results being returned for file recognition
 TOPN = 2
 
-SUPPORTED_EXTENSIONS = [ 'mp3', 'mpeg', 'wav', 'ogg', "m4a" ]
\ No newline at end of file
+SUPPORTED_EXTENSIONS = [ 'mp3', 'mpeg', 'wav', 'ogg', "m4a" ]
+
+# PostgreSQL connection pool: connections opened on first use and most connections open at once
+DB_POOL_MIN_SIZE = 1
+DB_POOL_MAX_SIZE = 10
+# seconds a pooled connection may idle before it is pinged on checkout
+DB_POOL_PING_AFTER = 30
+# seconds to wait for a free connection when all of them are in use
+DB_POOL_TIMEOUT = 30
+
+# hashes per array query of a match search: size of the first batch, and bounds of the adapted size
+DB_MATCH_BATCH_SIZE = 2000
+DB_MATCH_BATCH_MIN = 500
+DB_MATCH_BATCH_MAX = 50000
+# seconds a batch of a match search should take, the batch size is adapted towards it
+DB_MATCH_BATCH_SECONDS = 0.02
+# connections a match search is split over and queried on concurrently, 1 queries on a single one
+DB_MATCH_PARTITIONS = 1
+# hashes a partition of a match search gets at least, smaller searches are split over fewer connections
+DB_MATCH_PARTITION_MIN = 2000
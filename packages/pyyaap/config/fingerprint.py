@@ -5,7 +5,34 @@ FP_N_NEIGHBOURS = 5
 
 FP_PEAK_MIN_AMP = 10
 FP_PEAK_WIN_SIZE = 21
+# 'cv2' (dilation), 'vhgw' (NumPy running maximum) or 'auto', cv2 when installed
+FP_PEAK_ENGINE = "auto"
+# Keep at most FP_PEAK_BUDGET strongest peaks per slice of FP_PEAK_BUDGET_FRAMES
+# frames and band of FP_PEAK_BUDGET_BINS frequency bins, None keeps every peak
+FP_PEAK_BUDGET = None
+FP_PEAK_BUDGET_FRAMES = 22
+FP_PEAK_BUDGET_BINS = 256
 
 FP_SPEC_WIN_SIZE = 4096
 FP_SPEC_FREQ = 44100
 FP_SPEC_OVERLAP = 0.5
+# Every fingerprinted signal is resampled to this rate, the window shrinks so offsets keep the
+# FP_SPEC_FREQ time base; None keeps the native rate. Downmixing is FP_CHANNEL_STRATEGY 'mono'.
+FP_ANALYSIS_FREQ = None
+# Skip the spectrogram frames that provably hold no bin above FP_SILENCE_DB,
+# None means FP_PEAK_MIN_AMP so hashes stay exactly the same
+FP_SILENCE_GATE = True
+FP_SILENCE_DB = None
+# How the channels of a record are fingerprinted: 'per_channel', 'mono' (downmix)
+# or 'batched' (one spectrogram and peak pass over all channels)
+FP_CHANNEL_STRATEGY = "per_channel"
+# The channels of records of at least FP_SEGMENT_MIN_SECONDS are fingerprinted in parallel
+# on a process pool, split into time segments of at least that length when workers outnumber them
+FP_SEGMENT_MIN_SECONDS = 300
+# One of pyyaap.matching.signal.spectrogram.SPECTROGRAM_ENGINES
+FP_SPEC_ENGINE = "scipy"
+
+# Spectrogram frames analysed per block by the streaming fingerprinter
+FP_STREAM_BLOCK_FRAMES = 1024
+# Finalised spectrogram frames gathered before a live stream emits new hashes
+FP_STREAM_PUSH_FRAMES = 16
@@ -0,0 +1 @@
+from pyyaap.matching.signal.streaming import StreamingFingerprinter, iter_fingerprint
@@ -1,52 +1,185 @@
-import scipy.signal as sgnl
 import numpy as np
-import cv2
 from operator import itemgetter
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Tuple
 
 from pyyaap.config.fingerprint import (
     FP_HASH_DELTA_MAX, FP_HASH_DELTA_MIN, 
-    FP_SPEC_FREQ, FP_SPEC_OVERLAP, FP_SPEC_WIN_SIZE,
-    FP_PEAK_WIN_SIZE, FP_PEAK_MIN_AMP, 
+    FP_SPEC_FREQ, FP_SPEC_OVERLAP, FP_SPEC_WIN_SIZE, FP_SPEC_ENGINE, FP_ANALYSIS_FREQ,
+    FP_CHANNEL_STRATEGY, FP_SILENCE_GATE, FP_SILENCE_DB,
+    FP_PEAK_WIN_SIZE, FP_PEAK_MIN_AMP, FP_PEAK_ENGINE,
+    FP_PEAK_BUDGET, FP_PEAK_BUDGET_FRAMES, FP_PEAK_BUDGET_BINS,
     FP_N_NEIGHBOURS,
 )
+from pyyaap.codec.decode.utils import downmix, resample
+from pyyaap.matching.signal.hashes import Fingerprints
+from pyyaap.matching.signal.maxfilter import local_maxima
+from pyyaap.matching.signal.silence import get_active_spans, get_silent_frames
+from pyyaap.matching.signal.spectrogram import get_spectrogram_engine
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
 
 
 def _get_audio_spectrogram(
     data: np.ndarray, window_sz: int = FP_SPEC_WIN_SIZE, 
-    freq: int = FP_SPEC_FREQ, overlap_ratio: float = FP_SPEC_OVERLAP, **kwargs
+    freq: int = FP_SPEC_FREQ, overlap_ratio: float = FP_SPEC_OVERLAP,
+    spec_engine: str = FP_SPEC_ENGINE, **kwargs
 ) -> np.ndarray:
-    f, t, spectrum = sgnl.spectrogram(
-        data,
-        nperseg=window_sz, nfft=window_sz,fs=freq, window='hann',
-        noverlap=int(window_sz * overlap_ratio), mode='psd',
-        scaling='spectrum'
+    return get_spectrogram_engine(spec_engine).compute(
+        data, window_sz=window_sz, freq=freq, overlap_ratio=overlap_ratio
+    )
+
+def _iter_audio_spectrograms(
+    data: np.ndarray, window_sz: int = FP_SPEC_WIN_SIZE, overlap_ratio: float = FP_SPEC_OVERLAP,
+    silence_gate: bool = FP_SILENCE_GATE, silence_db: float = FP_SILENCE_DB,
+    amp_min: int = FP_PEAK_MIN_AMP, spec_win_size: int = FP_PEAK_WIN_SIZE,
+    peak_budget: int = FP_PEAK_BUDGET, budget_frames: int = FP_PEAK_BUDGET_FRAMES,
+    stats: Dict[str, int] = None, **kwargs
+) -> Iterator[Tuple[np.ndarray, int]]:
+    """
+    Computes the spectrogram of the spans of `data` that are not silent.
+    Two spans are at least half a peak window apart and every skipped frame stays
+    below `silence_db`, so with the default level the peaks of the spans are exactly
+    the peaks of the whole spectrogram.
+    :param data: PCM samples of a channel, or stacked channels along the first axis.
+    :param silence_gate: if False, the whole spectrogram is yielded.
+    :param silence_db: level under which frames are skipped, None means `amp_min`;
+        above it, weak peaks next to the skipped frames may be lost.
+    :param stats: if given, the 'frames' and 'frames_skipped' counters are increased.
+    :return: an iterator of (spectrogram, index of its first frame) tuples.
+    """
+    config = {**kwargs, "window_sz": window_sz, "overlap_ratio": overlap_ratio}
+    if not silence_gate or data.shape[-1] < window_sz:
+        yield _get_audio_spectrogram(data, **config), 0
+        return
+
+    hop = window_sz - int(window_sz * overlap_ratio)
+    silent = get_silent_frames(data, window_sz, hop, amp_min if silence_db is None else silence_db)
+    # a peak budget is decided over whole time slices
+    spans = get_active_spans(
+        silent, min_gap=spec_win_size // 2, align=budget_frames if peak_budget is not None else 1
     )
-    spectrum = 10 * np.log10(spectrum)
-    return spectrum
+
+    if stats is not None:
+        stats["frames"] = stats.get("frames", 0) + len(silent)
+        stats["frames_skipped"] = stats.get("frames_skipped", 0) + len(silent) - sum(stop - start for start, stop in spans)
+
+    for start, stop in spans:
+        yield _get_audio_spectrogram(data[..., start * hop: (stop - 1) * hop + window_sz], **config), start
+
+def _select_peak_budget(
+    f: np.ndarray, t: np.ndarray, amps: np.ndarray, peak_budget: int = FP_PEAK_BUDGET,
+    budget_frames: int = FP_PEAK_BUDGET_FRAMES, budget_bins: int = FP_PEAK_BUDGET_BINS
+) -> np.ndarray:
+    """
+    Selects the `peak_budget` strongest peaks of every cell of `budget_frames` frames
+    by `budget_bins` frequency bins.
+    :param f: frequency bins of the peaks.
+    :param t: absolute time frames of the peaks, so cells do not depend on blocking.
+    :param amps: amplitudes of the peaks.
+    :return: sorted indices of the kept peaks.
+    """
+    n_bands = int(f.max()) // budget_bins + 1 if len(f) else 1
+    cells = (t // budget_frames) * n_bands + f // budget_bins
+
+    # by cell, strongest first; ties keep the row-major peak order
+    order = np.lexsort((-amps, cells))
+    cells = cells[order]
+
+    position = np.arange(len(cells))
+    cell_start = np.r_[True, cells[1:] != cells[:-1]] if len(cells) else np.empty(0, dtype=bool)
+    rank = position - np.maximum.accumulate(np.where(cell_start, position, 0))
+
+    return np.sort(order[rank < peak_budget])
 
 def _get_spectrogram_local_peaks(
     spectrogram: np.ndarray, spec_win_size: int = FP_PEAK_WIN_SIZE,
-    amp_min: int = FP_PEAK_MIN_AMP, **kwargs
-) -> List[Tuple[int, int]]:
-    locality_kernel = cv2.getStructuringElement(
-        cv2.MORPH_RECT, (spec_win_size, spec_win_size)
-    )
+    amp_min: int = FP_PEAK_MIN_AMP, peak_budget: int = FP_PEAK_BUDGET,
+    budget_frames: int = FP_PEAK_BUDGET_FRAMES, budget_bins: int = FP_PEAK_BUDGET_BINS,
+    frame_offset: int = 0, frame_range: Tuple[int, int] = None, stats: Dict[str, int] = None,
+    peak_engine: str = FP_PEAK_ENGINE, **kwargs
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the local maxima of the spectrogram above `amp_min`.
+    :param spectrogram: spectrogram in dB, shaped (frequencies, frames).
+    :param frame_offset: absolute index of the first spectrogram frame.
+    :param frame_range: if given, only peaks in these absolute frames [from, to) are returned.
+    :param stats: if given, the 'peaks' and 'peaks_dropped' counters are increased.
+    :param peak_engine: 'cv2' (dilation), 'vhgw' (NumPy running maximum) or 'auto' (cv2 when installed).
+    :return: a tuple of (f, t) arrays, t being absolute frame indices.
+    """
+    # the window is square, so peaks are searched in memory order and mapped back
+    transposed = spectrogram.strides[0] < spectrogram.strides[1]
+    image = spectrogram.T if transposed else spectrogram
 
-    dilated_img = cv2.dilate(spectrogram, locality_kernel, iterations=1)
+    if peak_engine == "cv2" or (peak_engine == "auto" and cv2 is not None):
+        locality_kernel = cv2.getStructuringElement(
+            cv2.MORPH_RECT, (spec_win_size, spec_win_size)
+        )
 
-    peak_map = (spectrogram == dilated_img)
-    
-    amps =  spectrogram[peak_map].flatten()
-    f, t = np.where(peak_map)
+        dilated_img = cv2.dilate(image, locality_kernel, iterations=1)
+
+        peak_map = image > amp_min
+        peak_map &= image == dilated_img
+        rows, cols = np.nonzero(peak_map)
+    elif peak_engine in ("vhgw", "auto"):
+        rows, cols = local_maxima(image, spec_win_size, amp_min)
+    else:
+        raise ValueError(f"Unsupported peak engine supplied: {peak_engine}")
+
+    if transposed:
+        order = np.lexsort((rows, cols))
+        f, t = cols[order], rows[order]
+    else:
+        f, t = rows, cols
+
+    if frame_range is not None:
+        in_range = (frame_range[0] <= t + frame_offset) & (t + frame_offset < frame_range[1])
+        f, t = f[in_range], t[in_range]
+
+    n_peaks = len(f)
+    if peak_budget is not None:
+        kept = _select_peak_budget(f, t + frame_offset, spectrogram[f, t], peak_budget, budget_frames, budget_bins)
+        f, t = f[kept], t[kept]
 
-    tgt_peak = np.where(amps > amp_min)
-    f = f[tgt_peak]
-    t = t[tgt_peak]
+    t = t + frame_offset
 
-    return list(
-        zip(f, t)
-    ) 
+    if stats is not None:
+        stats["peaks"] = stats.get("peaks", 0) + len(f)
+        stats["peaks_dropped"] = stats.get("peaks_dropped", 0) + n_peaks - len(f)
+
+    return f, t
+
+def _get_stacked_local_peaks(
+    spectrograms: np.ndarray, spec_win_size: int = FP_PEAK_WIN_SIZE,
+    peak_budget: int = FP_PEAK_BUDGET, budget_bins: int = FP_PEAK_BUDGET_BINS, **kwargs
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Finds the local peaks of several channels in a single pass: the spectrograms are
+    stacked along the frequency axis, separated by rows of -inf at least half a window
+    high so no channel sees the peaks of another one.
+    :param spectrograms: spectrograms in dB, shaped (channels, frequencies, frames).
+    :return: a list of (f, t) arrays per channel, as `_get_spectrogram_local_peaks` returns them.
+    """
+    n_channels, n_bins, n_frames = spectrograms.shape
+    stride = n_bins + spec_win_size // 2
+    if peak_budget is not None:
+        # budget bands must not straddle two channels
+        stride = -(-stride // budget_bins) * budget_bins
+
+    # filled in (frames, frequencies) memory order, as the engines lay spectrograms out
+    stacked = np.empty((n_frames, n_channels, stride), dtype=spectrograms.dtype)
+    stacked[:, :, n_bins:] = -np.inf
+    stacked[:, :, :n_bins] = spectrograms.transpose(2, 0, 1)
+    stacked = stacked.reshape(n_frames, n_channels * stride)
+
+    f, t = _get_spectrogram_local_peaks(
+        stacked.T, spec_win_size=spec_win_size, peak_budget=peak_budget, budget_bins=budget_bins, **kwargs
+    )
+    channels, f = np.divmod(f, stride)
+    return [(f[channels == channel], t[channels == channel]) for channel in range(n_channels)]
 
 def _get_combinatorial_hashes(
     peaks: List[Tuple[int, int]], offset_min: int = FP_HASH_DELTA_MIN, 
@@ -79,11 +212,161 @@ def _get_combinatorial_hashes(
 
     return hashes
 
+def _get_combinatorial_hash_arrays(
+    f: np.ndarray, t: np.ndarray, offset_min: int = FP_HASH_DELTA_MIN,
+    offset_max: int = FP_HASH_DELTA_MAX, n_neighbours: int = FP_N_NEIGHBOURS,
+    n_anchors: int = None, **kwargs
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized counterpart of `_get_combinatorial_hashes`.
+    Pairs every anchor peak with its next `n_neighbours - 1` peaks in time order
+    and packs each pair as `anchor_f << 32 | candidate_f << 16 | t_delta`.
+    :param f: frequency bins of the peaks.
+    :param t: time frames of the peaks.
+    :param n_anchors: if given, only the first `n_anchors` peaks in time order are used as anchors.
+    :return: a tuple of (hashes, offsets) arrays ordered by anchor, then neighbour.
+    """
+    # same order as the stable sort by time of the row-major `np.where` output
+    order = np.lexsort((f, t))
+    f = f[order].astype(np.uint64)
+    t = t[order].astype(np.int64)
+
+    n_peaks = len(t)
+    if n_peaks == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int32)
+
+    n_anchors = n_peaks if n_anchors is None else min(n_anchors, n_peaks)
+
+    candidates = np.arange(n_anchors)[:, None] + np.arange(1, max(n_neighbours, 1))[None, :]
+    in_range = candidates < n_peaks
+    np.minimum(candidates, n_peaks - 1, out=candidates)
+
+    t_delta = t[candidates] - t[:n_anchors, None]
+    pair_mask = in_range & (offset_min <= t_delta) & (t_delta <= offset_max)
+
+    anchors, neighbours = np.nonzero(pair_mask)
+    candidates = candidates[anchors, neighbours]
+
+    hashes = f[anchors] << np.uint64(32) | f[candidates] << np.uint64(16) \
+        | t_delta[anchors, neighbours].astype(np.uint64)
+
+    return hashes, t[anchors].astype(np.int32)
+
+def _get_analysis_config(analysis_freq: int = FP_ANALYSIS_FREQ, **kwargs) -> Dict[str, any]:
+    """
+    Adapts the fingerprint configuration to the analysis framerate: the window is scaled
+    so a spectrogram frame lasts as long as with FP_SPEC_WIN_SIZE at FP_SPEC_FREQ,
+    keeping both offsets in seconds and bins in Hz unchanged.
+    :param analysis_freq: framerate the channels are resampled to, None keeps the native one.
+    :return: the configuration to fingerprint samples at `analysis_freq` with.
+    """
+    if analysis_freq is None:
+        return kwargs
+
+    window_sz = kwargs.get("window_sz", FP_SPEC_WIN_SIZE)
+    return {
+        **kwargs,
+        "freq": analysis_freq,
+        "window_sz": int(round(window_sz * analysis_freq / FP_SPEC_FREQ)),
+    }
+
+def get_peaks(
+    data: np.ndarray, **kwargs
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the peak constellation of a single channel.
+    :param data: PCM samples of the channel, at framerate `freq`.
+    :param kwargs: fingerprint configuration; with `analysis_freq` set the channel
+        is resampled to it first.
+    :return: a tuple of (f, t) arrays, t being absolute frame indices.
+    """
+    analysis_freq = kwargs.get("analysis_freq", FP_ANALYSIS_FREQ)
+    if analysis_freq is not None:
+        data = resample(data, kwargs.get("freq", FP_SPEC_FREQ), analysis_freq)
+        kwargs = _get_analysis_config(**kwargs)
+
+    f, t = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for spectrogram, frame_offset in _iter_audio_spectrograms(data, **kwargs):
+        span_f, span_t = _get_spectrogram_local_peaks(spectrogram, frame_offset=frame_offset, **kwargs)
+        f.append(span_f)
+        t.append(span_t)
+
+    return np.concatenate(f), np.concatenate(t)
+
+def get_channel_peaks(
+    channels: List[np.ndarray], channel_strategy: str = FP_CHANNEL_STRATEGY, **kwargs
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Finds the peak constellations of all the channels of a record.
+    'per_channel' gives one per channel, 'mono' the one of their downmix and 'batched'
+    the ones of 'per_channel' with one spectrogram and peak pass.
+    :param channels: PCM samples of every channel, of equal length.
+    :param channel_strategy: one of 'per_channel', 'mono' or 'batched'.
+    :param kwargs: fingerprint configuration, as accepted by `fingerprint`.
+    :return: a list of (f, t) arrays, as `get_peaks` returns them.
+    """
+    if channel_strategy == "per_channel":
+        return [get_peaks(channel, **kwargs) for channel in channels]
+
+    if channel_strategy == "mono":
+        return [get_peaks(downmix(channels), **kwargs)]
+
+    if channel_strategy == "batched":
+        data = np.stack(channels)
+        analysis_freq = kwargs.get("analysis_freq", FP_ANALYSIS_FREQ)
+        if analysis_freq is not None:
+            data = resample(data, kwargs.get("freq", FP_SPEC_FREQ), analysis_freq)
+            kwargs = _get_analysis_config(**kwargs)
+
+        f = [[np.empty(0, dtype=np.int64)] for _ in channels]
+        t = [[np.empty(0, dtype=np.int64)] for _ in channels]
+        for spectrograms, frame_offset in _iter_audio_spectrograms(data, **kwargs):
+            peaks = _get_stacked_local_peaks(spectrograms, frame_offset=frame_offset, **kwargs)
+            for channel, (span_f, span_t) in enumerate(peaks):
+                f[channel].append(span_f)
+                t[channel].append(span_t)
+
+        return [(np.concatenate(channel_f), np.concatenate(channel_t)) for channel_f, channel_t in zip(f, t)]
+
+    raise ValueError(f"Unsupported channel strategy supplied: {channel_strategy}")
+
+def fingerprint_peaks(
+    peaks: List[Tuple[np.ndarray, np.ndarray]], **kwargs
+) -> Fingerprints:
+    """
+    Hashes peak constellations, e.g. the ones of `get_channel_peaks` or of a peak cache.
+    :param peaks: a list of (f, t) arrays.
+    :param kwargs: hashing configuration, as accepted by `fingerprint`.
+    :return: the unique (hash, offset) pairs of all the constellations.
+    """
+    return Fingerprints.union(*[
+        Fingerprints.from_arrays(*_get_combinatorial_hash_arrays(f, t, **kwargs)) for f, t in peaks
+    ])
+
 def fingerprint(
     data: np.ndarray, **kwargs
-) -> List[Tuple[int, int]]:
-    return _get_combinatorial_hashes(
-        _get_spectrogram_local_peaks(
-            _get_audio_spectrogram(data, **kwargs), **kwargs
-        ), **kwargs
+) -> Fingerprints:
+    """
+    Fingerprints a single channel.
+    :param data: PCM samples of the channel, at framerate `freq`.
+    :param kwargs: fingerprint configuration; with `analysis_freq` set the channel
+        is resampled to it first.
+    :return: the (hash, offset) pairs of the channel.
+    """
+    return Fingerprints.from_arrays(
+        *_get_combinatorial_hash_arrays(*get_peaks(data, **kwargs), **kwargs)
     )
+
+def fingerprint_channels(
+    channels: List[np.ndarray], channel_strategy: str = FP_CHANNEL_STRATEGY, **kwargs
+) -> Fingerprints:
+    """
+    Fingerprints all the channels of a record.
+    'per_channel' fingerprints every channel on its own, 'mono' fingerprints their downmix
+    and 'batched' gives the hashes of 'per_channel' with one spectrogram and peak pass.
+    :param channels: PCM samples of every channel, of equal length.
+    :param channel_strategy: one of 'per_channel', 'mono' or 'batched'.
+    :param kwargs: fingerprint configuration, as accepted by `fingerprint`.
+    :return: the unique (hash, offset) pairs of the record.
+    """
+    return fingerprint_peaks(get_channel_peaks(channels, channel_strategy, **kwargs), **kwargs)
@@ -0,0 +1,161 @@
+import numpy as np
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+
+# 12 bytes per (hash, offset) pair instead of a tuple of two Python ints.
+FINGERPRINT_DTYPE = np.dtype([
+    ("hash", np.uint64), ("offset", np.int32)
+])
+
+
+class Fingerprints:
+    """
+    Compact container of (hash, offset) pairs backed by a NumPy structured array.
+    Iterating over it yields (hash, offset) tuples of Python ints, so it can be
+    used wherever a list of tuples was expected before.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data: np.ndarray = None):
+        if data is None:
+            data = np.empty(0, dtype=FINGERPRINT_DTYPE)
+        self.data = data
+
+    @classmethod
+    def from_arrays(cls, hashes: np.ndarray, offsets: np.ndarray) -> "Fingerprints":
+        data = np.empty(len(hashes), dtype=FINGERPRINT_DTYPE)
+        data["hash"] = hashes
+        data["offset"] = offsets
+        return cls(data)
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[int, int]]) -> "Fingerprints":
+        return cls(np.array(list(pairs), dtype=FINGERPRINT_DTYPE))
+
+    @classmethod
+    def union(cls, *fingerprints: "Fingerprints") -> "Fingerprints":
+        """
+        Merges several containers (e.g. one per channel) dropping duplicated pairs.
+        :param fingerprints: containers to merge.
+        :return: a new container with unique (hash, offset) pairs.
+        """
+        if not fingerprints:
+            return cls()
+        return cls(np.concatenate([fp.data for fp in fingerprints])).unique()
+
+    @property
+    def hashes(self) -> np.ndarray:
+        return self.data["hash"]
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self.data["offset"]
+
+    def unique(self) -> "Fingerprints":
+        """
+        Drops duplicated (hash, offset) pairs.
+        :return: a new container sorted by hash, then offset.
+        """
+        data = self.data[np.lexsort((self.offsets, self.hashes))]
+        keep = np.ones(len(data), dtype=bool)
+        keep[1:] = (data["hash"][1:] != data["hash"][:-1]) | (data["offset"][1:] != data["offset"][:-1])
+        return Fingerprints(data[keep])
+
+    def group_by_hash(self) -> Dict[int, np.ndarray]:
+        """
+        Groups offsets by hash.
+        :return: a dictionary mapping every distinct hash to the array of its offsets.
+        """
+        order = np.argsort(self.hashes, kind="stable")
+        hashes = self.hashes[order]
+        offsets = self.offsets[order]
+
+        values, starts = np.unique(hashes, return_index=True)
+        return dict(zip(values.tolist(), np.split(offsets, starts[1:])))
+
+    def tolist(self) -> List[Tuple[int, int]]:
+        return self.data.tolist()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return iter(self.data.tolist())
+
+    def __or__(self, other: "Fingerprints") -> "Fingerprints":
+        return Fingerprints.union(self, as_fingerprints(other))
+
+    def __repr__(self) -> str:
+        return f"Fingerprints(n={len(self)})"
+
+
+def as_fingerprints(hashes: Union[Fingerprints, Iterable[Tuple[int, int]]]) -> Fingerprints:
+    """
+    Wraps a sequence of (hash, offset) tuples, returning containers untouched.
+    :param hashes: a Fingerprints container or a sequence of (hash, offset) tuples.
+    :return: a Fingerprints container.
+    """
+    if isinstance(hashes, Fingerprints):
+        return hashes
+    return Fingerprints.from_pairs(hashes)
+
+
+class SharedFingerprints(NamedTuple):
+    """
+    Descriptor of a Fingerprints container written to a shared memory block, so a
+    process pool returns a name and a length instead of pickling the pairs.
+    The block belongs to whoever holds the descriptor until it is attached once.
+
+    # worker
+    return SharedFingerprints.export(fingerprints)
+    # parent
+    with shared.attach() as fingerprints:
+        db.insert_hashes(audio_id, fingerprints)
+    """
+    name: str
+    length: int
+
+    @classmethod
+    def export(cls, fingerprints: Fingerprints) -> "SharedFingerprints":
+        """
+        Copies a container to a new shared memory block.
+        :param fingerprints: container to share.
+        :return: the descriptor of the block.
+        """
+        # empty blocks are not allowed
+        block = SharedMemory(create=True, size=max(fingerprints.data.nbytes, 1))
+        try:
+            np.ndarray(len(fingerprints), dtype=FINGERPRINT_DTYPE, buffer=block.buf)[:] = fingerprints.data
+        except BaseException:
+            block.close()
+            block.unlink()
+            raise
+
+        # the exporting process must not unlink the block when it exits, the reader does
+        resource_tracker.unregister(block._name, "shared_memory")
+        block.close()
+        return cls(block.name, len(fingerprints))
+
+    @contextmanager
+    def attach(self) -> Iterator[Fingerprints]:
+        """
+        Maps the block without copying it, and releases it on exit.
+        :return: a container viewing the block, emptied when the context ends.
+        """
+        block = SharedMemory(name=self.name)
+        # the view keeps the mapping alive, closing it under a live view fails instead of crashing
+        fingerprints = Fingerprints(np.frombuffer(block.buf, dtype=FINGERPRINT_DTYPE, count=self.length))
+        try:
+            yield fingerprints
+        finally:
+            # the container is emptied, so it cannot outlive the block
+            fingerprints.data = np.empty(0, dtype=FINGERPRINT_DTYPE)
+            try:
+                block.close()
+            except BufferError:
+                # another view was taken, the mapping goes away once it is collected
+                pass
+            block.unlink()
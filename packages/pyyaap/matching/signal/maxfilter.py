@@ -0,0 +1,77 @@
+import numpy as np
+from typing import Tuple
+
+
+def _lowest(dtype: np.dtype):
+    if np.issubdtype(dtype, np.floating):
+        return -np.inf
+    return np.iinfo(dtype).min
+
+def running_max(data: np.ndarray, size: int, axis: int = -1) -> np.ndarray:
+    """
+    Centered running maximum of `size` elements along an axis, van Herk/Gil-Werman style:
+    the axis is split in blocks of `size`, and every window is the maximum of one block
+    suffix and the next block prefix, so the cost does not depend on `size`.
+    Out of range elements are ignored, as with the default border of `cv2.dilate`.
+    :param data: array to filter, any real dtype.
+    :param size: window length.
+    :param axis: axis to filter along.
+    :return: filtered array with the shape and dtype of `data`.
+    """
+    # the filtered axis goes first so every step below works on contiguous rows
+    data = np.moveaxis(data, axis, 0)
+    n = len(data)
+    left = size // 2
+
+    n_blocks = -(-(n + size - 1) // size)
+    padded = np.full((n_blocks * size,) + data.shape[1:], _lowest(data.dtype), dtype=data.dtype)
+    padded[left:left + n] = data
+
+    suffix = padded.reshape((n_blocks, size) + data.shape[1:])
+    prefix = suffix.copy()
+
+    # block prefix maxima, then block suffix maxima in place of the padded copy
+    for k in range(1, size):
+        np.maximum(prefix[:, k - 1], prefix[:, k], out=prefix[:, k])
+        np.maximum(suffix[:, size - k], suffix[:, size - k - 1], out=suffix[:, size - k - 1])
+
+    prefix = prefix.reshape(padded.shape)
+
+    # window of output i spans [i, i + size - 1] of the padded axis
+    return np.moveaxis(np.maximum(padded[:n], prefix[size - 1:size - 1 + n]), 0, axis)
+
+def local_maxima(data: np.ndarray, size: int, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the elements of a 2-D array that are the maximum of the `size` x `size` square
+    around them and exceed `threshold`, like comparing with `cv2.dilate` but in one mask pass.
+    The running maximum is only computed along the first axis; the second axis is checked
+    for the few candidates left, nearest neighbours first.
+    :param data: 2-D array, ideally C-contiguous.
+    :param size: odd side of the square window.
+    :param threshold: minimal value (exclusive) of a maximum.
+    :return: a tuple of (rows, columns) arrays in row-major order.
+    """
+    n_rows, n_cols = data.shape
+    half = size // 2
+
+    # out of range columns as the lowest value, so neighbour lookups need no bounds checks
+    padded = np.full((n_rows, n_cols + 2 * half), _lowest(data.dtype), dtype=data.dtype)
+    padded[:, half:half + n_cols] = data
+    column_max = running_max(padded, size, axis=0)
+
+    candidates = padded > threshold
+    candidates &= padded == column_max
+    flat = np.flatnonzero(candidates)
+    del candidates
+
+    values = padded.ravel()[flat]
+    column_max = column_max.ravel()
+    for distance in range(1, half + 1):
+        for shift in (distance, -distance):
+            if shift > size - 1 - half:
+                continue
+            keep = column_max[flat + shift] <= values
+            flat, values = flat[keep], values[keep]
+
+    rows, columns = np.divmod(flat, n_cols + 2 * half)
+    return rows, columns - half
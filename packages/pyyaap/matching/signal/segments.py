@@ -0,0 +1,228 @@
+import numpy as np
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing.pool import Pool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from pyyaap.config.fingerprint import (
+    FP_SPEC_WIN_SIZE, FP_SPEC_FREQ, FP_SPEC_OVERLAP, FP_ANALYSIS_FREQ,
+    FP_CHANNEL_STRATEGY, FP_PEAK_WIN_SIZE,
+    FP_PEAK_BUDGET, FP_PEAK_BUDGET_FRAMES,
+    FP_SEGMENT_MIN_SECONDS,
+)
+from pyyaap.codec.decode.utils import downmix, resample
+from pyyaap.matching.signal.fingerprint import (
+    _get_analysis_config, _iter_audio_spectrograms, _get_spectrogram_local_peaks,
+    fingerprint_peaks, get_channel_peaks
+)
+from pyyaap.matching.signal.hashes import Fingerprints
+
+
+class SharedChannels(NamedTuple):
+    """
+    Descriptor of the decoded channels of a record written to a shared memory block, so
+    a pool worker hands a record too long for it over to the process splitting it over
+    the pool, which does not have to decode it again.
+    The block belongs to whoever holds the descriptor until it is attached once.
+
+    # worker
+    return SharedChannels.export(channels, framerate)
+    # parent
+    with shared.attach() as channels:
+        peaks = get_channel_peaks_segmented(channels, pool, n_workers, freq=shared.framerate)
+    """
+    name: str
+    n_channels: int
+    n_samples: int
+    dtype: str
+    framerate: int
+
+    @classmethod
+    def export(cls, channels: List[np.ndarray], framerate: int) -> "SharedChannels":
+        """
+        Copies the channels of a record to a new shared memory block.
+        :param channels: PCM samples of every channel, of equal length.
+        :param framerate: framerate of the channels.
+        :return: the descriptor of the block.
+        """
+        n_samples = len(channels[0]) if len(channels) else 0
+        dtype = np.result_type(*channels) if len(channels) else np.dtype(np.int16)
+        # empty blocks are not allowed
+        block = SharedMemory(create=True, size=max(len(channels) * n_samples * dtype.itemsize, 1))
+        try:
+            stacked = np.ndarray((len(channels), n_samples), dtype=dtype, buffer=block.buf)
+            for index, channel in enumerate(channels):
+                stacked[index] = channel
+            del stacked
+        except BaseException:
+            block.close()
+            block.unlink()
+            raise
+
+        # the exporting process must not unlink the block when it exits, the reader does
+        resource_tracker.unregister(block._name, "shared_memory")
+        block.close()
+        return cls(block.name, len(channels), n_samples, dtype.str, framerate)
+
+    @contextmanager
+    def attach(self) -> Iterator[List[np.ndarray]]:
+        """
+        Maps the block without copying it, and releases it on exit.
+        :return: the channels, viewing the block, emptied when the context ends.
+        """
+        block = SharedMemory(name=self.name)
+        channels = list(np.ndarray((self.n_channels, self.n_samples), dtype=np.dtype(self.dtype), buffer=block.buf))
+        try:
+            yield channels
+        finally:
+            # the list is emptied, so the channels cannot outlive the block
+            channels.clear()
+            try:
+                block.close()
+            except BufferError:
+                # another view was taken, the mapping goes away once it is collected
+                pass
+            block.unlink()
+
+def get_segment_count(
+    n_samples: int, n_channels: int, n_workers: int, freq: int = FP_SPEC_FREQ,
+    channel_strategy: str = FP_CHANNEL_STRATEGY, segment_min_seconds: float = FP_SEGMENT_MIN_SECONDS,
+    **kwargs
+) -> int:
+    """
+    Number of segments every source of a record, a channel or their downmix for 'mono',
+    is split into: sources and their segments are fingerprinted in parallel, as many
+    of them as there are workers, none shorter than `segment_min_seconds`.
+    :param n_samples: length of the channels.
+    :param n_channels: number of channels of the record.
+    :param n_workers: processes segments are fingerprinted on.
+    :return: segments per source, 1 meaning the sources are not split.
+    """
+    n_sources = 1 if channel_strategy == "mono" else n_channels
+    by_duration = int(n_samples / freq // segment_min_seconds)
+    by_workers = n_workers // max(n_sources, 1)
+    return max(1, min(by_duration, by_workers))
+
+def get_task_count(
+    n_samples: int, n_channels: int, n_workers: int, freq: int = FP_SPEC_FREQ,
+    channel_strategy: str = FP_CHANNEL_STRATEGY, segment_min_seconds: float = FP_SEGMENT_MIN_SECONDS,
+    **kwargs
+) -> int:
+    """
+    Number of tasks a record is fingerprinted in on a process pool: every segment of
+    every source, for records of at least `segment_min_seconds`.
+    :param n_samples: length of the channels.
+    :param n_channels: number of channels of the record.
+    :param n_workers: processes segments are fingerprinted on.
+    :return: the number of tasks, 1 meaning the record is fingerprinted in-process.
+    """
+    if n_workers <= 1 or n_samples / freq < segment_min_seconds:
+        return 1
+    n_sources = 1 if channel_strategy == "mono" else n_channels
+    return n_sources * get_segment_count(
+        n_samples, n_channels, n_workers, freq=freq, channel_strategy=channel_strategy,
+        segment_min_seconds=segment_min_seconds
+    )
+
+def _get_segment_peaks(task: Tuple[np.ndarray, int, int, int, Dict[str, any]]) -> Tuple[np.ndarray, np.ndarray, Dict[str, int]]:
+    """
+    Finds the peaks of frames [frame_from, frame_to) of a channel from the samples of a
+    segment and of its context, `data` starting at frame `context_from`.
+    :return: a tuple of (f, t, stats), t being absolute frame indices.
+    """
+    data, context_from, frame_from, frame_to, kwargs = task
+    stats = {}
+    f, t = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for spectrogram, frame_offset in _iter_audio_spectrograms(data, **{**kwargs, "stats": stats}):
+        span_f, span_t = _get_spectrogram_local_peaks(
+            spectrogram, frame_offset=context_from + frame_offset,
+            frame_range=(frame_from, frame_to), **{**kwargs, "stats": stats}
+        )
+        f.append(span_f)
+        t.append(span_t)
+
+    return np.concatenate(f), np.concatenate(t), stats
+
+def get_channel_peaks_segmented(
+    channels: List[np.ndarray], pool: Pool = None, n_workers: int = None,
+    stats: Dict[str, int] = None, **kwargs
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Finds the peak constellations of a record like `get_channel_peaks`, the channels of
+    long records being fingerprinted in parallel on a process pool, split into time
+    segments when there are more workers than channels.
+    A segment is analysed together with the half peak window of frames around it, and
+    keeps only the peaks of its own frames, so the merged constellations hold exactly
+    the peaks of a single-process run. Segments start on peak budget slices, and the
+    silence gate is exact at its default level, so neither changes the result.
+    'batched' channels are segmented like 'per_channel' ones, which gives the same peaks.
+    :param channels: PCM samples of every channel, of equal length.
+    :param pool: process pool the segments are sent to, None fingerprints in this process.
+    :param n_workers: processes of `pool`, the split follows `get_task_count` and `get_segment_count`.
+    :param stats: if given, the peak and frame counters are increased; frame counters
+        include the context frames segments share.
+    :param kwargs: fingerprint configuration, as accepted by `fingerprint`.
+    :return: a list of (f, t) arrays, as `get_channel_peaks` returns them.
+    """
+    if pool is None or not len(channels) or get_task_count(len(channels[0]), len(channels), n_workers or 1, **kwargs) == 1:
+        return get_channel_peaks(channels, **{**kwargs, "stats": stats})
+    n_segments = get_segment_count(len(channels[0]), len(channels), n_workers, **kwargs)
+
+    config = kwargs
+    sources = [downmix(channels)] if kwargs.get("channel_strategy", FP_CHANNEL_STRATEGY) == "mono" else channels
+    analysis_freq = kwargs.get("analysis_freq", FP_ANALYSIS_FREQ)
+    if analysis_freq is not None:
+        # resampled whole, segment edges would otherwise see the filter transients
+        sources = [resample(source, kwargs.get("freq", FP_SPEC_FREQ), analysis_freq) for source in sources]
+        kwargs = _get_analysis_config(**kwargs)
+
+    window_sz = kwargs.get("window_sz", FP_SPEC_WIN_SIZE)
+    hop = window_sz - int(window_sz * kwargs.get("overlap_ratio", FP_SPEC_OVERLAP))
+    n_frames = (len(sources[0]) - window_sz) // hop + 1
+    if n_frames < n_segments:
+        return get_channel_peaks(channels, **{**config, "stats": stats})
+
+    # a peak budget is decided over whole time slices, segments and their context start on them
+    slice_frames = kwargs.get("budget_frames", FP_PEAK_BUDGET_FRAMES) \
+        if kwargs.get("peak_budget", FP_PEAK_BUDGET) is not None else 1
+    halo = kwargs.get("spec_win_size", FP_PEAK_WIN_SIZE) // 2
+    context = -(-halo // slice_frames) * slice_frames
+
+    n_slices = -(-n_frames // slice_frames)
+    bounds = np.minimum(np.linspace(0, n_slices, n_segments + 1).round().astype(int) * slice_frames, n_frames)
+
+    tasks, owners = [], []
+    for source_index, source in enumerate(sources):
+        for frame_from, frame_to in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            context_from = max(frame_from - context, 0)
+            context_to = min(frame_to + halo, n_frames)
+            data = source[context_from * hop: (context_to - 1) * hop + window_sz]
+            tasks.append((data, context_from, frame_from, frame_to, kwargs))
+            owners.append(source_index)
+
+    f = [[np.empty(0, dtype=np.int64)] for _ in sources]
+    t = [[np.empty(0, dtype=np.int64)] for _ in sources]
+    for source_index, (segment_f, segment_t, segment_stats) in zip(owners, pool.imap(_get_segment_peaks, tasks)):
+        f[source_index].append(segment_f)
+        t[source_index].append(segment_t)
+        if stats is not None:
+            for name, value in segment_stats.items():
+                stats[name] = stats.get(name, 0) + value
+
+    return [(np.concatenate(source_f), np.concatenate(source_t)) for source_f, source_t in zip(f, t)]
+
+def fingerprint_channels_segmented(
+    channels: List[np.ndarray], pool: Pool = None, n_workers: int = None, **kwargs
+) -> Fingerprints:
+    """
+    Fingerprints all the channels of a record like `fingerprint_channels`, long channels
+    being split into time segments on `pool`; the hashes are exactly the same.
+    :param channels: PCM samples of every channel, of equal length.
+    :param pool: process pool the segments are sent to, None fingerprints in this process.
+    :param n_workers: processes of `pool`.
+    :param kwargs: fingerprint configuration, as accepted by `fingerprint`.
+    :return: the unique (hash, offset) pairs of the record.
+    """
+    peaks = get_channel_peaks_segmented(channels, pool, n_workers, **kwargs)
+    return fingerprint_peaks(peaks, **kwargs)
@@ -0,0 +1,79 @@
+import numpy as np
+import scipy.signal as sgnl
+from math import gcd
+from typing import List, Tuple
+
+
+# samples converted to float64 at once while summing blocks
+ENERGY_CHUNK_SIZE = 2**20
+
+def frame_energies(data: np.ndarray, window_sz: int, hop: int) -> np.ndarray:
+    """
+    Energy of every spectrogram frame once its mean is removed, as the spectrogram
+    engines detrend it. Samples are summed in blocks of gcd(window_sz, hop) and
+    frames are assembled from whole blocks, so no long running sum loses precision.
+    :param data: PCM samples of a channel, or stacked channels along the first axis.
+    :param window_sz: frame length.
+    :param hop: distance between the starts of two frames.
+    :return: energies shaped (..., frames), as float64.
+    """
+    block = gcd(window_sz, hop)
+    n_blocks = data.shape[-1] // block
+
+    sums = np.empty(data.shape[:-1] + (n_blocks,))
+    squares = np.empty_like(sums)
+    chunk_blocks = max(ENERGY_CHUNK_SIZE // block, 1)
+    for start in range(0, n_blocks, chunk_blocks):
+        stop = min(start + chunk_blocks, n_blocks)
+        chunk = data[..., start * block: stop * block].astype(np.float64)
+        chunk = chunk.reshape(data.shape[:-1] + (stop - start, block))
+        sums[..., start:stop] = chunk.sum(axis=-1)
+        squares[..., start:stop] = np.einsum("...i,...i->...", chunk, chunk)
+
+    frame_blocks = window_sz // block
+    step = hop // block
+    frame_sums = np.lib.stride_tricks.sliding_window_view(sums, frame_blocks, axis=-1)[..., ::step, :].sum(axis=-1)
+    frame_squares = np.lib.stride_tricks.sliding_window_view(squares, frame_blocks, axis=-1)[..., ::step, :].sum(axis=-1)
+
+    return np.maximum(frame_squares - frame_sums ** 2 / window_sz, 0)
+
+def get_silent_frames(data: np.ndarray, window_sz: int, hop: int, threshold_db: float) -> np.ndarray:
+    """
+    Flags the frames where no bin of the hann-windowed, 'spectrum' scaled power spectrum
+    can exceed `threshold_db`. By Cauchy-Schwarz every bin is at most
+    2 * energy * sum(w^2) / sum(w)^2, so the test is exact rather than heuristic.
+    :param data: PCM samples of a channel, or stacked channels along the first axis.
+    :param threshold_db: level in dB no bin of a silent frame may exceed.
+    :return: a boolean array of frames, True where every channel is silent.
+    """
+    window = sgnl.get_window('hann', window_sz)
+    # a thousandth of margin covers the rounding of single precision engines
+    max_energy = 10 ** (threshold_db / 10) * window.sum() ** 2 / (2 * np.dot(window, window)) * 0.999
+
+    silent = frame_energies(data, window_sz, hop) <= max_energy
+    return silent.reshape(-1, silent.shape[-1]).all(axis=0)
+
+def get_active_spans(silent: np.ndarray, min_gap: int, align: int = 1) -> List[Tuple[int, int]]:
+    """
+    Groups the frames that must be analysed into spans.
+    Silent runs shorter than `min_gap` frames between two active frames stay inside a span.
+    :param silent: boolean array of silent frames.
+    :param min_gap: shortest silent run that separates two spans.
+    :param align: spans are widened to multiples of it.
+    :return: a list of [start, stop) frame spans.
+    """
+    active = np.flatnonzero(~silent)
+    if len(active) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(active) > min_gap)
+    starts = np.r_[active[0], active[breaks + 1]] // align * align
+    stops = np.minimum(-(-(np.r_[active[breaks], active[-1]] + 1) // align) * align, len(silent))
+
+    spans = []
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], stop)
+        else:
+            spans.append((start, stop))
+    return spans
@@ -0,0 +1,127 @@
+import scipy.fft as fft
+import scipy.signal as sgnl
+import numpy as np
+from functools import lru_cache
+
+from pyyaap.config.fingerprint import (
+    FP_SPEC_ENGINE, FP_SPEC_FREQ, FP_SPEC_OVERLAP, FP_SPEC_WIN_SIZE
+)
+
+
+class BaseSpectrogram:
+    """
+    Spectrogram engine: 'spectrum' scaled one-sided power, in dB, of
+    hann-windowed and mean-detrended frames, shaped (frequencies, frames).
+    Stacked channels, shaped (channels, samples), give (channels, frequencies, frames).
+    """
+    @classmethod
+    def compute(
+        cls, data: np.ndarray, window_sz: int = FP_SPEC_WIN_SIZE,
+        freq: int = FP_SPEC_FREQ, overlap_ratio: float = FP_SPEC_OVERLAP
+    ) -> np.ndarray:
+        raise NotImplementedError
+
+
+class ScipySpectrogram(BaseSpectrogram):
+    """
+    Reference engine built on `scipy.signal.spectrogram`.
+    """
+    @classmethod
+    def compute(
+        cls, data: np.ndarray, window_sz: int = FP_SPEC_WIN_SIZE,
+        freq: int = FP_SPEC_FREQ, overlap_ratio: float = FP_SPEC_OVERLAP
+    ) -> np.ndarray:
+        f, t, spectrum = sgnl.spectrogram(
+            data,
+            nperseg=window_sz, nfft=window_sz,fs=freq, window='hann',
+            noverlap=int(window_sz * overlap_ratio), mode='psd',
+            scaling='spectrum'
+        )
+        spectrum = 10 * np.log10(spectrum)
+        return spectrum
+
+
+@lru_cache(maxsize=None)
+def _get_hann_window(window_sz: int, dtype: np.dtype) -> np.ndarray:
+    window = sgnl.get_window('hann', window_sz).astype(dtype)
+    window.flags.writeable = False
+    return window
+
+@lru_cache(maxsize=None)
+def _get_power_scale(window_sz: int, dtype: np.dtype) -> np.ndarray:
+    # 'spectrum' scaling, doubled for all bins but DC (and Nyquist for even sizes)
+    scale = np.full(window_sz // 2 + 1, 2.0 / _get_hann_window(window_sz, np.float64).sum() ** 2)
+    scale[0] /= 2
+    if window_sz % 2 == 0:
+        scale[-1] /= 2
+
+    scale = scale.astype(dtype)
+    scale.flags.writeable = False
+    return scale
+
+
+class RFFTSpectrogram(BaseSpectrogram):
+    """
+    Real FFT over strided frames with a cached hann window, squaring and
+    logarithm done in place. Computes in `dtype` (float64 by default).
+    Signals shorter than a window go through `ScipySpectrogram`.
+    """
+    dtype = np.float64
+
+    @classmethod
+    def compute(
+        cls, data: np.ndarray, window_sz: int = FP_SPEC_WIN_SIZE,
+        freq: int = FP_SPEC_FREQ, overlap_ratio: float = FP_SPEC_OVERLAP
+    ) -> np.ndarray:
+        dtype = np.dtype(cls.dtype)
+        if data.shape[-1] < window_sz:
+            # scipy shrinks the window to the signal and zero-pads its single frame
+            return ScipySpectrogram.compute(data, window_sz, freq, overlap_ratio).astype(dtype, copy=False)
+
+        hop = window_sz - int(window_sz * overlap_ratio)
+
+        frames = np.lib.stride_tricks.sliding_window_view(data, window_sz, axis=-1)[..., ::hop, :]
+
+        # mean detrending allocates the only full-size real buffer
+        frames = frames - frames.mean(axis=-1, keepdims=True, dtype=dtype)
+        frames *= _get_hann_window(window_sz, dtype)
+
+        spectrum = fft.rfft(frames, axis=-1, overwrite_x=True)
+        del frames
+
+        # |X|^2 as re^2 + im^2 over the interleaved float view
+        interleaved = spectrum.view(dtype)
+        np.square(interleaved, out=interleaved)
+        power = interleaved[..., 0::2] + interleaved[..., 1::2]
+        del spectrum, interleaved
+
+        power *= _get_power_scale(window_sz, dtype)
+        np.log10(power, out=power)
+        power *= 10
+
+        return np.swapaxes(power, -1, -2)
+
+
+class RFFT32Spectrogram(RFFTSpectrogram):
+    """
+    Single precision variant of `RFFTSpectrogram`, halving memory traffic.
+    """
+    dtype = np.float32
+
+
+SPECTROGRAM_ENGINES = {
+    "scipy": ScipySpectrogram,
+    "rfft": RFFTSpectrogram,
+    "rfft32": RFFT32Spectrogram,
+}
+
+def get_spectrogram_engine(engine: str = FP_SPEC_ENGINE) -> BaseSpectrogram:
+    """
+    Given an engine name it returns the spectrogram engine registered under it.
+    :param engine: name of the engine, one of SPECTROGRAM_ENGINES.
+    :return: the spectrogram engine class.
+    """
+    try:
+        return SPECTROGRAM_ENGINES[engine]
+    except KeyError:
+        raise ValueError(f"Unsupported spectrogram engine supplied: {engine}")
@@ -0,0 +1,201 @@
+import numpy as np
+from typing import Iterator
+
+from pyyaap.config.fingerprint import (
+    FP_SPEC_WIN_SIZE, FP_SPEC_FREQ, FP_SPEC_OVERLAP, FP_ANALYSIS_FREQ,
+    FP_PEAK_WIN_SIZE, FP_N_NEIGHBOURS,
+    FP_PEAK_BUDGET, FP_PEAK_BUDGET_FRAMES,
+    FP_STREAM_BLOCK_FRAMES, FP_STREAM_PUSH_FRAMES,
+)
+from pyyaap.codec.decode.utils import resample
+from pyyaap.matching.signal.fingerprint import (
+    _get_analysis_config, _get_audio_spectrogram, _get_spectrogram_local_peaks,
+    _get_combinatorial_hash_arrays, fingerprint
+)
+from pyyaap.matching.signal.hashes import Fingerprints
+
+
+class StreamingFingerprinter:
+    """
+    Incremental fingerprinter for PCM that arrives in frames of arbitrary size.
+    Only the samples of the next spectrogram frame, the spectrogram columns inside
+    the peak-picking window and the peaks still waiting for their neighbours are
+    kept between pushes, so memory and per-push cost do not grow with the stream.
+    The hashes of a whole stream are exactly the ones of `fingerprint` over it.
+
+    # Use one instance per live feed
+    fingerprinter = StreamingFingerprinter(**config)
+    for frame in feed:
+        for hsh, offset in fingerprinter.push(frame):
+            ...
+    fingerprinter.flush()
+    """
+    def __init__(self, push_frames: int = FP_STREAM_PUSH_FRAMES, **kwargs):
+        """
+        :param push_frames: finalised spectrogram frames gathered before hashes are emitted,
+            trading latency for fewer peak-picking passes.
+        :param kwargs: fingerprint configuration, as accepted by `fingerprint`; with
+            `analysis_freq` set the pushed samples must already be at that framerate.
+        """
+        kwargs = _get_analysis_config(**kwargs)
+        self.config = kwargs
+        self.push_frames = max(push_frames, 1)
+
+        self.window_sz = kwargs.get("window_sz", FP_SPEC_WIN_SIZE)
+        self.hop = self.window_sz - int(self.window_sz * kwargs.get("overlap_ratio", FP_SPEC_OVERLAP))
+        # a local maximum depends on spec_win_size // 2 frames on each side
+        self.halo = kwargs.get("spec_win_size", FP_PEAK_WIN_SIZE) // 2
+        # peaks that still miss some of their neighbours are not used as anchors yet
+        self.n_carry = max(kwargs.get("n_neighbours", FP_N_NEIGHBOURS) - 1, 0)
+        # a peak budget is decided over whole time slices
+        self.slice_frames = 1
+        if kwargs.get("peak_budget", FP_PEAK_BUDGET) is not None:
+            self.slice_frames = kwargs.get("budget_frames", FP_PEAK_BUDGET_FRAMES)
+
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Drops the stream state, offsets of the next push start from zero again.
+        """
+        # samples not consumed by a spectrogram frame yet, starting at `_pcm_start`
+        self._pcm = None
+        self._pcm_start = 0
+        # spectrogram columns [_spec_start, _n_frames)
+        self._spectrogram = None
+        self._spec_start = 0
+        self._n_frames = 0
+        # frames whose peaks have already been decided
+        self._n_final = 0
+
+        self._carry_f = np.empty(0, dtype=np.int64)
+        self._carry_t = np.empty(0, dtype=np.int64)
+
+    @property
+    def latency(self) -> int:
+        """
+        Maximal delay, in spectrogram frames, between a frame being complete and its hashes being emitted.
+        """
+        return self.push_frames + self.halo + self.slice_frames - 1
+
+    def push(self, samples: np.ndarray) -> Fingerprints:
+        """
+        Feeds the next PCM samples of the stream.
+        :param samples: PCM samples of a single channel, of any length.
+        :return: the (hash, absolute offset) pairs that became final with these samples.
+        """
+        # copy, live sources often reuse their frame buffers; keep the dtype of
+        # the input as the spectrogram precision depends on it
+        self._pcm = np.array(samples) if self._pcm is None else np.concatenate([self._pcm, samples])
+
+        self._extend_spectrogram()
+
+        frame_to = (self._n_frames - self.halo) // self.slice_frames * self.slice_frames
+        if frame_to - self._n_final < self.push_frames:
+            return Fingerprints()
+
+        return self._emit(frame_to, final=False)
+
+    def flush(self) -> Fingerprints:
+        """
+        Ends the stream: the trailing frames are decided and every pending peak is paired.
+        :return: the remaining (hash, absolute offset) pairs.
+        """
+        if self._n_frames == 0 and self._pcm is not None and len(self._pcm):
+            # a stream shorter than a window has a single frame, over a window shrunk to it
+            self._spectrogram = _get_audio_spectrogram(self._pcm, **self.config)
+            self._n_frames = self._spectrogram.shape[1]
+
+        fingerprints = self._emit(self._n_frames, final=True)
+        self.reset()
+        return fingerprints
+
+    def _extend_spectrogram(self) -> None:
+        n_samples = self._pcm_start + len(self._pcm)
+        if n_samples < self.window_sz:
+            return
+
+        n_frames = (n_samples - self.window_sz) // self.hop + 1
+        if n_frames == self._n_frames:
+            return
+
+        block = self._pcm[
+            self._n_frames * self.hop - self._pcm_start: (n_frames - 1) * self.hop + self.window_sz - self._pcm_start
+        ]
+        columns = _get_audio_spectrogram(block, **self.config)
+
+        if self._spectrogram is None:
+            self._spectrogram = columns
+        else:
+            self._spectrogram = np.concatenate([self._spectrogram, columns], axis=1)
+        self._n_frames = n_frames
+
+        # the next frame starts at n_frames * hop, nothing before it is needed anymore
+        next_start = n_frames * self.hop
+        self._pcm = self._pcm[next_start - self._pcm_start:]
+        self._pcm_start = next_start
+
+    def _emit(self, frame_to: int, final: bool) -> Fingerprints:
+        f = np.empty(0, dtype=np.int64)
+        t = np.empty(0, dtype=np.int64)
+
+        if frame_to > self._n_final:
+            context_from = max(self._n_final - self.halo, self._spec_start)
+            spectrogram = self._spectrogram[:, context_from - self._spec_start:]
+
+            f, t = _get_spectrogram_local_peaks(
+                spectrogram, frame_offset=context_from, frame_range=(self._n_final, frame_to), **self.config
+            )
+
+            order = np.lexsort((f, t))
+            f, t = f[order], t[order]
+
+            self._n_final = frame_to
+
+            # keep the left context of the frames still to be decided
+            spec_start = max(frame_to - self.halo, self._spec_start)
+            self._spectrogram = self._spectrogram[:, spec_start - self._spec_start:]
+            self._spec_start = spec_start
+
+        f = np.concatenate([self._carry_f, f])
+        t = np.concatenate([self._carry_t, t])
+
+        n_anchors = len(t) if final else max(len(t) - self.n_carry, 0)
+        fingerprints = Fingerprints.from_arrays(
+            *_get_combinatorial_hash_arrays(f, t, n_anchors=n_anchors, **self.config)
+        )
+
+        self._carry_f, self._carry_t = f[n_anchors:], t[n_anchors:]
+
+        return fingerprints
+
+
+def iter_fingerprint(
+    data: np.ndarray, block_frames: int = FP_STREAM_BLOCK_FRAMES, **kwargs
+) -> Iterator[Fingerprints]:
+    """
+    Fingerprints a channel block by block, keeping memory bounded by the block size
+    rather than the channel duration. Blocks of `data` (e.g. a memory-mapped channel)
+    are only read when they are analysed.
+    Concatenating the yielded containers gives exactly the output of `fingerprint`.
+    :param data: PCM samples of a single channel.
+    :param block_frames: spectrogram frames analysed per block.
+    :return: an iterator of Fingerprints with absolute offsets.
+    """
+    analysis_freq = kwargs.get("analysis_freq", FP_ANALYSIS_FREQ)
+    if analysis_freq is not None:
+        data = resample(data, kwargs.get("freq", FP_SPEC_FREQ), analysis_freq)
+        kwargs = _get_analysis_config(**kwargs)
+
+    if len(data) < kwargs.get("window_sz", FP_SPEC_WIN_SIZE):
+        # scipy shrinks the window to the signal length, nothing to stream
+        yield fingerprint(data, **kwargs)
+        return
+
+    fingerprinter = StreamingFingerprinter(push_frames=block_frames, **kwargs)
+    block_samples = block_frames * fingerprinter.hop
+
+    for index in range(0, len(data), block_samples):
+        yield fingerprinter.push(data[index: index + block_samples])
+
+    yield fingerprinter.flush()
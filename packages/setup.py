@@ -12,9 +12,14 @@ setup(
         "numpy",
         "wave",
         "scipy",
-        "opencv-python",
         "pydub",
         "psycopg2-binary"
     ],
+    extras_require={
+        # faster peak picking, a NumPy fallback is used without it
+        "cv2": ["opencv-python"],
+        # AsyncPostgreSQLDatabase, for asyncio services
+        "asyncpg": ["asyncpg"],
+    },
 )
 